@@ -0,0 +1,63 @@
+"""Benchmark the gc_mode option of Pickler and Unpickler on large graphs.
+
+Dumps and loads lists of small records, each holding a dict, a list and
+a tuple, with the cyclic garbage collector left alone, disabled during
+the operation (gc_mode="disable") and, for loading, also frozen
+afterwards (gc_mode="freeze"), and prints the timings, along with that
+of a full collection run while the loaded result is alive.
+
+    python bench_gc_mode.py [records]
+"""
+import sys
+import gc
+import importlib.util
+import io
+import time
+
+sys.modules['_pickle'] = None
+if 'pickle' in sys.modules:
+    del sys.modules['pickle']
+spec = importlib.util.spec_from_file_location("pickle",
+                                              "./std_pickle/pickle.py")
+pickle = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pickle)
+
+
+def records(n):
+    return [{"id": i, "tags": [str(i % 100), i], "pos": (i, -i)}
+            for i in range(n)]
+
+
+def timed(func):
+    # Time one call, starting from a fully collected heap.
+    gc.collect()
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    obj = records(n)
+    data = pickle._dumps(obj, 4)
+    print("%-10s %10s %10s %12s" %
+          ("gc_mode", "dump (s)", "load (s)", "collect (s)"))
+    for mode in (None, "disable", "freeze"):
+        if mode == "freeze":
+            dump = "%10s" % "-"
+        else:
+            dump_time, _ = timed(lambda: pickle._dumps(obj, 4, gc_mode=mode))
+            dump = "%10.3f" % dump_time
+        load_time, result = timed(lambda: pickle._loads(data, gc_mode=mode))
+        assert result == obj
+        start = time.perf_counter()
+        gc.collect()
+        collect_time = time.perf_counter() - start
+        del result
+        gc.unfreeze()
+        print("%-10s %s %10.3f %12.3f" %
+              (mode, dump, load_time, collect_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Benchmark the lazy_size option of Unpickler on plain dicts and lists.
+
+Pickles a dict holding a small header and a long list of small records,
+and one holding a hundredth as many records each larger than lazy_size,
+then times loading each whole, reading the header, one record, 1% of the
+records and every record through the LazyDict and LazyList proxies, and
+prints the best of three timings along with the number of pickle
+fragments each lazy read loaded.  Small records are loaded together, so
+that reading one of them costs about as much as reading all; large
+records are proxies, so that reading 1% of them costs a fraction of a
+full load.
+
+    python bench_lazy_size.py [records] [lazy_size]
+"""
+import sys
+import importlib.util
+import io
+import time
+
+sys.modules['_pickle'] = None
+if 'pickle' in sys.modules:
+    del sys.modules['pickle']
+spec = importlib.util.spec_from_file_location("pickle",
+                                              "./std_pickle/pickle.py")
+pickle = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pickle)
+
+
+def table(n):
+    return {"meta": {"version": 3, "records": n},
+            "rows": [{"id": i, "name": "n%d" % i, "vals": [i, i * 0.5]}
+                     for i in range(n)]}
+
+
+def wide_table(n, lazy_size):
+    # Each record holds about lazy_size / 8 floats, pickled as 9 bytes each.
+    k = lazy_size // 8 + 16
+    return {"meta": {"version": 3, "records": n},
+            "rows": [{"id": i, "name": "n%d" % i,
+                      "vals": [i + j * 0.5 for j in range(k)]}
+                     for i in range(n)]}
+
+
+def counted_loads(data, lazy_size, read):
+    # Load data with a lazy_size, pass the result to read and return
+    # what it returns and the number of fragments loaded.
+    fragments = 0
+    unpickler = pickle._Unpickler(io.BytesIO(data), lazy_size=lazy_size)
+    load_fragment = unpickler._load_fragment
+
+    def count(fragment):
+        nonlocal fragments
+        fragments += 1
+        return load_fragment(fragment)
+    unpickler._load_fragment = count
+    # As loads() does, leave the file where the pickle starts.
+    return read(unpickler._load(False)), fragments
+
+
+def timed(func, repeat=3):
+    # Return the best time of repeat calls of func, and what it returned.
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lazy_size = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    for title, obj in (("%d small records" % n, table(n)),
+                       ("%d large records" % (n // 100),
+                        wide_table(n // 100, lazy_size))):
+        rows = len(obj["rows"])
+        data = pickle._dumps(obj, 4)
+        reads = [
+            ("header", lambda value: value["meta"]["version"]),
+            ("one record", lambda value: value["rows"][rows // 2]["vals"][1]),
+            ("1% records", lambda value: sum(value["rows"][i]["vals"][1]
+                                             for i in range(0, rows, 100))),
+            ("all records", lambda value: sum(row["vals"][1]
+                                              for row in value["rows"])),
+        ]
+        print("%s, %d bytes" % (title, len(data)))
+        print("%-12s %10s %10s" % ("read", "time (s)", "fragments"))
+        load_time, result = timed(lambda: pickle._loads(data))
+        assert result == obj
+        print("%-12s %10.3f %10s" % ("full load", load_time, "-"))
+        for name, read in reads:
+            read_time, (value, fragments) = timed(
+                lambda: counted_loads(data, lazy_size, read))
+            assert value == read(obj)
+            print("%-12s %10.3f %10d" % (name, read_time, fragments))
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Benchmark loads_data() against Unpickler.load().
+
+Loads the data sets generated by black_box_test/python_version_test.py,
+and larger lists of similar records, with both loaders of the vendored
+pure-Python pickle module, checks that they give the same result and
+prints the timings.
+
+    python bench_loads_data.py [repeat]
+"""
+import sys
+import importlib.util
+import io
+import os
+import timeit
+
+sys.modules['_pickle'] = None
+if 'pickle' in sys.modules:
+    del sys.modules['pickle']
+spec = importlib.util.spec_from_file_location("pickle",
+                                              "./std_pickle/pickle.py")
+pickle = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pickle)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "..", "black_box_test"))
+from python_version_test import generate_test_data
+
+
+def payloads():
+    cases = generate_test_data()
+    for case in cases:
+        yield case['description'], case['data'], 1000
+    records = [dict(case['data'], id=i, tags=[str(i), (i, -i)])
+               for i in range(500) for case in cases]
+    yield "records x1500", records, 10
+
+
+def load(data):
+    return pickle._Unpickler(io.BytesIO(data)).load()
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print("%-40s %6s %10s %10s %8s" %
+          ("payload", "proto", "load (s)", "data (s)", "speedup"))
+    for name, obj, number in payloads():
+        for proto in (2, pickle.HIGHEST_PROTOCOL):
+            data = pickle.dumps(obj, proto)
+            if pickle.loads_data(data) != load(data):
+                raise AssertionError("results differ for %s" % name)
+            times = []
+            for func in (load, pickle.loads_data):
+                times.append(min(timeit.repeat(lambda: func(data),
+                                               number=number,
+                                               repeat=repeat)))
+            print("%-40s %6d %10.4f %10.4f %7.2fx" %
+                  (name[:40], proto, times[0], times[1],
+                   times[0] / times[1]))
+
+
+if __name__ == "__main__":
+    main()
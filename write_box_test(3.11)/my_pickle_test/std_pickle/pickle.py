@@ -23,21 +23,35 @@ Misc variables:
 
 """
 
-from types import FunctionType
+from types import (FunctionType, MethodType, BuiltinFunctionType,
+                   ModuleType)
 from copyreg import dispatch_table
 from copyreg import _extension_registry, _inverted_registry, _extension_cache
-from itertools import islice
-from functools import partial
+from collections import deque, namedtuple, OrderedDict, defaultdict, Counter
+from collections.abc import MutableMapping, MutableSequence
+from itertools import islice, count
+from functools import partial, lru_cache
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from weakref import WeakKeyDictionary, ref
+from _thread import RLock
 import sys
+import gc
+import os
 from sys import maxsize
-from struct import pack, unpack
+from struct import (pack, unpack, unpack_from, calcsize, Struct,
+                    error as struct_error)
 import re
 import io
 import codecs
 import _compat_pickle
 
 __all__ = ["PickleError", "PicklingError", "UnpicklingError", "Pickler",
-           "Unpickler", "dump", "dumps", "load", "loads"]
+           "Unpickler", "dump", "dumps", "load", "loads", "dumps_data",
+           "loads_data", "DataPlanCache", "register_layout",
+           "unregister_layout",
+           "prefetch_globals", "PickleLog", "scan", "PickleScan",
+           "PickleSpan", "PickleIndex", "LazyDict", "LazyList"]
 
 try:
     from _pickle import PickleBuffer
@@ -50,6 +64,14 @@ except ImportError:
 # Shortcut for use in isinstance testing
 bytes_types = (bytes, bytearray)
 
+# Containers that _batch_appends() and _batch_setitems() may iterate
+# directly, without an islice() copy, when they fit in a single batch.
+_sized_list_types = (list, deque)
+_sized_items_types = (type({}.items()), type(OrderedDict().items()))
+
+# Mappings whose SETITEMS batches can be applied with a single update().
+_plain_mapping_types = (dict, OrderedDict, defaultdict)
+
 # These are purely informational; no code uses these.
 format_version = "4.0"                  # File format version we write
 compatible_formats = ["1.0",            # Original protocol 0
@@ -98,6 +120,10 @@ class _Stop(Exception):
     def __init__(self, value):
         self.value = value
 
+# Returned instead of the result by the main loops of load() run for
+# iter_load(), when items have been appended to the top-level list.
+_APPENDED = object()
+
 # Jython has PyStringMap; it's a dict subclass with string keys
 try:
     from org.python.core import PyStringMap
@@ -258,6 +284,124 @@ class _Framer:
         write(payload)
 
 
+class _IndexFramer(_Framer):
+    # The framer of Picklers created with an index_file, which keeps count
+    # of the bytes written.  Offsets are taken without the FRAME opcodes,
+    # which are only written once a frame is committed, and the offsets of
+    # the frames are kept in the same terms to fix them up afterwards.
+
+    def __init__(self, file_write):
+        super().__init__(self._write)
+        self._file_write = file_write
+        self.written = 0
+        self.frames = []
+
+    def _write(self, data):
+        # commit_frame() writes each FRAME opcode on its own.  No other
+        # write of 9 bytes starts with one: frames do not, and the
+        # payloads written on their own are 64 KiB or more.
+        n = len(data)
+        if n == 9 and data[0] == 0x95:
+            self.frames.append(self.written - 9 * len(self.frames))
+        self.written += n
+        return self._file_write(data)
+
+    def tell(self):
+        # Return the offset of the next byte written, not counting FRAME
+        # opcodes.
+        offset = self.written - 9 * len(self.frames)
+        if self.current_frame:
+            offset += self.current_frame.tell()
+        return offset
+
+    def offset(self, pos, end=False):
+        # Return the offset in the output of pos, as returned by tell();
+        # for an end, before the FRAME opcode of a frame starting there.
+        frames = self.frames
+        if end:
+            return pos + 9 * bisect_left(frames, pos)
+        return pos + 9 * bisect_right(frames, pos)
+
+class _Indexer:
+    # Records where each item of the dict or list at the root of a pickle
+    # is, for the index of Picklers created with an index_file.  The keys
+    # and values of a dict are recorded as separate items, each with its
+    # byte range, the number of memo entries defined before it and the
+    # memo keys it reads from outside of itself, which for item i are
+    # deps[dep_starts[i]:dep_starts[i + 1]].  The GETs are seen by hooking
+    # the get() method of the pickler.
+
+    def __init__(self, pickler):
+        self.pickler = pickler
+        self.framer = framer = pickler.framer
+        framer.written = 0
+        del framer.frames[:]
+        self.memo_base = len(pickler.memo)
+        self.kind = None
+        self.keys = None
+        self.spans = array('Q')
+        self.memo_starts = array('Q')
+        self.dep_starts = array('Q', [0])
+        self.deps = array('Q')
+        self.refs = []
+        self._get = pickler.get
+        pickler.get = self.get
+
+    def close(self):
+        del self.pickler.get
+
+    def get(self, i):
+        self.refs.append(i)
+        return self._get(i)
+
+    def start(self, kind):
+        # Called once the root of kind "dict" or "list" is written.
+        self.kind = kind
+        if kind == "dict":
+            self.keys = []
+
+    def save(self, obj):
+        # Save a key or a value of the root.
+        pickler = self.pickler
+        memo = pickler.memo
+        refs = self.refs
+        tell = self.framer.tell
+        n = len(refs)
+        i = len(self.memo_starts)
+        if self.keys is not None and not i & 1:
+            self.keys.append(obj)
+        memo_start = len(memo)
+        start = tell()
+        pickler.save(obj)
+        self.spans.append(start)
+        self.spans.append(tell())
+        self.memo_starts.append(memo_start)
+        if len(refs) > n:
+            memo_end = len(memo)
+            self.deps.extend(sorted({key for key in refs[n:]
+                                     if not memo_start <= key < memo_end}))
+            del refs[n:]
+        self.dep_starts.append(len(self.deps))
+
+    def index(self):
+        # Return the index of the pickle written, as the dict PickleIndex
+        # reads.
+        pickler = self.pickler
+        offset = self.framer.offset
+        spans = self.spans
+        for i in range(0, len(spans), 2):
+            spans[i] = offset(spans[i])
+            spans[i + 1] = offset(spans[i + 1], True)
+        memo_starts = self.memo_starts
+        memo_starts.append(len(pickler.memo))
+        return {"kind": self.kind, "proto": pickler.proto,
+                "size": self.framer.written,
+                "memo": None if pickler.fast else self.memo_base,
+                "keys": self.keys, "spans": spans,
+                "memo_starts": memo_starts, "dep_starts": self.dep_starts,
+                "deps": self.deps}
+
+
 class _Unframer:
 
     def __init__(self, file_read, file_readline, file_tell=None):
@@ -315,6 +459,39 @@ def _getattribute(obj, name):
                                  .format(name, obj)) from None
     return obj, parent
 
+# Cache for _Pickler.save_global(), mapping obj to a dict that maps the
+# name it was saved with to (module_name, name, parent, lastname,
+# toplevel), where parent is a weak reference and toplevel tells whether
+# it is the module.  Nothing in it keeps obj alive, so functions
+# and classes created at run time can be freed; objects that cannot be
+# weakly referenced are not cached.
+_global_names = WeakKeyDictionary()
+_GLOBAL_NAMES_MAX = 10000
+
+def _lookup_global(obj, name):
+    # Return (module_name, name, module, parent) for a global reference
+    # to obj, or raise PicklingError.
+    if name is None:
+        name = getattr(obj, '__qualname__', None)
+    if name is None:
+        name = obj.__name__
+
+    module_name = whichmodule(obj, name)
+    try:
+        __import__(module_name, level=0)
+        module = sys.modules[module_name]
+        obj2, parent = _getattribute(module, name)
+    except (ImportError, KeyError, AttributeError):
+        raise PicklingError(
+            "Can't pickle %r: it's not found as %s.%s" %
+            (obj, module_name, name)) from None
+    else:
+        if obj2 is not obj:
+            raise PicklingError(
+                "Can't pickle %r: it's not the same object as %s.%s" %
+                (obj, module_name, name))
+    return module_name, name, module, parent
+
 def whichmodule(obj, name):
     """Find the module an object belong to."""
     module_name = getattr(obj, '__module__', None)
@@ -385,12 +562,373 @@ def decode_long(data):
     return int.from_bytes(data, byteorder='little', signed=True)
 
 
+# Opt-in support for standard library value types (stdlib_types=True).
+# The modules involved are imported on first use, so that ordinary
+# pickling does not pay for them.
+
+_stdlib_save_table = None
+_stdlib_reduce_hooks = None
+_EnumType = None
+
+def _init_stdlib_types():
+    global _stdlib_save_table, _stdlib_reduce_hooks, _EnumType
+    import datetime
+    import decimal
+    import enum
+    import fractions
+    import uuid
+    from math import gcd
+
+    def load_uuid(cls, args):
+        if (len(args) == 2 and args[0] is None and
+                type(args[1]) is bytes and len(args[1]) == 16):
+            # Skip UUID.__init__() argument validation.
+            value = object.__new__(cls)
+            object.__setattr__(value, 'int', int.from_bytes(args[1], 'big'))
+            object.__setattr__(value, 'is_safe', uuid.SafeUUID.unknown)
+            return value
+        return cls(*args)
+
+    def load_fraction(cls, args):
+        if len(args) == 2:
+            numerator, denominator = args
+            if (type(numerator) is int and type(denominator) is int and
+                    denominator > 0 and gcd(numerator, denominator) == 1):
+                # Already normalized; skip Fraction.__new__().
+                value = object.__new__(cls)
+                value._numerator = numerator
+                value._denominator = denominator
+                return value
+        return cls(*args)
+
+    _stdlib_save_table = {
+        datetime.datetime: _Pickler.save_datetime,
+        datetime.date: _Pickler.save_datetime,
+        datetime.time: _Pickler.save_datetime,
+        datetime.timedelta: _Pickler.save_timedelta,
+        decimal.Decimal: _Pickler.save_decimal,
+        uuid.UUID: _Pickler.save_uuid,
+        fractions.Fraction: _Pickler.save_fraction,
+    }
+    _stdlib_reduce_hooks = {
+        id(uuid.UUID): load_uuid,
+        id(fractions.Fraction): load_fraction,
+    }
+    _EnumType = enum.EnumMeta
+
+def _stdlib_save_dispatch():
+    if _stdlib_save_table is None:
+        _init_stdlib_types()
+    return _stdlib_save_table
+
+# Per-class handlers for plain namedtuples and dataclasses, or None for
+# other classes.  Filled in lazily by _Pickler.save(); weak, so that
+# classes created at run time can still be freed.
+_record_handlers = WeakKeyDictionary()
+
+_namedtuple_getnewargs = namedtuple('_', '').__getnewargs__.__code__
+_plain_instance_size = type('_', (), {}).__basicsize__
+
+def _record_handler(t):
+    # Only classes whose instances object.__reduce_ex__() reduces to
+    # copyreg.__newobj__(cls, *args) with at most a __dict__ state qualify.
+    if (t.__reduce_ex__ is not object.__reduce_ex__ or
+            t.__reduce__ is not object.__reduce__ or
+            t.__getstate__ is not object.__getstate__ or
+            hasattr(t, '__getnewargs_ex__')):
+        return None
+    if issubclass(t, tuple):
+        getnewargs = getattr(t, '__getnewargs__', None)
+        if (getattr(getnewargs, '__code__', None) is _namedtuple_getnewargs
+                and t.__basicsize__ == tuple.__basicsize__
+                and not t.__dictoffset__):
+            return _Pickler.save_namedtuple
+    elif hasattr(t, '__dataclass_fields__'):
+        if (not hasattr(t, '__getnewargs__') and
+                t.__basicsize__ == _plain_instance_size and
+                not any('__slots__' in c.__dict__ for c in t.__mro__)):
+            return _Pickler.save_dataclass
+    return None
+
+def _stdlib_subclass_handler(t):
+    # Return the handler for an Enum or PurePath subclass, or None.
+    from enum import Enum
+    from pathlib import PurePath
+    if issubclass(t, Enum):
+        if t.__reduce_ex__ is Enum.__reduce_ex__:
+            return _Pickler.save_enum
+    elif issubclass(t, PurePath):
+        if t.__reduce__ is PurePath.__reduce__:
+            return _Pickler.save_purepath
+    return None
+
+def _load_enum(cls, args):
+    if len(args) == 1:
+        try:
+            return cls._value2member_map_[args[0]]
+        except (KeyError, TypeError):
+            pass
+    return cls(*args)
+
+# Specialized handlers for classes registered with register_layout().
+# _layout_builders maps each class to the function that applies a BUILD
+# state to a new instance; its pickler is in _Pickler.dispatch.
+_layout_builders = {}
+
+# Pickler classes mapped to whether they neither define persistent_id()
+# nor reducer_override(), so that layout picklers may write field values
+# without going through save().
+_plain_picklers = {}
+
+def _plain_pickler(pickler):
+    # Whether neither pickler nor its class define persistent_id() or
+    # reducer_override().
+    attrs = pickler.__dict__
+    if 'persistent_id' in attrs or 'reducer_override' in attrs:
+        return False
+    cls = type(pickler)
+    plain = _plain_picklers.get(cls)
+    if plain is None:
+        plain = _plain_picklers[cls] = (
+            cls.persistent_id is _Pickler.persistent_id and
+            not hasattr(cls, 'reducer_override'))
+    return plain
+
+def _layout_fields(cls):
+    # Field names and types of a dataclass, or else the annotations of cls
+    # and its bases.
+    if hasattr(cls, '__dataclass_fields__'):
+        from dataclasses import fields
+        return {f.name: f.type for f in fields(cls)}
+    annotations = {}
+    for c in reversed(cls.__mro__):
+        annotations.update(c.__dict__.get('__annotations__', {}))
+    return annotations
+
+# Source templates for the value of a field of a registered class, by the
+# field type, writing the value held in the variable {v}.  All of them write
+# what save() would, and hand other values to save().
+_LAYOUT_SAVE_ATOM = {
+    int: """\
+if type({v}) is int and -0x80000000 <= {v} <= 0x7fffffff:
+    if 0 <= {v} <= 0xff:
+        write(_DATA_BININT1[{v}])
+    elif 0 <= {v} <= 0xffff:
+        write(BININT2 + pack("<H", {v}))
+    else:
+        write(BININT + pack("<i", {v}))
+else:
+    save({v})
+""",
+    float: """\
+if type({v}) is float:
+    write(BINFLOAT + pack('>d', {v}))
+else:
+    save({v})
+""",
+    bool: """\
+if {v} is True:
+    write(NEWTRUE)
+elif {v} is False:
+    write(NEWFALSE)
+else:
+    save({v})
+""",
+    type(None): """\
+if {v} is None:
+    write(NONE)
+else:
+    save({v})
+""",
+    str: """\
+if type({v}) is str:
+    x = memo.get(id({v}))
+    if x is not None:
+        write(get(x[0]))
+    else:
+        encoded = {v}.encode('utf-8', 'surrogatepass')
+        n = len(encoded)
+        if n <= 0xff:
+            write(_DATA_SHORT_BINUNICODE[n] + encoded + MEMOIZE)
+            memo[id({v})] = len(memo), {v}
+        else:
+            save({v})
+else:
+    save({v})
+""",
+    bytes: """\
+if type({v}) is bytes and len({v}) <= 0xff:
+    x = memo.get(id({v}))
+    if x is not None:
+        write(get(x[0]))
+    else:
+        write(SHORT_BINBYTES + pack("<B", len({v})) + {v} + MEMOIZE)
+        memo[id({v})] = len(memo), {v}
+else:
+    save({v})
+""",
+}
+
+_LAYOUT_SAVE = """\
+def save_layout(self, obj):
+    if self._save_by_table(obj):
+        return
+    state = obj.__dict__
+    memo = self.memo
+    if (type(state) is not dict or tuple(state) != fields or
+            self.proto < 4 or self.fast or id(state) in memo or
+            not _plain_pickler(self)):
+        self.save_reduce(obj=obj, *obj.__reduce_ex__(self.proto))
+        return
+    %(keys)s = state
+    %(values)s = state.values()
+    save = self.save
+    write = self.write
+    get = self.get
+    x = memo.get(id(cls))
+    if x is not None:
+        write(get(x[0]))
+    else:
+        save(cls)
+    memo[id(obj)] = len(memo), obj
+    write(%(header)r)
+    memo[id(state)] = len(memo), state
+%(items)s\
+    write(%(trailer)r)
+"""
+
+_LAYOUT_SAVE_KEY = """\
+x = memo.get(id(%(k)s))
+if x is not None:
+    write(get(x[0]))
+else:
+    write(%(encoded)r)
+    memo[id(%(k)s)] = len(memo), %(k)s
+"""
+
+_LAYOUT_BUILD = """\
+def build_layout(inst, state):
+    if type(state) is not dict or len(state) != %(n)d:
+        return False
+    try:
+%(gets)s\
+    except KeyError:
+        return False
+    inst_dict = inst.__dict__
+%(sets)s\
+    return True
+"""
+
+# The globals the generated code reads besides those register_layout()
+# passes itself.
+_LAYOUT_NAMES = ('BINFLOAT', 'BININT', 'BININT2', 'MEMOIZE', 'NEWFALSE',
+                 'NEWTRUE', 'NONE', 'SHORT_BINBYTES', '_DATA_BININT1',
+                 '_DATA_SHORT_BINUNICODE', '_plain_pickler', 'pack')
+
+def _indent(source, level):
+    return "".join(" " * level + line + "\n" for line in source.splitlines())
+
+def register_layout(cls, fields=None):
+    """Generate a specialized pickler and unpickler handler for cls.
+
+    cls must be a plain class whose instances keep their attributes in
+    their __dict__ and are pickled by object.__reduce_ex__(), without
+    __slots__, __getnewargs__(), __getstate__() or __setstate__().
+
+    *fields* maps the attribute names of the instances to their expected
+    types, in the order the attributes are set; by default these are the
+    fields of a dataclass or else the class annotations.  A sequence of
+    names is taken to mean fields of any type.
+
+    With protocol 4 and higher, instances whose __dict__ has exactly
+    these names in this order are then written by a function generated
+    for cls, which writes ints, floats, bools, None, short strs and short
+    bytes of the expected types without going through save().  When
+    loading, their state is applied by a function generated for cls as
+    well.  The pickles are those dumps() would write otherwise, up to
+    where frames end, and can be read by any unpickler.  Picklers with a
+    persistent_id() or reducer_override() still see every field value,
+    and a reducer for cls in a dispatch table takes precedence.
+
+    The handlers are used by every pickler and unpickler of the process
+    until unregister_layout() is called; registering cls again replaces
+    them.
+    """
+    if not isinstance(cls, type):
+        raise TypeError("register_layout() argument must be a class, not %r"
+                        % (type(cls).__name__,))
+    if (cls.__reduce_ex__ is not object.__reduce_ex__ or
+            cls.__reduce__ is not object.__reduce__ or
+            cls.__getstate__ is not object.__getstate__ or
+            hasattr(cls, '__setstate__') or
+            hasattr(cls, '__getattr__') or
+            cls.__getattribute__ is not object.__getattribute__ or
+            hasattr(cls, '__getnewargs_ex__') or
+            hasattr(cls, '__getnewargs__') or
+            cls.__basicsize__ != _plain_instance_size or
+            any('__slots__' in c.__dict__ for c in cls.__mro__)):
+        raise TypeError("can't register a layout for %s: its instances are "
+                        "not pickled as their __dict__" % cls.__qualname__)
+    if fields is None:
+        fields = _layout_fields(cls)
+    if not isinstance(fields, dict):
+        fields = dict.fromkeys(fields, object)
+    names = tuple(fields)
+    if not all(type(name) is str for name in names):
+        raise TypeError("field names must be str")
+    if not names or len(names) > _Pickler._BATCHSIZE:
+        raise ValueError("a layout needs 1 to %d fields" %
+                         _Pickler._BATCHSIZE)
+
+    items = []
+    for i, (name, t) in enumerate(fields.items()):
+        encoded = name.encode('utf-8', 'surrogatepass')
+        if len(encoded) <= 0xff:
+            encoded = SHORT_BINUNICODE + pack("<B", len(encoded)) + encoded
+        else:
+            encoded = BINUNICODE + pack("<I", len(encoded)) + encoded
+        items.append(_LAYOUT_SAVE_KEY % {'k': 'k%d' % i,
+                                         'encoded': encoded + MEMOIZE})
+        atom = _LAYOUT_SAVE_ATOM.get(t, "save({v})\n")
+        items.append(atom.format(v="v%d" % i))
+    many = len(names) > 1
+    source = _LAYOUT_SAVE % {
+        'keys': "".join("k%d, " % i for i in range(len(names))),
+        'values': "".join("v%d, " % i for i in range(len(names))),
+        'header': (EMPTY_TUPLE + NEWOBJ + MEMOIZE + EMPTY_DICT + MEMOIZE +
+                   (MARK if many else b'')),
+        'trailer': (SETITEMS if many else SETITEM) + BUILD,
+        'items': _indent("".join(items), 4),
+    }
+    source += _LAYOUT_BUILD % {
+        'n': len(names),
+        'gets': "".join("        v%d = state[%r]\n" % (i, name)
+                        for i, name in enumerate(names)),
+        'sets': "".join("    inst_dict[%r] = v%d\n" % (name, i)
+                        for i, name in enumerate(names)),
+    }
+    module = globals()
+    namespace = {name: module[name] for name in _LAYOUT_NAMES}
+    namespace.update(cls=cls, fields=names)
+    exec(source, namespace)
+    _Pickler.dispatch[cls] = namespace['save_layout']
+    _layout_builders[cls] = namespace['build_layout']
+
+def unregister_layout(cls):
+    """Remove the handlers register_layout() generated for cls."""
+    if cls not in _layout_builders:
+        raise ValueError("no layout is registered for %r" % (cls,))
+    del _layout_builders[cls]
+    del _Pickler.dispatch[cls]
+
+
 # Pickling machinery
 
 class _Pickler:
 
     def __init__(self, file, protocol=None, *, fix_imports=True,
-                 buffer_callback=None):
+                 buffer_callback=None, stdlib_types=False, gc_mode=None,
+                 index_file=None):
         """This takes a binary file for writing a pickle data stream.
 
         The optional *protocol* argument tells the pickler to use the
@@ -423,6 +961,25 @@ class _Pickler:
 
         It is an error if *buffer_callback* is not None and *protocol*
         is None or smaller than 5.
+
+        If *stdlib_types* is true, instances of datetime, date, time,
+        timedelta, Decimal, UUID, Fraction, Enum members and PurePath are
+        written by dedicated handlers instead of the generic __reduce_ex__()
+        machinery.  The output can be read by any unpickler.
+
+        If *gc_mode* is "disable", the cyclic garbage collector is disabled
+        while dump() runs, instead of being triggered over and over by the
+        memo entries; it is enabled again afterwards if it was enabled.
+        This affects the whole process.
+
+        If *index_file* is given, it must have a write() method like
+        *file*, and dump() only accepts a dict or a list.  After each
+        pickle, a pickled index of it is written to *index_file*, which
+        tells where each key and item of the root is in the pickle and
+        which memo entries it reads from elsewhere, so that PickleIndex
+        can load one of them without the rest.  dump_iter() and
+        dump_items() write an index as well.  The pickles are the same as
+        without an index.
         """
         if protocol is None:
             protocol = DEFAULT_PROTOCOL
@@ -437,7 +994,14 @@ class _Pickler:
             self._file_write = file.write
         except AttributeError:
             raise TypeError("file must have a 'write' attribute")
-        self.framer = _Framer(self._file_write)
+        if index_file is None:
+            self.framer = _Framer(self._file_write)
+        else:
+            if not hasattr(index_file, 'write'):
+                raise TypeError("index_file must have a 'write' attribute")
+            self.framer = _IndexFramer(self._file_write)
+        self._index_file = index_file
+        self._indexer = None
         self.write = self.framer.write
         self._write_large_bytes = self.framer.write_large_bytes
         self.memo = {}
@@ -445,6 +1009,14 @@ class _Pickler:
         self.bin = protocol >= 1
         self.fast = 0
         self.fix_imports = fix_imports and protocol < 3
+        self._stdlib_types = stdlib_types
+        if gc_mode not in (None, "disable"):
+            raise ValueError("gc_mode must be None or 'disable', not %r" %
+                             (gc_mode,))
+        self._gc_mode = gc_mode
+        if stdlib_types:
+            self.dispatch = dict(self.dispatch)
+            self.dispatch.update(_stdlib_save_dispatch())
 
     def clear_memo(self):
         """Clears the pickler's "memo".
@@ -458,18 +1030,115 @@ class _Pickler:
 
     def dump(self, obj):
         """Write a pickled representation of obj to the open file."""
+        if self._index_file is None:
+            self._dump(self.save, obj)
+            return
+        # The root is written by _save_root() instead of save(), which
+        # would not tell where its items are: check that save() would
+        # write it as a dict or list.
+        t = type(obj)
+        reduce = getattr(self, "reducer_override", None)
+        if (t is not dict and t is not list or
+                self.dispatch.get(t) is not _Pickler.dispatch[t] or
+                id(obj) in self.memo or
+                self.persistent_id(obj) is not None or
+                reduce is not None and reduce(obj) is not NotImplemented):
+            raise PicklingError("a Pickler with an index_file can only "
+                                "pickle a dict or list, not %r object" %
+                                (t.__name__,))
+        self._dump(self._save_root, obj)
+
+    def dump_iter(self, iterable):
+        """Write the items of iterable to the open file as a pickled list.
+
+        The pickle is the same as that of dump(list(iterable)), but items
+        are pickled as the iterable produces them, in batches of 1000, so
+        the list is never built.  Items kept in the memo, to be referenced
+        again, stay alive until the memo is cleared.
+        """
+        self._dump(self._save_iter, iterable)
+
+    def dump_items(self, items):
+        """Write (key, value) pairs to the open file as a pickled dict.
+
+        The pickle is the same as that of dump(dict(items)) when the keys
+        are distinct, but pairs are pickled as *items* produces them, in
+        batches of 1000, so the dict is never built.  A key that occurs
+        more than once is loaded with its last value.
+        """
+        self._dump(self._save_items, items)
+
+    def _dump(self, save, obj):
         # Check whether Pickler was initialized correctly. This is
         # only needed to mimic the behavior of _pickle.Pickler.dump().
         if not hasattr(self, "_file_write"):
             raise PicklingError("Pickler.__init__() was not called by "
                                 "%s.__init__()" % (self.__class__.__name__,))
-        if self.proto >= 2:
-            self.write(PROTO + pack("<B", self.proto))
-        if self.proto >= 4:
-            self.framer.start_framing()
-        self.save(obj)
-        self.write(STOP)
-        self.framer.end_framing()
+        indexer = None
+        if self._index_file is not None:
+            indexer = self._indexer = _Indexer(self)
+        try:
+            if self.proto >= 2:
+                self.write(PROTO + pack("<B", self.proto))
+            if self.proto >= 4:
+                self.framer.start_framing()
+            if self._gc_mode is None:
+                save(obj)
+            else:
+                enabled = gc.isenabled()
+                gc.disable()
+                try:
+                    save(obj)
+                finally:
+                    if enabled:
+                        gc.enable()
+            self.write(STOP)
+            self.framer.end_framing()
+        finally:
+            if indexer is not None:
+                self._indexer = None
+                indexer.close()
+        if indexer is not None:
+            _dump(indexer.index(), self._index_file, self.proto,
+                  fix_imports=self.fix_imports)
+
+    # Write the list of dump_iter() or the dict of dump_items() as
+    # save_list() and save_dict() would.  The container does not exist, so
+    # a new empty one takes its memo entry.  With an index_file, the items
+    # are saved through the indexer.
+
+    def _save_iter(self, iterable):
+        self.framer.commit_frame()
+        self.write(EMPTY_LIST if self.bin else MARK + LIST)
+        self.memoize([])
+        self._batch_appends(iter(iterable), self._index_save("list"))
+
+    def _save_items(self, items):
+        self.framer.commit_frame()
+        self.write(EMPTY_DICT if self.bin else MARK + DICT)
+        self.memoize({})
+        self._batch_setitems(iter(items), self._index_save("dict"))
+
+    def _save_root(self, obj):
+        # Write the dict or list obj for dump() with an index_file.
+        self.framer.commit_frame()
+        if type(obj) is dict:
+            self.write(EMPTY_DICT if self.bin else MARK + DICT)
+            self.memoize(obj)
+            self._batch_setitems(obj.items(), self._index_save("dict"))
+        else:
+            self.write(EMPTY_LIST if self.bin else MARK + LIST)
+            self.memoize(obj)
+            self._batch_appends(obj, self._index_save("list"))
+
+    def _index_save(self, kind):
+        # Return the function saving the items of the root, or None to
+        # use save().
+        indexer = self._indexer
+        if indexer is None:
+            return None
+        indexer.start(kind)
+        return indexer.save
 
     def memoize(self, obj):
         """Store an object in the memo."""
@@ -555,6 +1224,23 @@ class _Pickler:
                     self.save_global(obj)
                     return
 
+                # Enum and PurePath subclasses are only known once seen;
+                # remember them in this pickler's dispatch copy.
+                if self._stdlib_types and t not in self.dispatch:
+                    f = self.dispatch[t] = _stdlib_subclass_handler(t)
+                    if f is not None:
+                        f(self, obj)
+                        return
+
+                # Plain namedtuples and dataclasses are written from a
+                # per-class layout decided once.
+                f = _record_handlers.get(t, _record_handlers)
+                if f is _record_handlers:
+                    f = _record_handlers[t] = _record_handler(t)
+                if f is not None and self.proto >= 2:
+                    f(self, obj)
+                    return
+
                 # Check for a __reduce_ex__ method, fall back to __reduce__
                 reduce = getattr(obj, "__reduce_ex__", None)
                 if reduce is not None:
@@ -566,6 +1252,10 @@ class _Pickler:
                     else:
                         raise PicklingError("Can't pickle %r object: %r" %
                                             (t.__name__, obj))
+        self._save_reduce_value(obj, rv, reduce)
+
+    def _save_reduce_value(self, obj, rv, reduce):
+        # Save obj as described by rv, the value reduce(obj) returned.
 
         # Check for string returned by reduce(), meaning "save as global"
         if isinstance(rv, str):
@@ -897,9 +1587,10 @@ class _Pickler:
 
     _BATCHSIZE = 1000
 
-    def _batch_appends(self, items):
+    def _batch_appends(self, items, save=None):
         # Helper to batch up APPENDS sequences
-        save = self.save
+        if save is None:
+            save = self.save
         write = self.write
 
         if not self.bin:
@@ -908,6 +1599,21 @@ class _Pickler:
                 write(APPEND)
             return
 
+        if (type(items) in _sized_list_types and
+                len(items) <= self._BATCHSIZE):
+            # Fast path: a single batch, written straight from the
+            # container.
+            n = len(items)
+            if n > 1:
+                write(MARK)
+                for x in items:
+                    save(x)
+                write(APPENDS)
+            elif n:
+                save(items[0])
+                write(APPEND)
+            return
+
         it = iter(items)
         while True:
             tmp = list(islice(it, self._BATCHSIZE))
@@ -937,9 +1643,10 @@ class _Pickler:
     if PyStringMap is not None:
         dispatch[PyStringMap] = save_dict
 
-    def _batch_setitems(self, items):
+    def _batch_setitems(self, items, save=None):
         # Helper to batch up SETITEMS sequences; proto >= 1 only
-        save = self.save
+        if save is None:
+            save = self.save
         write = self.write
 
         if not self.bin:
@@ -949,6 +1656,24 @@ class _Pickler:
                 write(SETITEM)
             return
 
+        if (type(items) in _sized_items_types and
+                len(items) <= self._BATCHSIZE):
+            # Fast path: a single batch, written straight from the
+            # items view.
+            n = len(items)
+            if n > 1:
+                write(MARK)
+                for k, v in items:
+                    save(k)
+                    save(v)
+                write(SETITEMS)
+            elif n:
+                for k, v in items:
+                    save(k)
+                    save(v)
+                write(SETITEM)
+            return
+
         it = iter(items)
         while True:
             tmp = list(islice(it, self._BATCHSIZE))
@@ -1015,29 +1740,171 @@ class _Pickler:
         self.memoize(obj)
     dispatch[frozenset] = save_frozenset
 
+    def _save_by_table(self, obj):
+        # Save obj with the reducer that copyreg.pickle() or a private
+        # dispatch_table registers for its type, if there is one, as
+        # save() would have done without a dispatch entry for the type.
+        # Return whether obj was saved.
+        reduce = getattr(self, 'dispatch_table', dispatch_table).get(type(obj))
+        if reduce is None:
+            return False
+        self._save_reduce_value(obj, reduce(obj), reduce)
+        return True
+
+    # The collections containers below are written exactly as their
+    # __reduce_ex__() output would be, but without building the reduce
+    # tuple and the item iterators.  The container is memoized before its
+    # items are saved, so recursive references are preserved.  Reducers
+    # registered in a dispatch table still take precedence.
+
+    def save_deque(self, obj):
+        if self._save_by_table(obj):
+            return
+        maxlen = obj.maxlen
+        args = () if maxlen is None else ((), maxlen)
+        self.save_reduce(deque, args, obj=obj)
+        self._batch_appends(obj)
+    dispatch[deque] = save_deque
+
+    def save_ordereddict(self, obj):
+        if self._save_by_table(obj):
+            return
+        if obj.__dict__:
+            # Instance attributes are part of the state; let the generic
+            # reduction handle them.
+            self.save_reduce(obj=obj, *obj.__reduce_ex__(self.proto))
+            return
+        self.save_reduce(OrderedDict, (), obj=obj)
+        self._batch_setitems(obj.items())
+    dispatch[OrderedDict] = save_ordereddict
+
+    def save_defaultdict(self, obj):
+        if self._save_by_table(obj):
+            return
+        factory = obj.default_factory
+        args = () if factory is None else (factory,)
+        self.save_reduce(defaultdict, args, obj=obj)
+        self._batch_setitems(obj.items())
+    dispatch[defaultdict] = save_defaultdict
+
+    def save_counter(self, obj):
+        if self._save_by_table(obj):
+            return
+        self.save_reduce(Counter, (dict(obj),), obj=obj)
+    dispatch[Counter] = save_counter
+
+    # Handlers for the opt-in standard library value types, installed by
+    # _stdlib_save_dispatch() when the pickler is created with
+    # stdlib_types=True.  Each writes cls(*args) with REDUCE, which any
+    # unpickler can read.
+
+    def _save_value(self, cls, args, obj):
+        # The constructor is looked up in the memo directly once it has
+        # been written, instead of going through save() for every value.
+        x = self.memo.get(id(cls))
+        if x is not None:
+            self.write(self.get(x[0]))
+        else:
+            self.save(cls)
+        self.save(args)
+        self.write(REDUCE)
+        self.memoize(obj)
+
+    def save_datetime(self, obj):
+        # date, time and datetime reduce to their packed byte state, plus
+        # the tzinfo if there is one.
+        self._save_value(type(obj), obj.__reduce_ex__(self.proto)[1], obj)
+
+    def save_timedelta(self, obj):
+        self._save_value(type(obj),
+                         (obj.days, obj.seconds, obj.microseconds), obj)
+
+    def save_decimal(self, obj):
+        self._save_value(type(obj), (str(obj),), obj)
+
+    def save_uuid(self, obj):
+        if obj.is_safe.value is not None:
+            # is_safe is only kept by the generic reduction.
+            self.save_reduce(obj=obj, *obj.__reduce_ex__(self.proto))
+            return
+        # UUID(None, bytes) or UUID(hex), rather than a state dict.
+        if self.proto >= 3:
+            args = (None, obj.bytes)
+        else:
+            args = (obj.hex,)
+        self._save_value(type(obj), args, obj)
+
+    def save_fraction(self, obj):
+        # Fraction(numerator, denominator) rather than Fraction('n/d').
+        self._save_value(type(obj), (obj.numerator, obj.denominator), obj)
+
+    def save_enum(self, obj):
+        self._save_value(type(obj), (obj._value_,), obj)
+
+    def save_purepath(self, obj):
+        # A single string rather than a tuple of path parts.
+        self._save_value(type(obj), (str(obj),), obj)
+
+    # Namedtuples and dataclasses without custom reduction hooks, found by
+    # _record_handler().  Both write exactly what object.__reduce_ex__()
+    # would: copyreg.__newobj__ as NEWOBJ, followed by BUILD with the
+    # instance dict if there is one.  Protocol 2 or higher only.
+
+    def save_namedtuple(self, obj):
+        save = self.save
+        write = self.write
+        save(type(obj))
+        save(tuple(obj))
+        write(NEWOBJ)
+        if id(obj) in self.memo:
+            # Recursive namedtuple; see save_reduce().
+            write(POP + self.get(self.memo[id(obj)][0]))
+        else:
+            self.memoize(obj)
+
+    def save_dataclass(self, obj):
+        self.save(type(obj))
+        self.write(EMPTY_TUPLE + NEWOBJ)
+        self.memoize(obj)
+        state = obj.__dict__
+        if state:
+            self.save(state)
+            self.write(BUILD)
+
     def save_global(self, obj, name=None):
         write = self.write
         memo = self.memo
 
-        if name is None:
-            name = getattr(obj, '__qualname__', None)
-        if name is None:
-            name = obj.__name__
-
-        module_name = whichmodule(obj, name)
+        # The module lookup below is done once per object; later calls
+        # only check that the name still refers to the same object.
+        key = name
         try:
-            __import__(module_name, level=0)
-            module = sys.modules[module_name]
-            obj2, parent = _getattribute(module, name)
-        except (ImportError, KeyError, AttributeError):
-            raise PicklingError(
-                "Can't pickle %r: it's not found as %s.%s" %
-                (obj, module_name, name)) from None
+            names = _global_names.get(obj)
+        except TypeError:
+            # obj cannot be weakly referenced, and is not cached.
+            names = cacheable = None
         else:
-            if obj2 is not obj:
-                raise PicklingError(
-                    "Can't pickle %r: it's not the same object as %s.%s" %
-                    (obj, module_name, name))
+            cacheable = True
+        entry = names.get(key) if names is not None else None
+        parent = entry[2]() if entry is not None else None
+        if parent is not None and getattr(parent, entry[3], None) is obj:
+            module_name, name, _, _, toplevel = entry
+        else:
+            module_name, name, module, parent = _lookup_global(obj, name)
+            toplevel = parent is module
+            if cacheable:
+                try:
+                    parent_ref = ref(parent)
+                except TypeError:
+                    # Nor is obj when its parent cannot be.
+                    cacheable = False
+            if cacheable:
+                if names is None:
+                    if len(_global_names) >= _GLOBAL_NAMES_MAX:
+                        _global_names.clear()
+                    names = _global_names[obj] = {}
+                names[key] = (module_name, name, parent_ref,
+                              name.rpartition('.')[2], toplevel)
 
         if self.proto >= 2:
             code = _extension_registry.get((module_name, name))
@@ -1051,14 +1918,14 @@ class _Pickler:
                     write(EXT4 + pack("<i", code))
                 return
         lastname = name.rpartition('.')[2]
-        if parent is module:
+        if toplevel:
             name = lastname
         # Non-ASCII identifiers are supported only with protocols >= 3.
         if self.proto >= 4:
             self.save(module_name)
             self.save(name)
             write(STACK_GLOBAL)
-        elif parent is not module:
+        elif not toplevel:
             self.save_reduce(getattr, (parent, lastname))
         elif self.proto >= 3:
             write(GLOBAL + bytes(module_name, "utf-8") + b'\n' +
@@ -1077,7 +1944,8 @@ class _Pickler:
             except UnicodeEncodeError:
                 raise PicklingError(
                     "can't pickle global identifier '%s.%s' using "
-                    "pickle protocol %i" % (module, name, self.proto)) from None
+                    "pickle protocol %i" % (module_name, name,
+                                            self.proto)) from None
 
         self.memoize(obj)
 
@@ -1093,13 +1961,195 @@ class _Pickler:
     dispatch[FunctionType] = save_global
     dispatch[type] = save_type
 
+    # Other callables.  Bound methods and builtin functions are written as
+    # their __reduce__() would describe them, without calling it, unless a
+    # dispatch table has a reducer for them.  Partials are written the
+    # same way, but with the state __reduce__() gives, as reading their
+    # __dict__ would create it.
+
+    def save_method(self, obj):
+        if self._save_by_table(obj):
+            return
+        # getattr(instance, name)
+        self.save_reduce(getattr, (obj.__self__, obj.__func__.__name__),
+                         obj=obj)
+    dispatch[MethodType] = save_method
+
+    def save_builtin_function(self, obj):
+        if self._save_by_table(obj):
+            return
+        self_obj = obj.__self__
+        if self_obj is not None and not isinstance(self_obj, ModuleType):
+            self.save_reduce(getattr, (self_obj, obj.__name__), obj=obj)
+        elif '.' not in obj.__qualname__:
+            self.save_global(obj, obj.__qualname__)
+        else:
+            # A static method of a type, like str.maketrans, whose type
+            # only __reduce__() gives, as getattr(type, name).
+            reduce = obj.__reduce__
+            self._save_reduce_value(obj, reduce(), reduce)
+    dispatch[BuiltinFunctionType] = save_builtin_function
+
+    def save_partial(self, obj):
+        if self._save_by_table(obj):
+            return
+        save = self.save
+        write = self.write
+        save(partial)
+        save((obj.func,))
+        write(REDUCE)
+        if id(obj) in self.memo:
+            write(POP + self.get(self.memo[id(obj)][0]))
+        else:
+            self.memoize(obj)
+        save(obj.__reduce__()[2])
+        write(BUILD)
+    dispatch[partial] = save_partial
+
 
 # Unpickling machinery
 
+def _compat_global(module, name, proto, fix_imports):
+    # Map a Python 2 global name to its Python 3 location.
+    if proto < 3 and fix_imports:
+        if (module, name) in _compat_pickle.NAME_MAPPING:
+            return _compat_pickle.NAME_MAPPING[(module, name)]
+        elif module in _compat_pickle.IMPORT_MAPPING:
+            return _compat_pickle.IMPORT_MAPPING[module], name
+    return module, name
+
+def _find_global(module, name, proto, fix_imports):
+    # Import and return the global named in a pickle, for find_class().
+    if proto < 3 and fix_imports:
+        module, name = _compat_global(module, name, proto, fix_imports)
+    __import__(module, level=0)
+    if proto >= 4:
+        return _getattribute(sys.modules[module], name)[0]
+    else:
+        return getattr(sys.modules[module], name)
+
+# Process-wide cache of _find_global(), for Unpicklers created with
+# shared_global_cache=True.
+_find_global_cached = lru_cache(maxsize=1024)(_find_global)
+
+# Limits for Unpicklers created with an intern_table: the longest string,
+# in UTF-8 bytes, and the longest tuple that are looked up in the table,
+# and the number of entries after which the table stops growing.  The
+# strings, bytes and ints in a tuple are held to the same size in length
+# or bytes.
+_INTERN_MAX_STR = 64
+_INTERN_MAX_TUPLE = 3
+_INTERN_MAX_ENTRIES = 1 << 16
+
+# Types of the values a tuple may hold to be interned.  Floats are left
+# out because 0.0 == -0.0.
+_intern_atom_types = frozenset({str, int, bool, bytes, type(None)})
+
+def _intern(table, value, key):
+    # Return the value stored in table under key, storing value there
+    # first if there is none and the table is not full.
+    found = table.get(key)
+    if found is None:
+        if len(table) < _INTERN_MAX_ENTRIES:
+            table[key] = value
+        return value
+    return found
+
+# Smallest BINBYTES payload returned as a view by Unpicklers created with
+# bytes_as="memoryview".  Picklers write payloads this large outside of
+# frames, which is where views can be taken.
+_MEMORYVIEW_MIN = 64 * 1024
+
+def _source_buffer(file):
+    # Return a read-only byte view of everything file reads from, or None
+    # if it does not expose one.
+    try:
+        getbuffer = file.getbuffer
+    except AttributeError:
+        try:
+            view = memoryview(file)
+        except TypeError:
+            return None
+    else:
+        view = getbuffer()
+    return view.cast('B').toreadonly()
+
+def _intern_tuple(table, items):
+    # Intern a small tuple of short atoms.  Equal tuples of values of
+    # different types, like (1,) and (True,), are kept apart by keying on
+    # the types.
+    for item in items:
+        t = type(item)
+        if t not in _intern_atom_types:
+            return items
+        if t is str or t is bytes:
+            if len(item) > _INTERN_MAX_STR:
+                return items
+        elif t is int and item.bit_length() > 8 * _INTERN_MAX_STR:
+            return items
+    return _intern(table, items, (items, tuple(map(type, items))))
+
+class _UnpicklerMemo(MutableMapping):
+    # The memo attribute of _Unpickler: a view of the list holding the keys
+    # from 0 up and of the dict holding the keys past a gap.  Keys are
+    # checked as when assigning a dict to the attribute.
+
+    __slots__ = ('_unpickler',)
+
+    def __init__(self, unpickler):
+        self._unpickler = unpickler
+
+    def __getitem__(self, i):
+        unpickler = self._unpickler
+        memo = unpickler._memo
+        if type(i) is int and 0 <= i < len(memo):
+            return memo[i]
+        return unpickler._memo_sparse[i]
+
+    def __setitem__(self, i, value):
+        if not isinstance(i, int):
+            raise TypeError("memo key must be integers")
+        if i < 0:
+            raise ValueError("memo key must be positive integers.")
+        self._unpickler._memo_put(i, value)
+
+    def __delitem__(self, i):
+        unpickler = self._unpickler
+        memo = unpickler._memo
+        if type(i) is int and 0 <= i < len(memo):
+            # The keys after i are no longer from 0 up.
+            unpickler._memo_sparse.update(
+                zip(range(i + 1, len(memo)), memo[i + 1:]))
+            del memo[i:]
+        else:
+            del unpickler._memo_sparse[i]
+
+    def __iter__(self):
+        unpickler = self._unpickler
+        yield from range(len(unpickler._memo))
+        yield from list(unpickler._memo_sparse)
+
+    def __len__(self):
+        unpickler = self._unpickler
+        return len(unpickler._memo) + len(unpickler._memo_sparse)
+
+    def clear(self):
+        self._unpickler._memo.clear()
+        self._unpickler._memo_sparse.clear()
+
+    def copy(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(self.copy())
+
 class _Unpickler:
 
     def __init__(self, file, *, fix_imports=True,
-                 encoding="ASCII", errors="strict", buffers=None):
+                 encoding="ASCII", errors="strict", buffers=None,
+                 stdlib_types=False, allowed_globals=None,
+                 shared_global_cache=False, intern_table=None,
+                 bytes_as="bytes", gc_mode=None, lazy_size=None):
         """This takes a binary file for reading a pickle data stream.
 
         The protocol version of the pickle is detected automatically, so
@@ -1136,52 +2186,750 @@ class _Unpickler:
         to decode 8-bit string instances pickled by Python 2; these
         default to 'ASCII' and 'strict', respectively. *encoding* can be
         'bytes' to read these 8-bit string instances as bytes objects.
+
+        If *stdlib_types* is true, REDUCE calls that rebuild UUID,
+        Fraction and Enum values use shortcuts which skip argument
+        parsing and validation when the arguments are well-formed.
+
+        Globals are looked up once per unpickler; find_class() returns
+        the same object for later references to the same name.  If
+        *shared_global_cache* is true, lookups are also shared through a
+        process-wide LRU cache, so that a global imported by one
+        unpickler is not looked up again by the next.  Objects rebound
+        in their module after the first lookup are then not noticed.
+
+        If *allowed_globals* is not None, it should be an iterable of
+        (module, name) pairs, and find_class() raises UnpicklingError for
+        any other global.  Python 2 names are checked after mapping them
+        to their Python 3 location.
+
+        If *intern_table* is not None, equal short strings and small tuples
+        of strings, ints, bytes and None are loaded as one shared object.
+        It may be True, to share them across the load() calls of this
+        unpickler, or a dict to share them across unpicklers; the dict
+        should not be used for anything else.  It stops taking new
+        entries once it holds 65536 of them.
+
+        If *bytes_as* is "memoryview", bytes of at least 64 KiB that lie
+        outside of a frame are loaded as read-only memoryview slices of
+        the input instead of being copied, when *file* is an io.BytesIO,
+        an mmap or another seekable object supporting the buffer
+        protocol.  The views keep the input alive: an io.BytesIO cannot
+        be resized and an mmap cannot be closed until they are released.
+        The unpickler itself lets go of the input when load() returns.
+
+        If *gc_mode* is "disable", the cyclic garbage collector is disabled
+        while load() runs, so that it does not scan the containers being
+        built over and over; it is enabled again afterwards if it was
+        enabled, even if load() fails.  With "freeze", gc.freeze() is
+        also called after a successful load(), which moves the result
+        and every other object tracked at that time to the permanent
+        generation; this suits processes about to fork workers that share
+        the result.  Both affect the whole process.
+
+        If *lazy_size* is not None, dicts and lists whose pickle is
+        larger than *lazy_size* bytes are returned by load() as LazyDict
+        and LazyList proxies, which build their dict or list on first use.
+        Their items are built the same way, so that only the parts of the
+        pickle that are used are decoded, and the items too small to be
+        proxies are decoded together.  Telling them apart takes one pass
+        over the pickle, made by load() to find where the pickle ends, or
+        by the first proxy built when loads() reads the whole data.
+        Proxies are built one at a time, under a lock: one may be used
+        from any thread, but not while this unpickler loads another
+        pickle in another thread.  Each value is still built once: a
+        proxy stands for its dict or list wherever the pickle shares it,
+        and a value read through the memo from a proxy not built yet
+        builds the proxies holding it first.  Proxies use a memo of their
+        own and read the input through the buffer of an io.BytesIO or an
+        mmap of a real file, which is kept until they are all built.
+        Values held by tuples and other objects are built whole.  When
+        *file* can be scanned neither way, or *buffers* was given,
+        load() builds everything.
         """
         self._buffers = iter(buffers) if buffers is not None else None
+        self._input = file
         self._file_readline = file.readline
         self._file_read = file.read
-        self.memo = {}
+        # The memo is kept as a list indexed by memo key, which is how
+        # picklers number their entries.  Keys written out of order are
+        # kept in _memo_sparse until the list grows up to them; all keys
+        # in _memo_sparse are greater than len(_memo).
+        self._memo = []
+        self._memo_sparse = {}
         self.encoding = encoding
         self.errors = errors
         self.proto = 0
         self.fix_imports = fix_imports
+        self._build_keys = {}
+        self._has_initargs = {}
+        self._found_globals = {}
+        if allowed_globals is not None:
+            allowed_globals = frozenset(allowed_globals)
+        self._allowed_globals = allowed_globals
+        if shared_global_cache:
+            self._find_global = _find_global_cached
+        else:
+            self._find_global = _find_global
+        if intern_table is True:
+            intern_table = {}
+        elif intern_table is False:
+            intern_table = None
+        self._interned = intern_table
+        if bytes_as == "memoryview":
+            self._file = file
+        elif bytes_as == "bytes":
+            self._file = None
+        else:
+            raise ValueError("bytes_as must be 'bytes' or 'memoryview', "
+                             "not %r" % (bytes_as,))
+        self._source = None
+        if gc_mode not in (None, "disable", "freeze"):
+            raise ValueError("gc_mode must be None, 'disable' or 'freeze', "
+                             "not %r" % (gc_mode,))
+        self._gc_mode = gc_mode
+        if lazy_size is not None and lazy_size < 0:
+            raise ValueError("lazy_size must be None or >= 0")
+        self._lazy_size = lazy_size
+        self._dispatch_overrides = ()
+        if stdlib_types:
+            if _stdlib_reduce_hooks is None:
+                _init_stdlib_types()
+            self._dispatch_overrides += (
+                (REDUCE[0], _Unpickler.load_reduce_stdlib),)
 
     def load(self):
         """Read a pickled object representation from the open file.
 
         Return the reconstituted object hierarchy specified in the file.
+        With a *lazy_size*, the input (the buffer of an io.BytesIO or an
+        mmap of the file) stays exported while any LazyDict or LazyList
+        returned is not built, so that an io.BytesIO cannot be resized
+        until then.
         """
-        # Check whether Unpickler was initialized correctly. This is
-        # only needed to mimic the behavior of _pickle.Unpickler.dump().
+        return self._load(True)
+
+    def _load(self, seek):
+        # load(), which leaves the file where the pickle ends only if seek
+        # is true or the pickle is not loaded lazily.
+        if self._lazy_size is not None and self._buffers is None:
+            view, pos, mapping = _open_scan(self._input, False)
+            if view is not None:
+                value = self._load_lazy(view, pos, mapping, seek)
+                if value is not _SelectWhole:
+                    return value
+        table, fused = self._start_load()
+        run = self._load_fused if fused else self._load_generic
+        try:
+            if self._gc_mode is None:
+                return run(table)
+            return self._gc_call(run, table)
+        finally:
+            # Only the views returned keep the input exported.
+            self._source = None
+
+    def _gc_call(self, func, *args):
+        # Call func(*args) with the collector handled as gc_mode says.
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            value = func(*args)
+        finally:
+            if enabled:
+                gc.enable()
+        if self._gc_mode == "freeze":
+            gc.freeze()
+        return value
+
+    def load_select(self, paths, *, refs="load"):
+        """Read a pickled object from the open file, building only parts of it.
+
+        *paths* is an iterable of paths, each a tuple or list of the dict
+        keys and list or tuple indices that lead from the pickled object
+        to a value to load; a path that is not a tuple or list is a single
+        key.  Ellipsis stands for every key or index, and negative indices
+        count from the end.  Along the paths, dicts, lists and tuples
+        (not their subclasses) are rebuilt with only their selected
+        entries, in order; a dict key or index that is not found is left
+        out.  The values the paths lead to, and any other value met on
+        the way, are loaded whole.  An empty path selects everything.
+
+        The pickle is first scanned, through the buffer of an io.BytesIO
+        or an mmap of a real file, and the opcodes of the values that are
+        not selected are skipped without building anything.  When the
+        paths name the keys or non-negative indices of a pickled dict or
+        list, scanning stops once the selected entries are complete, and
+        the rest of the pickle is only walked to find its end, which
+        loads() skips when its data ends with the pickle.  Selected values
+        that read memo entries defined by skipped values depend on *refs*:
+        with "load", the values they refer to are loaded too; with
+        "placeholder", those that are not atoms or globals are given as
+        the PickleSpan where they lie in the pickle instead, which keeps
+        the scanned input alive.  Values loaded this way are equal to
+        those of a full load, but are not always the same objects where
+        the pickle shares them: a value that is both selected whole and
+        part of a rebuilt container is loaded twice.
+
+        The memo is cleared first.  When *file* can be scanned neither
+        way, or *buffers* was given, the whole object is loaded by load()
+        and the selected parts are picked from it.
+        """
+        return self._load_select(paths, refs, True)
+
+    def _load_select(self, paths, refs, seek):
+        # load_select(), which leaves the file where the pickle ends only
+        # if seek is true.
+        if refs not in ("load", "placeholder"):
+            raise ValueError("refs must be 'load' or 'placeholder', not %r" %
+                             (refs,))
+        tree = _select_tree(paths)
+        view = None
+        if self._buffers is None:
+            view, pos, mapping = _open_scan(self._input, False)
+        if view is None:
+            return _select_value(self.load(), tree)
+        kept = False
+        try:
+            result = PickleScan(view, pos)
+            loader = _SelectLoader(self, result, refs == "placeholder")
+            if loader.loads_whole(pos, len(view), tree):
+                # The pickled object is a dict or list of small entries.
+                result.root = None
+            else:
+                _scan(result, loader.until(tree))
+            end = result.end
+            if result.root is None:
+                # A selected value of small entries makes up most of the
+                # pickle.
+                value = _SelectWhole
+            else:
+                if end is None:
+                    # The scan stopped early, with a dict or list at the bottom
+                    # of the stack, which is the pickled object only if the
+                    # last opcode adds to it.  Only loads() takes the pickle
+                    # to end with the data.
+                    stop = len(view)
+                    if seek or view[stop - 1] != 0x2e:  # STOP
+                        stop = end = _pickle_end(view, result.root.end)
+                        if end is None:
+                            raise UnpicklingError("pickle data was truncated")
+                    if _span_filled(result, result.root.start,
+                                    stop - 1) != result.root.kind:
+                        result = _scan(PickleScan(view, pos))
+                        loader = _SelectLoader(self, result,
+                                               refs == "placeholder")
+                        end = result.end
+                self._memo.clear()
+                self._memo_sparse.clear()
+                try:
+                    if self._gc_mode is None:
+                        value = loader.select(result.root, tree)
+                    else:
+                        value = self._gc_call(loader.select, result.root, tree)
+                except _SelectWhole:
+                    value = _SelectWhole
+            # Placeholders read the scanned data.
+            kept = loader.placeholders
+        finally:
+            if not kept:
+                _close_scan(view, mapping)
+        if value is _SelectWhole:
+            # The file is still where the pickle starts.
+            self._memo.clear()
+            self._memo_sparse.clear()
+            return _select_value(self.load(), tree)
+        if end is not None:
+            self._input.seek(end)
+        return value
+
+    def _load_lazy(self, view, pos, mapping, seek):
+        # _load() with a lazy_size, for input read through view.  Return
+        # _SelectWhole, with the file still where the pickle starts, if
+        # the pickled object is not a dict or list larger than the
+        # lazy_size.
+        kept = False
+        try:
+            result = PickleScan(view, pos)
+            loader = _LazyLoader(self, result, self._lazy_size)
+            loader.mapping = mapping
+            if not loader.find_root(seek):
+                return _SelectWhole
+            if self._gc_mode is None:
+                value = loader.load_root()
+            else:
+                value = self._gc_call(loader.load_root)
+            # Proxies read the data.
+            kept = bool(loader.pending)
+        finally:
+            if not kept:
+                _close_scan(view, mapping)
+        if seek:
+            self._input.seek(result.end)
+        return value
+
+    # The attributes _load_fragment() saves: a fragment may be loaded
+    # while another load is running, by a LazyDict or LazyList used by an
+    # object being built.
+    _fragment_state = ('_file_read', '_file_readline', '_file', '_unframer',
+                       'read', 'readline', 'marks', 'stack', 'append',
+                       'proto')
+
+    def _load_fragment(self, data):
+        # Load a pickle made by _span_pickle() from a part of the input,
+        # with the memo of this unpickler.
+        saved = [getattr(self, name, None) for name in self._fragment_state]
+        file = io.BytesIO(data)
+        self._file_read = file.read
+        self._file_readline = file.readline
+        self._file = None
+        try:
+            table, fused = self._start_load()
+            run = self._load_fused if fused else self._load_generic
+            return run(table)
+        finally:
+            for name, value in zip(self._fragment_state, saved):
+                setattr(self, name, value)
+
+    def iter_load(self):
+        """Read a pickled list from the open file, yielding its items.
+
+        Items are yielded as each APPENDS batch of the list is read, and
+        are then dropped from the list, as are the memo entries that
+        nothing later in the pickle refers to, so that a list written by
+        Pickler.dump() or Pickler.dump_iter() can be processed with memory
+        bounded by a batch of 1000 items and the objects shared between
+        them.
+
+        Finding the memo entries that are referred to needs a first pass
+        over the pickle, through the buffer of an io.BytesIO or an mmap of
+        a real file.  When *file* supports neither, or the list itself is
+        referred to, the list is loaded by load() and its items are then
+        yielded.  UnpicklingError is raised if the pickled object is not a
+        list.
+        """
+        view, pos, mapping = _open_scan(self._input, False)
+        plan = None
+        if view is not None:
+            try:
+                plan = _scan_list_gets(view, pos)
+            finally:
+                _close_scan(view, mapping)
+        if plan is None or plan[0] in plan[1]:
+            value = self.load()
+            if type(value) is not list:
+                raise UnpicklingError("iter_load() needs a pickled list, "
+                                      "not %s" % type(value).__name__)
+            yield from value
+            return
+
+        gets = plan[1]
+        table, fused = self._start_load()
+        run = self._load_fused if fused else self._load_generic
+        memo = self._memo
+        items = None        # the list, once items have been appended
+        dropped = 0         # memo keys below this have been dropped
+        try:
+            while True:
+                value = run(table, True)
+                if value is not _APPENDED:
+                    break
+                items = self.stack[0]
+                yield from items
+                del items[:]
+                for i in range(dropped, len(memo)):
+                    if i not in gets:
+                        memo[i] = None
+                dropped = len(memo)
+        finally:
+            self._source = None
+        if items is not None and value is not items or type(value) is not list:
+            raise UnpicklingError("iter_load() needs a pickled list")
+        yield from value
+
+    def _start_load(self):
+        # Prepare for reading a pickle; return the load table and whether
+        # the fused loop can be used with it.  Check whether Unpickler was
+        # initialized correctly, which is only needed to mimic the behavior
+        # of _pickle.Unpickler.load().
         if not hasattr(self, "_file_read"):
             raise UnpicklingError("Unpickler.__init__() was not called by "
                                   "%s.__init__()" % (self.__class__.__name__,))
         self._unframer = _Unframer(self._file_read, self._file_readline)
         self.read = self._unframer.read
         self.readline = self._unframer.readline
-        self.metastack = []
+        # All values live on one stack; marks holds the stack length at
+        # each open MARK.
+        self.marks = []
         self.stack = []
         self.append = self.stack.append
         self.proto = 0
+        return _load_table(self.dispatch, self._dispatch_overrides)
+
+    # The main loop of load() when some of the opcodes handled inline by
+    # _load_fused() have been overridden.
+    def _load_generic(self, table, stream=False):
         read = self.read
-        dispatch = self.dispatch
+        marks = self.marks
+        stack = self.stack
         try:
             while True:
                 key = read(1)
                 if not key:
                     raise EOFError
-                assert isinstance(key, bytes_types)
-                dispatch[key[0]](self)
+                code = key[0]
+                n = _stack_args[code]
+                if n and marks:
+                    stack[marks[-1] + n - 1]
+                table[code](self)
+                if (stream and (code == APPENDS[0] or code == APPEND[0]) and
+                        not marks and len(stack) == 1):
+                    return _APPENDED
         except _Stop as stopinst:
             return stopinst.value
 
+    # The main loop of load(), with the most frequent opcodes handled
+    # inline instead of through the dispatch table.  It is only used when
+    # none of the inlined opcodes has been overridden (see _load_table()).
+    # Opcodes and their arguments are read straight from the current
+    # frame; a conforming pickle never splits an opcode across frames.
+    def _load_fused(self, table, stream=False):
+        unframer = self._unframer
+        read = self.read
+        file_read = self._file_read
+        frame = unframer.current_frame
+        read1 = frame.read if frame else file_read
+        memo = self._memo
+        memo_append = memo.append
+        memo_sparse = self._memo_sparse
+        marks = self.marks
+        stack = self.stack
+        append = stack.append
+        stack_args = _stack_args
+        interned = self._interned
+        # Length of the stack at the topmost mark; values below it may
+        # not be consumed.  Opcodes that take k values check this by
+        # indexing stack[fence + k - 1], which raises IndexError.
+        fence = marks[-1] if marks else 0
+
+        def rest(data, n):
+            # Return the n bytes of an argument that read1() returned fewer
+            # of.  As _Unframer.read() does, read it from the file if the
+            # frame was used up, and go on reading from there.
+            nonlocal read1
+            if read1 is file_read:
+                return data
+            if data:
+                raise UnpicklingError("pickle exhausted before end of frame")
+            read1 = file_read
+            return read(n)
+
+        while True:
+            key = read1(1)
+            if not key:
+                # End of the current frame, or of the file.
+                key = read(1)
+                if not key:
+                    raise EOFError
+                frame = unframer.current_frame
+                read1 = frame.read if frame else file_read
+            code = key[0]
+            # The inlined opcodes are grouped by range to keep the number
+            # of comparisons per opcode low.  Each inlined case continues
+            # the loop; anything else falls through to the dispatch table.
+            if code >= 0x80:
+                if code == 0x94:                # MEMOIZE
+                    stack[fence]
+                    if memo_sparse:
+                        self._memo_put(len(memo) + len(memo_sparse),
+                                       stack[-1])
+                    else:
+                        memo_append(stack[-1])
+                    continue
+                elif code == 0x8c:              # SHORT_BINUNICODE
+                    data = read1(1)
+                    if not data:
+                        data = rest(data, 1)
+                    n = data[0]
+                    data = read1(n)
+                    if len(data) < n:
+                        data = rest(data, n)
+                    value = str(data, 'utf-8', 'surrogatepass')
+                    if interned is not None and n <= _INTERN_MAX_STR:
+                        value = _intern(interned, value, value)
+                    append(value)
+                    continue
+                elif code == 0x86:              # TUPLE2
+                    stack[fence + 1]
+                    second = stack.pop()
+                    stack[-1] = (stack[-1], second)
+                    if interned is not None:
+                        stack[-1] = _intern_tuple(interned, stack[-1])
+                    continue
+                elif code == 0x85:              # TUPLE1
+                    stack[fence]
+                    stack[-1] = (stack[-1],)
+                    if interned is not None:
+                        stack[-1] = _intern_tuple(interned, stack[-1])
+                    continue
+                elif code == 0x87:              # TUPLE3
+                    stack[fence + 2]
+                    third = stack.pop()
+                    second = stack.pop()
+                    stack[-1] = (stack[-1], second, third)
+                    if interned is not None:
+                        stack[-1] = _intern_tuple(interned, stack[-1])
+                    continue
+                elif code == 0x88:              # NEWTRUE
+                    append(True)
+                    continue
+                elif code == 0x89:              # NEWFALSE
+                    append(False)
+                    continue
+                elif code == 0x95:              # FRAME
+                    data = read1(8)
+                    if len(data) < 8:
+                        data = rest(data, 8)
+                    frame_size, = unpack('<Q', data)
+                    if frame_size > sys.maxsize:
+                        raise ValueError("frame size > sys.maxsize: %d" %
+                                         frame_size)
+                    unframer.load_frame(frame_size)
+                    read1 = unframer.current_frame.read
+                    continue
+            elif code >= 0x61:
+                if code == 0x68:                # BINGET
+                    data = read1(1)
+                    if not data:
+                        data = rest(data, 1)
+                    i = data[0]
+                    if i < len(memo):
+                        append(memo[i])
+                    else:
+                        append(self._memo_get(i))
+                    continue
+                elif code == 0x71:              # BINPUT
+                    stack[fence]
+                    data = read1(1)
+                    if not data:
+                        data = rest(data, 1)
+                    i = data[0]
+                    if i == len(memo) and not memo_sparse:
+                        memo_append(stack[-1])
+                    else:
+                        self._memo_put(i, stack[-1])
+                    continue
+                elif code == 0x72:              # LONG_BINPUT
+                    stack[fence]
+                    data = read1(4)
+                    if len(data) < 4:
+                        data = rest(data, 4)
+                    i, = unpack('<I', data)
+                    if i > maxsize:
+                        raise ValueError("negative LONG_BINPUT argument")
+                    if i == len(memo) and not memo_sparse:
+                        memo_append(stack[-1])
+                    else:
+                        self._memo_put(i, stack[-1])
+                    continue
+                elif code == 0x75:              # SETITEMS
+                    # The mapping sits just below the mark and must not
+                    # belong to an enclosing mark.
+                    if fence and (len(marks) == 1 or marks[-2] < fence):
+                        target = stack[fence - 1]
+                        if (type(target) in _plain_mapping_types and
+                                not (len(stack) - fence) & 1):
+                            items = iter(stack[fence:])
+                            del stack[fence:]
+                            target.update(zip(items, items))
+                            marks.pop()
+                            fence = marks[-1] if marks else 0
+                            continue
+                elif code == 0x65:              # APPENDS
+                    if fence and (len(marks) == 1 or marks[-2] < fence):
+                        target = stack[fence - 1]
+                        if type(target) is list:
+                            target.extend(stack[fence:])
+                            del stack[fence:]
+                            marks.pop()
+                            if stream and not marks and len(stack) == 1:
+                                return _APPENDED
+                            fence = marks[-1] if marks else 0
+                            continue
+                elif code == 0x61:              # APPEND
+                    stack[fence + 1]
+                    value = stack.pop()
+                    stack[-1].append(value)
+                    if stream and not marks and len(stack) == 1:
+                        return _APPENDED
+                    continue
+                elif code == 0x73:              # SETITEM
+                    stack[fence + 2]
+                    value = stack.pop()
+                    k = stack.pop()
+                    stack[-1][k] = value
+                    continue
+                elif code == 0x74:              # TUPLE
+                    if marks:
+                        items = tuple(stack[fence:])
+                        del stack[fence:]
+                        if (interned is not None and
+                                len(items) <= _INTERN_MAX_TUPLE):
+                            items = _intern_tuple(interned, items)
+                        append(items)
+                        marks.pop()
+                        fence = marks[-1] if marks else 0
+                        continue
+                elif code == 0x6a:              # LONG_BINGET
+                    data = read1(4)
+                    if len(data) < 4:
+                        data = rest(data, 4)
+                    i, = unpack('<I', data)
+                    if i < len(memo):
+                        append(memo[i])
+                    else:
+                        append(self._memo_get(i))
+                    continue
+            else:
+                if code == 0x4b:                # BININT1
+                    data = read1(1)
+                    if not data:
+                        data = rest(data, 1)
+                    append(data[0])
+                    continue
+                elif code == 0x28:              # MARK
+                    fence = len(stack)
+                    marks.append(fence)
+                    continue
+                elif code == 0x58:              # BINUNICODE
+                    data = read1(4)
+                    if len(data) < 4:
+                        data = rest(data, 4)
+                    n, = unpack('<I', data)
+                    if n > maxsize:
+                        raise UnpicklingError("BINUNICODE exceeds system's "
+                                              "maximum size of %d bytes" %
+                                              maxsize)
+                    data = read1(n)
+                    if len(data) < n:
+                        data = rest(data, n)
+                    value = str(data, 'utf-8', 'surrogatepass')
+                    if interned is not None and n <= _INTERN_MAX_STR:
+                        value = _intern(interned, value, value)
+                    append(value)
+                    continue
+                elif code == 0x7d:              # EMPTY_DICT
+                    append({})
+                    continue
+                elif code == 0x5d:              # EMPTY_LIST
+                    append([])
+                    continue
+                elif code == 0x4d:              # BININT2
+                    data = read1(2)
+                    if len(data) < 2:
+                        data = rest(data, 2)
+                    append(unpack('<H', data)[0])
+                    continue
+                elif code == 0x4e:              # NONE
+                    append(None)
+                    continue
+                elif code == 0x47:              # BINFLOAT
+                    data = read1(8)
+                    if len(data) < 8:
+                        data = rest(data, 8)
+                    append(unpack('>d', data)[0])
+                    continue
+                elif code == 0x4a:              # BININT
+                    data = read1(4)
+                    if len(data) < 4:
+                        data = rest(data, 4)
+                    append(unpack('<i', data)[0])
+                    continue
+                elif code == 0x29:              # EMPTY_TUPLE
+                    append(())
+                    continue
+                elif code == 0x2e:              # STOP
+                    stack[fence]
+                    return stack.pop()
+            n = stack_args[code]
+            if n:
+                stack[fence + n - 1]
+            table[code](self)
+            if (stream and (code == 0x65 or code == 0x61) and not marks and
+                    len(stack) == 1):
+                return _APPENDED
+            # The handler may have pushed or popped a mark.
+            fence = marks[-1] if marks else 0
+
+    @property
+    def memo(self):
+        """The memo, as a mapping of memo keys to objects.
+
+        Changes to the mapping change the memo; copy() returns a dict.
+        Assign a dict to this attribute to replace the memo.
+        """
+        return _UnpicklerMemo(self)
+
+    @memo.setter
+    def memo(self, memo):
+        if isinstance(memo, _UnpicklerMemo):
+            memo = memo.copy()
+        if not isinstance(memo, dict):
+            raise TypeError("'memo' attribute must be a dict, not %s" %
+                            type(memo).__name__)
+        for i in memo:
+            if not isinstance(i, int):
+                raise TypeError("memo key must be integers")
+            if i < 0:
+                raise ValueError("memo key must be positive integers.")
+        # Mutate in place: a running load() holds references to both.
+        self._memo.clear()
+        self._memo_sparse.clear()
+        for i in sorted(memo):
+            self._memo_put(i, memo[i])
+
+    def _memo_get(self, i):
+        # Slow path of the GET opcodes, once i is past the end of _memo.
+        try:
+            return self._memo_sparse[i]
+        except KeyError:
+            msg = f'Memo value not found at index {i}'
+            raise UnpicklingError(msg) from None
+
+    def _memo_put(self, i, value):
+        memo = self._memo
+        n = len(memo)
+        if i < n:
+            memo[i] = value
+        elif i == n:
+            memo.append(value)
+            sparse = self._memo_sparse
+            if sparse:
+                n += 1
+                while n in sparse:
+                    memo.append(sparse.pop(n))
+                    n += 1
+        else:
+            self._memo_sparse[i] = value
+
     # Return a list of items pushed in the stack after last MARK instruction.
     def pop_mark(self):
-        items = self.stack
-        self.stack = self.metastack.pop()
-        self.append = self.stack.append
+        stack = self.stack
+        mark = self.marks.pop()
+        items = stack[mark:]
+        del stack[mark:]
         return items
 
+    # Return the object below the last MARK instruction, which APPENDS,
+    # SETITEMS and ADDITEMS add the items after the mark to, together
+    # with those items.
+    def pop_mark_target(self):
+        items = self.pop_mark()
+        marks = self.marks
+        if marks:
+            # IndexError if the target belongs to an enclosing mark.
+            self.stack[marks[-1]]
+        return self.stack[-1], items
+
     def persistent_load(self, pid):
         raise UnpicklingError("unsupported persistent id encountered")
 
@@ -1313,9 +3061,27 @@ class _Unpickler:
         if len > maxsize:
             raise UnpicklingError("BINBYTES exceeds system's maximum size "
                                   "of %d bytes" % maxsize)
-        self.append(self.read(len))
+        self.append(self._read_bytes(len))
     dispatch[BINBYTES[0]] = load_binbytes
 
+    def _read_bytes(self, n):
+        # Read a bytes payload, as a view of the input if it is large and
+        # bytes_as="memoryview" was given.
+        file = self._file
+        if (file is None or n < _MEMORYVIEW_MIN or
+                self._unframer.current_frame is not None):
+            return self.read(n)
+        source = self._source
+        if source is None:
+            source = self._source = _source_buffer(file)
+            if source is None:
+                self._file = None
+                return self.read(n)
+        pos = file.tell()
+        view = source[pos:pos + n]
+        file.seek(pos + len(view))
+        return view
+
     def load_unicode(self):
         self.append(str(self.readline()[:-1], 'raw-unicode-escape'))
     dispatch[UNICODE[0]] = load_unicode
@@ -1325,7 +3091,10 @@ class _Unpickler:
         if len > maxsize:
             raise UnpicklingError("BINUNICODE exceeds system's maximum size "
                                   "of %d bytes" % maxsize)
-        self.append(str(self.read(len), 'utf-8', 'surrogatepass'))
+        value = str(self.read(len), 'utf-8', 'surrogatepass')
+        if self._interned is not None and len <= _INTERN_MAX_STR:
+            value = _intern(self._interned, value, value)
+        self.append(value)
     dispatch[BINUNICODE[0]] = load_binunicode
 
     def load_binunicode8(self):
@@ -1341,7 +3110,7 @@ class _Unpickler:
         if len > maxsize:
             raise UnpicklingError("BINBYTES8 exceeds system's maximum size "
                                   "of %d bytes" % maxsize)
-        self.append(self.read(len))
+        self.append(self._read_bytes(len))
     dispatch[BINBYTES8[0]] = load_binbytes8
 
     def load_bytearray8(self):
@@ -1385,12 +3154,17 @@ class _Unpickler:
 
     def load_short_binunicode(self):
         len = self.read(1)[0]
-        self.append(str(self.read(len), 'utf-8', 'surrogatepass'))
+        value = str(self.read(len), 'utf-8', 'surrogatepass')
+        if self._interned is not None and len <= _INTERN_MAX_STR:
+            value = _intern(self._interned, value, value)
+        self.append(value)
     dispatch[SHORT_BINUNICODE[0]] = load_short_binunicode
 
     def load_tuple(self):
-        items = self.pop_mark()
-        self.append(tuple(items))
+        items = tuple(self.pop_mark())
+        if self._interned is not None and len(items) <= _INTERN_MAX_TUPLE:
+            items = _intern_tuple(self._interned, items)
+        self.append(items)
     dispatch[TUPLE[0]] = load_tuple
 
     def load_empty_tuple(self):
@@ -1399,14 +3173,20 @@ class _Unpickler:
 
     def load_tuple1(self):
         self.stack[-1] = (self.stack[-1],)
+        if self._interned is not None:
+            self.stack[-1] = _intern_tuple(self._interned, self.stack[-1])
     dispatch[TUPLE1[0]] = load_tuple1
 
     def load_tuple2(self):
         self.stack[-2:] = [(self.stack[-2], self.stack[-1])]
+        if self._interned is not None:
+            self.stack[-1] = _intern_tuple(self._interned, self.stack[-1])
     dispatch[TUPLE2[0]] = load_tuple2
 
     def load_tuple3(self):
         self.stack[-3:] = [(self.stack[-3], self.stack[-2], self.stack[-1])]
+        if self._interned is not None:
+            self.stack[-1] = _intern_tuple(self._interned, self.stack[-1])
     dispatch[TUPLE3[0]] = load_tuple3
 
     def load_empty_list(self):
@@ -1444,8 +3224,15 @@ class _Unpickler:
     # klass is the class to instantiate, and k points to the topmost mark
     # object, following which are the arguments for klass.__init__.
     def _instantiate(self, klass, args):
-        if (args or not isinstance(klass, type) or
-            hasattr(klass, "__getinitargs__")):
+        if not args and isinstance(klass, type):
+            try:
+                has_initargs = self._has_initargs[klass]
+            except KeyError:
+                has_initargs = hasattr(klass, "__getinitargs__")
+                self._has_initargs[klass] = has_initargs
+        else:
+            has_initargs = True
+        if has_initargs:
             try:
                 value = klass(*args)
             except TypeError as err:
@@ -1533,16 +3320,19 @@ class _Unpickler:
     def find_class(self, module, name):
         # Subclasses may override this.
         sys.audit('pickle.find_class', module, name)
-        if self.proto < 3 and self.fix_imports:
-            if (module, name) in _compat_pickle.NAME_MAPPING:
-                module, name = _compat_pickle.NAME_MAPPING[(module, name)]
-            elif module in _compat_pickle.IMPORT_MAPPING:
-                module = _compat_pickle.IMPORT_MAPPING[module]
-        __import__(module, level=0)
-        if self.proto >= 4:
-            return _getattribute(sys.modules[module], name)[0]
-        else:
-            return getattr(sys.modules[module], name)
+        key = (module, name, self.proto)
+        obj = self._found_globals.get(key)
+        if obj is not None:
+            return obj
+        if self._allowed_globals is not None:
+            allowed = _compat_global(module, name, self.proto,
+                                     self.fix_imports)
+            if allowed not in self._allowed_globals:
+                raise UnpicklingError("global '%s.%s' is forbidden" %
+                                      allowed)
+        obj = self._find_global(module, name, self.proto, self.fix_imports)
+        self._found_globals[key] = obj
+        return obj
 
     def load_reduce(self):
         stack = self.stack
@@ -1551,11 +3341,26 @@ class _Unpickler:
         stack[-1] = func(*args)
     dispatch[REDUCE[0]] = load_reduce
 
-    def load_pop(self):
-        if self.stack:
-            del self.stack[-1]
+    # Installed instead of load_reduce() by stdlib_types=True.
+    def load_reduce_stdlib(self):
+        stack = self.stack
+        args = stack.pop()
+        func = stack[-1]
+        hook = _stdlib_reduce_hooks.get(id(func))
+        if hook is None and isinstance(func, _EnumType):
+            hook = _load_enum
+        if hook is None:
+            stack[-1] = func(*args)
         else:
+            stack[-1] = hook(func, args)
+
+    def load_pop(self):
+        # POP directly after MARK discards the mark.
+        marks = self.marks
+        if marks and len(self.stack) == marks[-1]:
             self.pop_mark()
+        else:
+            del self.stack[-1]
     dispatch[POP[0]] = load_pop
 
     def load_pop_mark(self):
@@ -1568,55 +3373,56 @@ class _Unpickler:
 
     def load_get(self):
         i = int(self.readline()[:-1])
-        try:
-            self.append(self.memo[i])
-        except KeyError:
-            msg = f'Memo value not found at index {i}'
-            raise UnpicklingError(msg) from None
+        if 0 <= i < len(self._memo):
+            self.append(self._memo[i])
+        else:
+            self.append(self._memo_get(i))
     dispatch[GET[0]] = load_get
 
     def load_binget(self):
         i = self.read(1)[0]
-        try:
-            self.append(self.memo[i])
-        except KeyError as exc:
-            msg = f'Memo value not found at index {i}'
-            raise UnpicklingError(msg) from None
+        if i < len(self._memo):
+            self.append(self._memo[i])
+        else:
+            self.append(self._memo_get(i))
     dispatch[BINGET[0]] = load_binget
 
     def load_long_binget(self):
         i, = unpack('<I', self.read(4))
-        try:
-            self.append(self.memo[i])
-        except KeyError as exc:
-            msg = f'Memo value not found at index {i}'
-            raise UnpicklingError(msg) from None
+        if i < len(self._memo):
+            self.append(self._memo[i])
+        else:
+            self.append(self._memo_get(i))
     dispatch[LONG_BINGET[0]] = load_long_binget
 
     def load_put(self):
         i = int(self.readline()[:-1])
         if i < 0:
             raise ValueError("negative PUT argument")
-        self.memo[i] = self.stack[-1]
+        self._memo_put(i, self.stack[-1])
     dispatch[PUT[0]] = load_put
 
     def load_binput(self):
         i = self.read(1)[0]
         if i < 0:
             raise ValueError("negative BINPUT argument")
-        self.memo[i] = self.stack[-1]
+        self._memo_put(i, self.stack[-1])
     dispatch[BINPUT[0]] = load_binput
 
     def load_long_binput(self):
         i, = unpack('<I', self.read(4))
         if i > maxsize:
             raise ValueError("negative LONG_BINPUT argument")
-        self.memo[i] = self.stack[-1]
+        self._memo_put(i, self.stack[-1])
     dispatch[LONG_BINPUT[0]] = load_long_binput
 
     def load_memoize(self):
-        memo = self.memo
-        memo[len(memo)] = self.stack[-1]
+        # The next key is the number of entries, as for a dict memo.
+        if self._memo_sparse:
+            self._memo_put(len(self._memo) + len(self._memo_sparse),
+                           self.stack[-1])
+        else:
+            self._memo.append(self.stack[-1])
     dispatch[MEMOIZE[0]] = load_memoize
 
     def load_append(self):
@@ -1627,8 +3433,7 @@ class _Unpickler:
     dispatch[APPEND[0]] = load_append
 
     def load_appends(self):
-        items = self.pop_mark()
-        list_obj = self.stack[-1]
+        list_obj, items = self.pop_mark_target()
         try:
             extend = list_obj.extend
         except AttributeError:
@@ -1653,15 +3458,17 @@ class _Unpickler:
     dispatch[SETITEM[0]] = load_setitem
 
     def load_setitems(self):
-        items = self.pop_mark()
-        dict = self.stack[-1]
+        dict, items = self.pop_mark_target()
+        if type(dict) in _plain_mapping_types and not len(items) & 1:
+            pairs = iter(items)
+            dict.update(zip(pairs, pairs))
+            return
         for i in range(0, len(items), 2):
             dict[items[i]] = items[i + 1]
     dispatch[SETITEMS[0]] = load_setitems
 
     def load_additems(self):
-        items = self.pop_mark()
-        set_obj = self.stack[-1]
+        set_obj, items = self.pop_mark_target()
         if isinstance(set_obj, set):
             set_obj.update(items)
         else:
@@ -1674,6 +3481,9 @@ class _Unpickler:
         stack = self.stack
         state = stack.pop()
         inst = stack[-1]
+        build = _layout_builders.get(type(inst))
+        if build is not None and build(inst, state):
+            return
         setstate = getattr(inst, "__setstate__", None)
         if setstate is not None:
             setstate(state)
@@ -1683,21 +3493,29 @@ class _Unpickler:
             state, slotstate = state
         if state:
             inst_dict = inst.__dict__
-            intern = sys.intern
-            for k, v in state.items():
-                if type(k) is str:
-                    inst_dict[intern(k)] = v
-                else:
-                    inst_dict[k] = v
+            # Instances of one class usually share the same attribute
+            # names in the same order; reuse the keys interned for the
+            # previous instance when they match.
+            cls = type(inst)
+            keys = self._build_keys.get(cls)
+            if keys is not None and keys == tuple(state):
+                inst_dict.update(zip(keys, state.values()))
+            else:
+                intern = sys.intern
+                for k, v in state.items():
+                    if type(k) is str:
+                        inst_dict[intern(k)] = v
+                    else:
+                        inst_dict[k] = v
+                if type(state) is dict and all(type(k) is str for k in state):
+                    self._build_keys[cls] = tuple(map(intern, state))
         if slotstate:
             for k, v in slotstate.items():
                 setattr(inst, k, v)
     dispatch[BUILD[0]] = load_build
 
     def load_mark(self):
-        self.metastack.append(self.stack)
-        self.stack = []
-        self.append = self.stack.append
+        self.marks.append(len(self.stack))
     dispatch[MARK[0]] = load_mark
 
     def load_stop(self):
@@ -1706,32 +3524,3730 @@ class _Unpickler:
     dispatch[STOP[0]] = load_stop
 
 
+# Opcodes handled inline by _Unpickler._load_fused().
+_INLINED_OPCODES = (MEMOIZE, SHORT_BINUNICODE, BININT1, BINGET, MARK,
+                    SETITEMS, APPENDS, EMPTY_DICT, EMPTY_LIST, EMPTY_TUPLE,
+                    TUPLE1, TUPLE2, TUPLE3, TUPLE, NONE, NEWTRUE, NEWFALSE,
+                    BININT2, BININT, BINFLOAT, BINUNICODE, APPEND, SETITEM,
+                    BINPUT, LONG_BINPUT, LONG_BINGET, FRAME, STOP)
+
+# Cache for _load_table(), keyed by (id(dispatch), overrides).  Each entry
+# keeps a copy of the dispatch dict it was built from, so that a dict
+# changed after the fact is noticed.
+_load_tables = {}
+
+# Number of values each opcode takes off the stack, for those that take
+# any without popping a mark first.  load() checks them against the
+# topmost mark before running the handler (indexing the stack, which
+# raises IndexError), so that a malformed pickle cannot consume values
+# that belong to an enclosing mark.
+_stack_args = [0] * 256
+for _op, _n in ((STOP, 1), (DUP, 1), (BINPERSID, 1), (READONLY_BUFFER, 1),
+                (TUPLE1, 1), (TUPLE2, 2), (TUPLE3, 3), (NEWOBJ, 2),
+                (NEWOBJ_EX, 3), (STACK_GLOBAL, 2), (REDUCE, 2), (PUT, 1),
+                (BINPUT, 1), (LONG_BINPUT, 1), (MEMOIZE, 1), (APPEND, 2),
+                (SETITEM, 3), (BUILD, 2)):
+    _stack_args[_op[0]] = _n
+del _op, _n
+
+def _invalid_load_key(code):
+    def load_invalid(self):
+        raise UnpicklingError("invalid load key, '%c'." % code)
+    return load_invalid
+
+def _load_table(dispatch, overrides=()):
+    # Return a 256-entry list of load handlers built from an Unpickler
+    # dispatch dict and (opcode, handler) overrides, and whether the fused
+    # main loop can be used with it.
+    key = (id(dispatch), overrides)
+    entry = _load_tables.get(key)
+    if entry is not None and entry[0] == dispatch:
+        return entry[1], entry[2]
+    table = [dispatch.get(code) or _invalid_load_key(code)
+             for code in range(256)]
+    for code, func in overrides:
+        table[code] = func
+    base = _Unpickler.dispatch
+    fused = all(table[op[0]] is base[op[0]] for op in _INLINED_OPCODES)
+    if len(_load_tables) >= 64:
+        _load_tables.clear()
+    _load_tables[key] = (dict(dispatch), table, fused)
+    return table, fused
+
 # Shorthands
 
-def _dump(obj, file, protocol=None, *, fix_imports=True, buffer_callback=None):
+def _dump(obj, file, protocol=None, *, fix_imports=True, buffer_callback=None,
+          stdlib_types=False, gc_mode=None, index_file=None):
     _Pickler(file, protocol, fix_imports=fix_imports,
-             buffer_callback=buffer_callback).dump(obj)
+             buffer_callback=buffer_callback,
+             stdlib_types=stdlib_types, gc_mode=gc_mode,
+             index_file=index_file).dump(obj)
 
-def _dumps(obj, protocol=None, *, fix_imports=True, buffer_callback=None):
+def _dumps(obj, protocol=None, *, fix_imports=True, buffer_callback=None,
+           stdlib_types=False, gc_mode=None, index_file=None):
     f = io.BytesIO()
     _Pickler(f, protocol, fix_imports=fix_imports,
-             buffer_callback=buffer_callback).dump(obj)
+             buffer_callback=buffer_callback,
+             stdlib_types=stdlib_types, gc_mode=gc_mode,
+             index_file=index_file).dump(obj)
     res = f.getvalue()
     assert isinstance(res, bytes_types)
     return res
 
 def _load(file, *, fix_imports=True, encoding="ASCII", errors="strict",
-          buffers=None):
-    return _Unpickler(file, fix_imports=fix_imports, buffers=buffers,
-                     encoding=encoding, errors=errors).load()
+          buffers=None, stdlib_types=False, allowed_globals=None,
+          shared_global_cache=False, intern_table=None, bytes_as="bytes",
+          gc_mode=None, select=None, select_refs="load", lazy_size=None):
+    unpickler = _Unpickler(file, fix_imports=fix_imports, buffers=buffers,
+                           encoding=encoding, errors=errors,
+                           stdlib_types=stdlib_types,
+                           allowed_globals=allowed_globals,
+                           shared_global_cache=shared_global_cache,
+                           intern_table=intern_table, bytes_as=bytes_as,
+                           gc_mode=gc_mode, lazy_size=lazy_size)
+    if select is not None:
+        return unpickler.load_select(select, refs=select_refs)
+    return unpickler.load()
 
 def _loads(s, /, *, fix_imports=True, encoding="ASCII", errors="strict",
-           buffers=None):
+           buffers=None, stdlib_types=False, allowed_globals=None,
+           shared_global_cache=False, intern_table=None, bytes_as="bytes",
+           gc_mode=None, select=None, select_refs="load", lazy_size=None):
     if isinstance(s, str):
         raise TypeError("Can't load pickle from unicode string")
     file = io.BytesIO(s)
-    return _Unpickler(file, fix_imports=fix_imports, buffers=buffers,
-                      encoding=encoding, errors=errors).load()
+    unpickler = _Unpickler(file, fix_imports=fix_imports, buffers=buffers,
+                           encoding=encoding, errors=errors,
+                           stdlib_types=stdlib_types,
+                           allowed_globals=allowed_globals,
+                           shared_global_cache=shared_global_cache,
+                           intern_table=intern_table, bytes_as=bytes_as,
+                           gc_mode=gc_mode, lazy_size=lazy_size)
+    if bytes_as == "memoryview":
+        # View s itself; file.getbuffer() would copy it.
+        unpickler._source = memoryview(s).cast('B').toreadonly()
+    if select is not None:
+        # Nothing reads the file after this, so its end is not needed.
+        return unpickler._load_select(select, select_refs, False)
+    return unpickler._load(False)
+
+# Walking pickles without loading them
+
+# How the argument of each opcode is encoded, for the code that walks a
+# pickle without loading it: the size of a fixed-size argument, the struct
+# format of the length prefix of a counted one, and the number of
+# newline-terminated lines of a text one.  None for invalid opcodes.
+_opcode_args = [None] * 256
+for _ops, _layout in (
+        ((MARK, STOP, POP, POP_MARK, DUP, NONE, BINPERSID, REDUCE, APPEND,
+          BUILD, DICT, EMPTY_DICT, APPENDS, LIST, EMPTY_LIST, OBJ, SETITEM,
+          TUPLE, EMPTY_TUPLE, SETITEMS, NEWOBJ, TUPLE1, TUPLE2, TUPLE3,
+          NEWTRUE, NEWFALSE, EMPTY_SET, ADDITEMS, FROZENSET, NEWOBJ_EX,
+          STACK_GLOBAL, MEMOIZE, NEXT_BUFFER, READONLY_BUFFER), (0, None, 0)),
+        ((PROTO, BININT1, BINGET, BINPUT, EXT1), (1, None, 0)),
+        ((BININT2, EXT2), (2, None, 0)),
+        ((BININT, LONG_BINGET, LONG_BINPUT, EXT4), (4, None, 0)),
+        ((BINFLOAT, FRAME), (8, None, 0)),
+        ((SHORT_BINSTRING, SHORT_BINBYTES, SHORT_BINUNICODE, LONG1),
+         (0, '<B', 0)),
+        ((BINSTRING, LONG4), (0, '<i', 0)),
+        ((BINBYTES, BINUNICODE), (0, '<I', 0)),
+        ((BINBYTES8, BINUNICODE8, BYTEARRAY8), (0, '<Q', 0)),
+        ((INT, LONG, FLOAT, STRING, UNICODE, PERSID, GET, PUT), (0, None, 1)),
+        ((GLOBAL, INST), (0, None, 2))):
+    for _op in _ops:
+        _opcode_args[_op[0]] = _layout
+del _ops, _layout, _op
+
+# The full length of each opcode with a fixed-size argument, and 0 for the
+# others, for the scanners' fast paths.
+_opcode_sizes = [1 + layout[0]
+                 if layout is not None and layout[1] is None and
+                 not layout[2] else 0
+                 for layout in _opcode_args]
+
+def _find_newline(data, pos):
+    # Return the offset of the first newline in data at or after pos, or
+    # raise ValueError.  data may be a memoryview, which has no find().
+    size = 256
+    while True:
+        chunk = bytes(data[pos:pos + size])
+        i = chunk.find(b'\n')
+        if i >= 0:
+            return pos + i
+        if len(chunk) < size:
+            raise ValueError("unterminated line")
+        pos += size
+        size *= 2
+
+def _opcode_arg(data, pos, layout):
+    # Return the offsets of the start and end of the argument of an opcode
+    # found at data[pos], without its length prefix or final newline, and
+    # of the next opcode.  Raise IndexError, ValueError or struct.error for
+    # a truncated argument.
+    size, prefix, lines = layout
+    if prefix is not None:
+        n, = unpack_from(prefix, data, pos)
+        if n < 0:
+            raise ValueError("negative length")
+        pos += calcsize(prefix)
+        end = pos + n
+    elif lines:
+        end = _find_newline(data, pos)
+        if lines == 2:
+            end = _find_newline(data, end + 1)
+        return pos, end, end + 1
+    else:
+        end = pos + size
+    if end > len(data):
+        raise IndexError("truncated argument")
+    return pos, end, end
+
+def _open_scan(file, copy):
+    # Return a byte view of the pickle data in file, a binary file or a
+    # bytes-like object, the offset of the pickle in it, and the mmap to
+    # pass to _close_scan() with the view.  The position of file is left
+    # unchanged.  A file that exposes no buffer and cannot be mapped is
+    # read into memory if copy is true; otherwise the view is None, as it
+    # is for files that cannot tell their position.
+    if not hasattr(file, 'read'):
+        return memoryview(file).cast('B'), 0, None
+    try:
+        pos = file.tell()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        if copy:
+            raise
+        return None, 0, None
+    view = _source_buffer(file)
+    if view is not None:
+        return view, pos, None
+    try:
+        fileno = file.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        fileno = None
+    if fileno is not None:
+        import mmap
+        try:
+            mapping = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            pass
+        else:
+            return memoryview(mapping), pos, mapping
+    if not copy:
+        return None, pos, None
+    view = memoryview(file.read()).cast('B')
+    file.seek(pos)
+    return view, 0, None
+
+def _close_scan(view, mapping):
+    view.release()
+    if mapping is not None:
+        mapping.close()
+
+def _pickle_end(data, pos):
+    # Return the offset just past the STOP opcode of the pickle found at
+    # data[pos], or None if it is truncated or has an invalid opcode.
+    sizes = _opcode_sizes
+    stop = STOP[0]
+    try:
+        while True:
+            code = data[pos]
+            size = sizes[code]
+            if size:
+                pos += size
+                if code == stop:
+                    return pos
+            else:
+                layout = _opcode_args[code]
+                if layout is None:
+                    return None
+                pos = _opcode_arg(data, pos + 1, layout)[2]
+    except (IndexError, ValueError, struct_error):
+        return None
+
+def _scan_globals(data, pos):
+    # Return the protocol of the pickle found at data[pos] and the list of
+    # the (module, name) pairs it refers to, in order of first reference.
+    # Only strings are followed through the stack and the memo, as far as
+    # STACK_GLOBAL needs them.  Scanning stops quietly at the first invalid
+    # opcode or truncated argument; load() reports them.
+    refs = {}
+    proto = 0
+    strings = {}        # memo key -> (start, end) of a memoized string
+    memo_len = 0
+    prev = last = None  # (start, end) of the last two strings pushed
+    try:
+        while True:
+            code = data[pos]
+            layout = _opcode_args[code]
+            if layout is None:
+                break
+            start, end, pos = _opcode_arg(data, pos + 1, layout)
+            if code == STOP[0]:
+                break
+            elif code == MEMOIZE[0]:
+                if last is not None:
+                    strings[memo_len] = last
+                memo_len += 1
+                continue
+            elif code in (BINPUT[0], LONG_BINPUT[0], PUT[0]):
+                if code == PUT[0]:
+                    key = int(bytes(data[start:end]))
+                else:
+                    key = int.from_bytes(data[start:end], 'little')
+                if last is not None:
+                    strings[key] = last
+                else:
+                    strings.pop(key, None)
+                continue
+            elif code == FRAME[0]:
+                continue
+            value = None
+            if code in (SHORT_BINUNICODE[0], BINUNICODE[0], BINUNICODE8[0]):
+                value = (start, end)
+            elif code in (BINGET[0], LONG_BINGET[0]):
+                value = strings.get(int.from_bytes(data[start:end], 'little'))
+            elif code == GET[0]:
+                value = strings.get(int(bytes(data[start:end])))
+            elif code == PROTO[0]:
+                proto = data[start]
+            elif code == GLOBAL[0] or code == INST[0]:
+                line = str(data[start:end], "utf-8")
+                refs[tuple(line.split("\n"))] = None
+            elif code == STACK_GLOBAL[0]:
+                if prev is not None and last is not None:
+                    module, name = (str(data[s:e], 'utf-8', 'surrogatepass')
+                                    for s, e in (prev, last))
+                    refs[module, name] = None
+            elif code in (EXT1[0], EXT2[0], EXT4[0]):
+                key = _inverted_registry.get(
+                    int.from_bytes(data[start:end], 'little'))
+                if key:
+                    refs[key] = None
+            prev, last = last, value
+    except (IndexError, ValueError, struct_error):
+        pass
+    return proto, list(refs)
+
+def _scan_list_gets(data, pos):
+    # For iter_load(): return the memo key of the empty list that the
+    # pickle found at data[pos] starts with, or None if the list is not
+    # memoized, and the set of the memo keys its GET opcodes read.  Return
+    # None if the pickle does not start with an empty list or is invalid.
+    list_key = None
+    try:
+        while data[pos] == PROTO[0] or data[pos] == FRAME[0]:
+            pos += _opcode_sizes[data[pos]]
+        if data[pos] == EMPTY_LIST[0]:
+            pos += 1
+        elif data[pos] == MARK[0] and data[pos + 1] == LIST[0]:
+            pos += 2
+        else:
+            return None
+        code = data[pos]
+        if code == MEMOIZE[0]:
+            list_key = 0
+        elif code == BINPUT[0]:
+            list_key = data[pos + 1]
+        elif code == LONG_BINPUT[0]:
+            list_key, = unpack_from('<I', data, pos + 1)
+        elif code == PUT[0]:
+            start, end, _ = _opcode_arg(data, pos + 1, _opcode_args[code])
+            list_key = int(bytes(data[start:end]))
+
+        gets = set()
+        add = gets.add
+        sizes = _opcode_sizes
+        binget = BINGET[0]
+        long_binget = LONG_BINGET[0]
+        short_binunicode = SHORT_BINUNICODE[0]
+        stop = STOP[0]
+        while True:
+            code = data[pos]
+            size = sizes[code]
+            if size:
+                if code == binget:
+                    add(data[pos + 1])
+                elif code == long_binget:
+                    add(unpack_from('<I', data, pos + 1)[0])
+                elif code == stop:
+                    return list_key, gets
+                pos += size
+            elif code == short_binunicode:
+                pos += 2 + data[pos + 1]
+            else:
+                layout = _opcode_args[code]
+                if layout is None:
+                    return None
+                start, end, pos = _opcode_arg(data, pos + 1, layout)
+                if code == GET[0]:
+                    add(int(bytes(data[start:end])))
+    except (IndexError, ValueError, struct_error):
+        return None
+
+def _import_modules(modules):
+    # Import modules in order, returning the seconds each import took.
+    from time import perf_counter
+    times = []
+    for module in modules:
+        start = perf_counter()
+        try:
+            __import__(module, level=0)
+        except Exception:
+            # load() reports the error, if the global is needed.
+            continue
+        times.append((module, perf_counter() - start))
+    return times
+
+def prefetch_globals(file, *, fix_imports=True, allowed_globals=None,
+                     max_workers=1):
+    """Import the modules of the globals a pickle refers to.
+
+    *file* is a binary file positioned at the start of a pickle, or a
+    bytes-like object holding one.  The pickle is scanned for the globals
+    named by its GLOBAL, INST, STACK_GLOBAL and EXT opcodes, without
+    building any object; their modules are then imported and the globals
+    looked up in the process-wide cache used by Unpicklers created with
+    shared_global_cache=True.  The position of *file* is left unchanged;
+    real files are scanned through mmap if possible.
+
+    If *allowed_globals* is not None, only the globals it contains are
+    prefetched, as for Unpickler.  If *max_workers* is greater than 1,
+    modules of different top-level packages are imported on that many
+    threads.
+
+    Return a dict mapping the name of each module imported, in the order
+    the pickle first refers to them, to the time in seconds its import
+    took, which is close to 0 for modules already imported.  Modules and
+    globals that cannot be found are left for load() to report.
+
+    Like load(), this imports the modules named by the pickle; only use it
+    on trusted data or with *allowed_globals*.
+    """
+    if allowed_globals is not None:
+        allowed_globals = frozenset(allowed_globals)
+    view, pos, mapping = _open_scan(file, True)
+    try:
+        proto, refs = _scan_globals(view, pos)
+    finally:
+        _close_scan(view, mapping)
+
+    globals_ = []
+    modules = {}
+    for module, name in refs:
+        location = _compat_global(module, name, proto, fix_imports)
+        if allowed_globals is not None and location not in allowed_globals:
+            continue
+        globals_.append((module, name))
+        modules[location[0]] = None
+
+    if max_workers > 1 and len(modules) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        packages = {}
+        for module in modules:
+            packages.setdefault(module.partition('.')[0], []).append(module)
+        with ThreadPoolExecutor(max_workers) as executor:
+            times = dict(pair for group in executor.map(_import_modules,
+                                                        packages.values())
+                         for pair in group)
+        times = {module: times[module] for module in modules
+                 if module in times}
+    else:
+        times = dict(_import_modules(modules))
+
+    for module, name in globals_:
+        try:
+            _find_global_cached(module, name, proto, fix_imports)
+        except Exception:
+            pass
+    return times
+
+# Scanning the structure of pickles
+
+class PickleSpan:
+    """Where a value lies in a pickle, as found by scan().
+
+    *start* and *end* are the offsets in the scanned data of the first
+    opcode that builds the value and just past the last one, counting the
+    opcodes that memoize it, set its state or add items to it.  The other
+    attributes are found by scanning the range of the span the first time
+    they are asked for.
+    """
+
+    __slots__ = ('scan', 'start', 'end', '_kind', '_entries', '_items',
+                 '_index')
+
+    def __init__(self, scan, start, end, kind=None, entries=None):
+        self.scan = scan
+        self.start = start
+        self.end = end
+        self._kind = kind
+        # The (start, end) offsets of the values this one is built from,
+        # or None until the span is scanned.
+        self._entries = entries
+        self._items = None
+        # The items, with dict pairs flattened, and their ends, for find().
+        self._index = None
+
+    def __repr__(self):
+        return "<PickleSpan %s %d:%d>" % (self.kind, self.start, self.end)
+
+    def _scan(self):
+        _, self._kind, self._entries, _ = _scan_values(
+            self.scan.data, self.start, self.end, None)
+
+    def _find_index(self, offset):
+        # Scan the span up to the item holding offset, for find(), and
+        # return the items scanned and their ends, or None if they are all
+        # of them, which are then kept, or if the span is not known to
+        # hold a dict or list without scanning all of it.
+        if _span_filled(self.scan, self.start, self.end) is None:
+            return None
+
+        def until(kind, items, same):
+            return items and items[-1][1] > offset
+        _, kind, entries, stop = _scan_values(self.scan.data, self.start,
+                                              self.end, None, until)
+        if stop == self.end:
+            self._kind = kind
+            self._entries = entries
+            return None
+        items = self.scan._spans(entries)
+        return items, [item.end for item in items]
+
+    @property
+    def size(self):
+        """The number of bytes of the span."""
+        return self.end - self.start
+
+    @property
+    def kind(self):
+        """How the value is built.
+
+        "atom" for None, bools, numbers, strings and bytes; "tuple",
+        "list", "dict", "set" and "frozenset" for containers; "object" for
+        the result of REDUCE, NEWOBJ, NEWOBJ_EX, OBJ and INST; "global" for
+        GLOBAL, STACK_GLOBAL and the EXT opcodes; "ref" for a memo GET;
+        "persistent" for a persistent ID and "buffer" for an out-of-band
+        buffer.
+        """
+        if self._kind is None:
+            self._scan()
+        return self._kind
+
+    @property
+    def items(self):
+        """The spans of the values this one is built from, in order.
+
+        These are the items of tuples, lists, sets and frozensets, the
+        (key, value) pairs of dicts, and for objects the callable and its
+        arguments followed by what BUILD, APPEND, APPENDS, SETITEM and
+        SETITEMS add to the object.  None for the other kinds.
+        """
+        items = self._items
+        if items is None:
+            if self._entries is None:
+                self._scan()
+            if self._kind not in _SCAN_CONTAINERS:
+                return None
+            items = self.scan._spans(self._entries)
+            if self._kind == "dict":
+                items = list(zip(items[::2], items[1::2]))
+            self._items = items
+        return items
+
+    @property
+    def value(self):
+        """The value of an atom, or the (module, name) pair of a global.
+
+        Only the opcodes of the span are decoded.  The pair of an EXT
+        opcode is looked up in the extension registry and is None if the
+        code is not registered.  TypeError is raised for other kinds.
+        """
+        data = self.scan.data
+        kind = self.kind
+        if kind == "atom":
+            return loads_data(bytes(data[self.start:self.end]) + STOP)
+        if kind != "global":
+            raise TypeError("a %s span has no value" % kind)
+        code = data[self.start]
+        if code == GLOBAL[0] or code in (EXT1[0], EXT2[0], EXT4[0]):
+            start, end, _ = _opcode_arg(data, self.start + 1,
+                                        _opcode_args[code])
+            if code == GLOBAL[0]:
+                return tuple(str(data[start:end], "utf-8").split("\n"))
+            return _inverted_registry.get(
+                int.from_bytes(data[start:end], 'little'))
+        module, name = self.scan._spans(self._entries)
+        return module.value, name.value
+
+    @property
+    def defines(self):
+        """The memo keys defined by the opcodes of the span, in order."""
+        def_pos, def_keys, _, _, _ = self.scan._memo_index()
+        return def_keys[bisect_left(def_pos, self.start):
+                        bisect_left(def_pos, self.end)]
+
+    @property
+    def refs(self):
+        """The memo keys read by the span that are defined before it.
+
+        These are the values of the rest of the pickle that the span
+        depends on.
+        """
+        start = self.start
+        end = self.end
+        def_pos, def_keys, get_pos, get_defs, _ = self.scan._memo_index()
+        outside = {d for d in get_defs[bisect_left(get_pos, start):
+                                       bisect_left(get_pos, end)]
+                   if not start <= d < end}
+        return [def_keys[bisect_left(def_pos, d)] for d in sorted(outside)]
+
+    @property
+    def shared(self):
+        """The memo keys defined by the span that are read after it."""
+        def_pos, def_keys, _, _, last_get = self.scan._memo_index()
+        i = bisect_left(def_pos, self.start)
+        j = bisect_left(def_pos, self.end)
+        return [key for d, key in zip(def_pos[i:j], def_keys[i:j])
+                if last_get.get(d, -1) >= self.end]
+
+class PickleScan:
+    """The structure of a pickle, as returned by scan().
+
+    *data* is the scanned bytes-like object, *start* and *end* are the
+    offsets of the first opcode of the pickle and just past its STOP
+    opcode, *proto* is its protocol, 0 when it has no PROTO opcode, and
+    *root* is the PickleSpan of the value it holds.  *frames* lists the
+    offsets of its FRAME opcodes.
+    """
+
+    def __init__(self, data, start):
+        self.data = data
+        self.start = start
+        self.end = None
+        self.proto = 0
+        self.root = None
+        self.frames = []
+        self._frame_set = None
+        self._memo = None
+        self._last_def = None
+
+    def find(self, offset):
+        """Return the innermost span holding the opcode at *offset*.
+
+        Return None if *offset* is not inside the root span.
+        """
+        span = self.root
+        if not span.start <= offset < span.end:
+            return None
+        while True:
+            index = span._index
+            if index is None and span._entries is None:
+                index = span._find_index(offset)
+            if index is None:
+                items = span.items or []
+                if span.kind == "dict":
+                    items = [x for pair in items for x in pair]
+                index = span._index = (items, [item.end for item in items])
+            items, ends = index
+            i = bisect_left(ends, offset + 1)
+            if i == len(items) or items[i].start > offset:
+                return span
+            span = items[i]
+
+    def memo_span(self, key):
+        """Return the span of the value last memoized under *key*.
+
+        KeyError is raised if the pickle defines no such key.
+        """
+        last_def = self._last_def
+        if last_def is None:
+            def_pos, def_keys, _, _, _ = self._memo_index()
+            last_def = self._last_def = dict(zip(def_keys, def_pos))
+        return self.find(last_def[key])
+
+    def _spans(self, entries):
+        # Make the spans of a list of (start, end) offsets found by
+        # _scan_values().  The end of a value is taken to be the start of
+        # the next one, so it takes back any FRAME opcode between them.
+        frames = self._frame_set
+        if frames is None:
+            frames = self._frame_set = frozenset(self.frames)
+        spans = []
+        for start, end in entries:
+            if end - 9 in frames and end - 9 >= start:
+                end -= 9
+            spans.append(PickleSpan(self, start, end))
+        return spans
+
+    def _span(self, start, end):
+        # Like _spans() for a single value.
+        return self._spans(((start, end),))[0]
+
+    def _memo_index(self):
+        # Return the offsets of the memo definitions, in order, their keys,
+        # the offsets of the GETs, the offsets of the definitions they
+        # read, and a dict mapping the offset of each definition read to
+        # that of its last GET.
+        if self._memo is None:
+            self._memo = _scan_memo(self.data, self.start, self.end)[:5]
+        return self._memo
+
+# The kinds of spans that have items.
+_SCAN_CONTAINERS = frozenset(["tuple", "list", "dict", "set", "frozenset",
+                              "object"])
+
+# The kind of the values built by each opcode.
+_scan_kinds = [None] * 256
+for _ops, _kind in (
+        ((NONE, NEWTRUE, NEWFALSE, INT, BININT, BININT1, BININT2, LONG,
+          LONG1, LONG4, FLOAT, BINFLOAT, STRING, BINSTRING, SHORT_BINSTRING,
+          UNICODE, BINUNICODE, SHORT_BINUNICODE, BINUNICODE8, BINBYTES,
+          SHORT_BINBYTES, BINBYTES8, BYTEARRAY8), "atom"),
+        ((EMPTY_TUPLE, TUPLE, TUPLE1, TUPLE2, TUPLE3), "tuple"),
+        ((EMPTY_LIST, LIST), "list"),
+        ((EMPTY_DICT, DICT), "dict"),
+        ((EMPTY_SET,), "set"),
+        ((FROZENSET,), "frozenset"),
+        ((REDUCE, NEWOBJ, NEWOBJ_EX, OBJ, INST), "object"),
+        ((GLOBAL, STACK_GLOBAL, EXT1, EXT2, EXT4), "global"),
+        ((GET, BINGET, LONG_BINGET), "ref"),
+        ((PERSID, BINPERSID), "persistent"),
+        ((NEXT_BUFFER,), "buffer")):
+    for _op in _ops:
+        _scan_kinds[_op[0]] = _kind
+del _ops, _kind, _op
+
+_unpack_uint4 = Struct('<I').unpack_from
+
+# The opcodes that push a value without popping any or reading the memo.
+_scan_pushes = [kind is not None and kind != "ref" for kind in _scan_kinds]
+for _op in (TUPLE, TUPLE1, TUPLE2, TUPLE3, LIST, DICT, FROZENSET, REDUCE,
+            NEWOBJ, NEWOBJ_EX, OBJ, INST, STACK_GLOBAL, BINPERSID):
+    _scan_pushes[_op[0]] = False
+del _op
+
+# The opcodes that may start a value right above others.
+_scan_starts = list(_scan_pushes)
+for _op in (MARK, GET, BINGET, LONG_BINGET):
+    _scan_starts[_op[0]] = True
+del _op
+
+# How _scan_settled() follows the opcodes that neither set nor pop a mark,
+# nor are DUP: the number of values they read from the top of the stack,
+# or -1 for the others, and how much longer they leave it.
+_settle_reach = [0 if start else -1 for start in _scan_starts]
+_settle_grow = [1 if start else 0 for start in _scan_starts]
+for _code, _n in enumerate(_stack_args):
+    if _n:
+        _settle_reach[_code] = _n
+        _settle_grow[_code] = 1 - _n
+for _op in (MARK, DUP, STOP):
+    _settle_reach[_op[0]] = -1
+_settle_reach[PROTO[0]] = 0
+_settle_grow[PROTO[0]] = 0
+del _code, _n, _op
+
+def _scan_record(items, base, stack, n, stop):
+    # Bring the entries from items[base] on up to date with the values
+    # stack[1:n] of _scan_values(), the last of which ends at stop, and
+    # return the index of the first entry that changed.  A value that
+    # starts and ends where it did has not changed, nor have those below
+    # it, as values above it cannot be consumed without it.
+    k = min(len(items) - base, n - 1)
+    while k:
+        start, end = items[base + k - 1]
+        if start == stack[k] and end == (stack[k + 1] if k + 1 < n
+                                         else stop):
+            break
+        k -= 1
+    del items[base + k:]
+    starts = stack[k + 1:n]
+    items += zip(starts, starts[1:] + [stop])
+    return base + k
+
+def _scan_settled(data, pos, end, low, frames, limit=None):
+    # Follow the opcodes of data[pos:end], the first of which pushes a
+    # value at index low of the stack of _scan_values(), above the mark
+    # of a batch of items for the value at the bottom.  Return the offset
+    # just past the opcode that adds the batch to it and the (start, end)
+    # offsets of the values it adds from index low on.  If an opcode
+    # before then reads a value below index low, which the values there
+    # are then part of, or if the data is invalid or ends first, return
+    # the offset where the walk stopped and None.  Only the length of the
+    # stack, the marks and where the values of the batch start are
+    # followed, and the offsets of the FRAME opcodes are added to frames
+    # unless it is None.  If limit is given and the walk gets past it
+    # with the first value still the only one below any mark, return None
+    # and None.
+    sizes = _opcode_sizes
+    reach = _settle_reach
+    grow = _settle_grow
+    starts_value = _scan_starts
+    n = low
+    marks = []          # lengths of the stack at the marks set since pos
+    floor = low
+    starts = []         # the offsets where stack[low:] start
+    first = pos
+    stop = end if limit is None else min(limit, end)
+    try:
+        while True:
+            while pos < stop:
+                code = data[pos]
+                if not marks and starts_value[code]:
+                    del starts[n - low:]
+                    starts.append(pos)
+                size = sizes[code]
+                if size:
+                    pos += size
+                else:
+                    layout = _opcode_args[code]
+                    if layout is None:
+                        return pos, None
+                    pos = _opcode_arg(data, pos + 1, layout)[2]
+                k = reach[code]
+                if k >= 0:
+                    if n - k < floor:
+                        return pos, None
+                    n += grow[code]
+                elif code == 0x28:                  # MARK
+                    marks.append(n)
+                    floor = n
+                elif code == 0x95:                  # FRAME
+                    if frames is not None:
+                        frames.append(pos - 9)
+                elif code == 0x75 or code == 0x65 or code == 0x90:
+                    # SETITEMS, APPENDS, ADDITEMS
+                    if not marks:
+                        del starts[n - low:]
+                        return pos, list(zip(starts, starts[1:] + [pos - 1]))
+                    n = marks.pop()
+                    if n <= low:
+                        return pos, None
+                    floor = marks[-1] if marks else low
+                elif code == 0x32:                  # DUP
+                    if n - 1 < floor:
+                        return pos, None
+                    if not marks:
+                        del starts[n - low:]
+                        starts.append(starts[-1])
+                    n += 1
+                elif code == 0x30 and marks and n == marks[-1]:
+                    marks.pop()                     # POP of a mark
+                    floor = marks[-1] if marks else low
+                elif code == 0x30:                  # POP
+                    if n - 1 < floor:
+                        return pos, None
+                    n -= 1
+                elif marks and code != 0x2e:
+                    # TUPLE, LIST, DICT, FROZENSET, OBJ, INST, POP_MARK
+                    n = marks.pop() + (code != 0x31)
+                    floor = marks[-1] if marks else low
+                else:
+                    return pos, None
+            if stop == end:
+                break
+            if starts[0] == first and (marks[0] if marks else n) == low + 1:
+                return None, None
+            stop = end
+    except (IndexError, ValueError, struct_error):
+        pass
+    return pos, None
+
+def _scan_values(data, pos, end, scan, until=None):
+    # Follow the opcodes of data[pos:end] on a stack holding the offset of
+    # the first opcode of each value instead of the value.  Return the
+    # offset of the value on top of the stack when scanning stops, its
+    # kind and the (start, end) offsets of the values it is built from if
+    # it is the only value on the stack, None and None otherwise, and the
+    # offset where scanning stopped.
+    #
+    # If scan is a PickleScan, scanning stops after STOP, memo keys are
+    # checked and the protocol, frames and end are recorded in it.
+    # Otherwise data[pos:end] must hold a single value.
+    #
+    # until, if given, is called with the kind of the value at the bottom
+    # of the stack, the (start, end) offsets of the values added to it so
+    # far, and the number of them that are the same as at the last call,
+    # each time APPEND, APPENDS, SETITEM, SETITEMS, ADDITEMS or BUILD adds
+    # to it.  If until returns true, scanning stops there, and the end of
+    # the pickle is not recorded.  Values still on the stack cannot be
+    # told complete before then, as these opcodes could take the next ones
+    # with them.  But in a batch of items for a dict or list, each time a
+    # value starts, until is also called as if those below it were added;
+    # if it returns true, the rest of the batch is followed by
+    # _scan_settled(), and scanning stops after it unless an opcode there
+    # reaches below the new value.  Values are not guessed complete again
+    # before the end of that walk, so that no opcode is walked over twice.
+    # If until returns an offset instead of True, and the walk gets past
+    # it with the new value still the only one above the mark, None is
+    # returned for each of the results.
+    stack = []
+    append = stack.append
+    marks = []          # lengths of the stack at each mark
+    mark_pos = []       # and the offsets of the MARK opcodes
+    # Length of the stack at the topmost mark; values below it may not be
+    # consumed.  Opcodes that take k values check this by indexing
+    # stack[fence + k - 1], which raises IndexError.
+    fence = 0
+    sizes = _opcode_sizes
+    pushes = _scan_pushes
+    unpack_uint4 = _unpack_uint4
+    # The opcode and offset of the last value built from others at the
+    # bottom of the stack, and the (start, end) offsets of the values the
+    # bottom value holds.  Plain pushes leave them alone: a value at the
+    # bottom that was not built by the last builder was pushed.
+    bottom = bottom_start = None
+    items = []
+    # The index in items of the first value of the batch for the bottom
+    # value, and of the first entry changed since the last call to until.
+    base = changed = 0
+    # The index in items of the first entry only guessed complete, if any.
+    guess = None
+    # The offset from which values may be guessed complete.
+    resume = pos if until is not None else end
+    starts_value = _scan_starts
+    check_memo = scan is not None
+    # The memo keys are range(memo_len), or memo_keys once PUT has defined
+    # a key out of sequence.
+    memo_len = 0
+    memo_keys = None
+    start = pos
+    code = None
+    try:
+        while pos < end:
+            start = pos
+            code = data[pos]
+            if fence == 1 and start >= resume and starts_value[code] and \
+                    len(marks) == 1:
+                # The values above the bottom one may all be complete.
+                n = len(stack)
+                changed = min(changed,
+                              _scan_record(items, base, stack, n, start))
+                guess = base
+                kind = _scan_root_kind(data, stack[0], bottom, bottom_start)
+                if kind == "list" or kind == "dict":
+                    done = until(kind, items, changed)
+                    changed = len(items)
+                    if done:
+                        resume, rest = _scan_settled(
+                            data, start, end, n,
+                            scan.frames if scan is not None else None,
+                            None if done is True else done)
+                        if resume is None:
+                            return None, None, None, None
+                        if rest is not None:
+                            if n > 1:
+                                # Values pushed and popped after the last
+                                # one are part of it.
+                                items[-1] = (items[-1][0], rest[0][0] if rest
+                                             else resume - 1)
+                            items += rest
+                            return stack[0], kind, items, resume
+            if pushes[code]:
+                append(start)
+                size = sizes[code]
+                if size:
+                    pos += size
+                elif code == 0x8c or code == 0x43 or code == 0x8a or \
+                        code == 0x55:
+                    # SHORT_BINUNICODE, SHORT_BINBYTES, LONG1,
+                    # SHORT_BINSTRING
+                    pos += 2 + data[pos + 1]
+                elif code == 0x58 or code == 0x42:
+                    # BINUNICODE, BINBYTES
+                    pos += 5 + unpack_uint4(data, pos + 1)[0]
+                else:
+                    pos = _opcode_arg(data, pos + 1, _opcode_args[code])[2]
+            elif code == 0x94:                  # MEMOIZE
+                pos += 1
+                stack[-1]
+                if memo_keys is None:
+                    memo_len += 1
+                else:
+                    memo_keys.add(len(memo_keys))
+            elif code == 0x68 or code == 0x6a:  # BINGET, LONG_BINGET
+                if code == 0x68:
+                    key = data[pos + 1]
+                    pos += 2
+                else:
+                    key, = unpack_uint4(data, pos + 1)
+                    pos += 5
+                if key >= memo_len and check_memo and (
+                        memo_keys is None or key not in memo_keys):
+                    raise UnpicklingError("Memo value not found at index %d"
+                                          % key)
+                append(start)
+            elif code == 0x71 or code == 0x72:  # BINPUT, LONG_BINPUT
+                if code == 0x71:
+                    key = data[pos + 1]
+                    pos += 2
+                else:
+                    key, = unpack_uint4(data, pos + 1)
+                    pos += 5
+                stack[-1]
+                if memo_keys is not None:
+                    memo_keys.add(key)
+                elif key == memo_len:
+                    memo_len += 1
+                elif key > memo_len:
+                    memo_keys = set(range(memo_len))
+                    memo_keys.add(key)
+            elif code == 0x28:                  # MARK
+                pos += 1
+                fence = len(stack)
+                if fence == 1:
+                    if guess is not None:
+                        del items[guess:]
+                        changed = min(changed, guess)
+                        guess = None
+                    base = len(items)
+                marks.append(fence)
+                mark_pos.append(start)
+            elif code == 0x75 or code == 0x65 or code == 0x90:
+                # SETITEMS, APPENDS, ADDITEMS
+                pos += 1
+                if not marks:
+                    raise UnpicklingError("could not find MARK")
+                if fence == 0 or (len(marks) > 1 and marks[-2] == fence):
+                    raise UnpicklingError("unpickling stack underflow")
+                if code == 0x75 and (len(stack) - fence) & 1:
+                    raise UnpicklingError("odd number of items for SETITEMS")
+                if fence == 1:
+                    if until is None:
+                        starts = stack[1:]
+                        items += zip(starts, starts[1:] + [start])
+                    else:
+                        changed = min(changed, _scan_record(
+                            items, base, stack, len(stack), start))
+                        guess = None
+                del stack[fence:]
+                marks.pop()
+                mark_pos.pop()
+                fence = marks[-1] if marks else 0
+                if until is not None and len(stack) == 1:
+                    kind = _scan_root_kind(data, stack[0], bottom,
+                                           bottom_start)
+                    done = until(kind, items, changed)
+                    changed = len(items)
+                    if done:
+                        return stack[0], kind, items, pos
+            elif 0x85 <= code <= 0x87:          # TUPLE1, TUPLE2, TUPLE3
+                pos += 1
+                n = code - 0x84
+                stack[fence + n - 1]
+                if len(stack) == n:
+                    bottom = code
+                    bottom_start = stack[0]
+                    items = list(zip(stack, stack[1:] + [start]))
+                    changed = 0
+                del stack[len(stack) - n + 1:]
+            elif code == 0x61 or code == 0x73 or code == 0x62:
+                # APPEND, SETITEM, BUILD
+                pos += 1
+                n = 2 if code == 0x73 else 1
+                stack[fence + n]
+                if len(stack) == n + 1:
+                    starts = stack[1:]
+                    items += zip(starts, starts[1:] + [start])
+                del stack[-n:]
+                if until is not None and len(stack) == 1:
+                    kind = _scan_root_kind(data, stack[0], bottom,
+                                           bottom_start)
+                    done = until(kind, items, changed)
+                    changed = len(items)
+                    if done:
+                        return stack[0], kind, items, pos
+            elif code == 0x52 or code == 0x81 or code == 0x92 or \
+                    code == 0x93 or code == 0x51:
+                # REDUCE, NEWOBJ, NEWOBJ_EX, STACK_GLOBAL, BINPERSID
+                pos += 1
+                n = 3 if code == 0x92 else 1 if code == 0x51 else 2
+                stack[fence + n - 1]
+                if len(stack) == n:
+                    bottom = code
+                    bottom_start = stack[0]
+                    items = list(zip(stack, stack[1:] + [start]))
+                    changed = 0
+                del stack[len(stack) - n + 1:]
+            elif code == 0x95:                  # FRAME
+                unpack_from('<Q', data, pos + 1)
+                pos += 9
+                if scan is not None:
+                    scan.frames.append(start)
+            elif code == 0x2e:                  # STOP
+                pos += 1
+                stack[fence]
+                if scan is None:
+                    raise UnpicklingError("STOP inside a value")
+                break
+            elif code == 0x74 or code == 0x6c or code == 0x64 or \
+                    code == 0x91 or code == 0x6f or code == 0x69:
+                # TUPLE, LIST, DICT, FROZENSET, OBJ, INST
+                pos = _opcode_arg(data, pos + 1, _opcode_args[code])[2]
+                if not marks:
+                    raise UnpicklingError("could not find MARK")
+                if code == 0x64 and (len(stack) - fence) & 1:
+                    raise UnpicklingError("odd number of items for DICT")
+                if code == 0x6f:
+                    stack[fence]
+                if fence == 0:
+                    bottom = code
+                    bottom_start = mark_pos[-1]
+                    items = list(zip(stack, stack[1:] + [start]))
+                    changed = 0
+                elif fence == 1 and guess is not None:
+                    del items[guess:]
+                    changed = min(changed, guess)
+                    guess = None
+                del stack[fence:]
+                append(mark_pos.pop())
+                marks.pop()
+                fence = marks[-1] if marks else 0
+            elif code == 0x67 or code == 0x70:  # GET, PUT
+                a, b, pos = _opcode_arg(data, pos + 1, _opcode_args[code])
+                key = int(bytes(data[a:b]))
+                if code == 0x67:
+                    if key >= memo_len and check_memo and (
+                            memo_keys is None or key not in memo_keys):
+                        raise UnpicklingError("Memo value not found at "
+                                              "index %d" % key)
+                    append(start)
+                    continue
+                if key < 0:
+                    raise ValueError("negative PUT argument")
+                stack[-1]
+                if memo_keys is not None:
+                    memo_keys.add(key)
+                elif key == memo_len:
+                    memo_len += 1
+                elif key > memo_len:
+                    memo_keys = set(range(memo_len))
+                    memo_keys.add(key)
+            elif code == 0x98:                  # READONLY_BUFFER
+                pos += 1
+                stack[fence]
+            elif code == 0x30:                  # POP
+                pos += 1
+                if marks and len(stack) == fence:
+                    if fence == 1 and guess is not None:
+                        del items[guess:]
+                        changed = min(changed, guess)
+                        guess = None
+                    marks.pop()
+                    mark_pos.pop()
+                    fence = marks[-1] if marks else 0
+                else:
+                    del stack[-1]
+                    if not stack:
+                        items = []
+                        changed = 0
+            elif code == 0x31:                  # POP_MARK
+                pos += 1
+                if not marks:
+                    raise UnpicklingError("could not find MARK")
+                if fence == 1 and guess is not None:
+                    del items[guess:]
+                    changed = min(changed, guess)
+                    guess = None
+                del stack[fence:]
+                if not stack:
+                    items = []
+                    changed = 0
+                marks.pop()
+                mark_pos.pop()
+                fence = marks[-1] if marks else 0
+            elif code == 0x32:                  # DUP
+                pos += 1
+                append(stack[-1])
+            elif code == 0x80:                  # PROTO
+                proto = data[pos + 1]
+                pos += 2
+                if not 0 <= proto <= HIGHEST_PROTOCOL:
+                    raise ValueError("unsupported pickle protocol: %d" %
+                                     proto)
+                if scan is not None:
+                    scan.proto = proto
+            else:
+                raise UnpicklingError("invalid load key, '%c'." % code)
+    except (IndexError, ValueError, struct_error) as exc:
+        if start + 1 >= len(data) or pos > len(data):
+            raise UnpicklingError("pickle data was truncated") from None
+        if isinstance(exc, IndexError):
+            raise UnpicklingError("unpickling stack underflow") from None
+        raise UnpicklingError(str(exc)) from None
+    if scan is not None:
+        if code != 0x2e:
+            raise UnpicklingError("pickle data was truncated")
+        scan.end = pos
+    elif pos != end or len(stack) != 1 or marks:
+        raise UnpicklingError("the range does not hold a single value")
+    if len(stack) != 1:
+        return stack[-1], None, None, pos
+    start = stack[0]
+    return (start, _scan_root_kind(data, start, bottom, bottom_start),
+            items, pos)
+
+def _scan_root_kind(data, start, bottom, bottom_start):
+    # The kind of the value at the bottom of the stack of _scan_values():
+    # that of the last opcode that built a value there, if it built this
+    # one, else that of its first opcode.
+    if start == bottom_start:
+        return _scan_kinds[bottom]
+    return _scan_kinds[data[start]]
+
+# The opcodes that read or define memo entries.
+_scan_memo_ops = [False] * 256
+for _op in (MEMOIZE, GET, BINGET, LONG_BINGET, PUT, BINPUT, LONG_BINPUT):
+    _scan_memo_ops[_op[0]] = True
+del _op
+
+def _scan_memo(data, pos, end, index=None):
+    # For PickleScan._memo_index(): index the memo opcodes of the pickle in
+    # data[pos:end].  Return the offsets of the definitions, their keys,
+    # the offsets of the GETs, the offsets of the definitions they read, a
+    # dict mapping the offset of each definition read to that of its last
+    # GET, a dict mapping keys to the offset of their last definition and
+    # the offset where indexing stopped.  If index is such a result for the
+    # data before pos, it is extended instead.  A scan that stopped early
+    # has not checked the data, so UnpicklingError is raised for opcodes
+    # that are not valid.
+    if index is None:
+        index = [[], [], [], [], {}, {}, pos]
+    def_pos, def_keys, get_pos, get_defs, last_get, memo, _ = index
+    sizes = _opcode_sizes
+    memo_ops = _scan_memo_ops
+    unpack_uint4 = _unpack_uint4
+    try:
+        while pos < end:
+            code = data[pos]
+            size = sizes[code]
+            if not memo_ops[code]:
+                if size:
+                    pos += size
+                elif code == 0x8c or code == 0x43:
+                    # SHORT_BINUNICODE, SHORT_BINBYTES
+                    pos += 2 + data[pos + 1]
+                elif code == 0x58 or code == 0x42:
+                    # BINUNICODE, BINBYTES
+                    pos += 5 + unpack_uint4(data, pos + 1)[0]
+                else:
+                    layout = _opcode_args[code]
+                    if layout is None:
+                        raise UnpicklingError("invalid load key, '%c'." %
+                                              code)
+                    pos = _opcode_arg(data, pos + 1, layout)[2]
+                continue
+            key = None
+            if size:
+                if code == 0x94:                # MEMOIZE
+                    key = len(memo)
+                elif code == 0x68:              # BINGET
+                    d = memo[data[pos + 1]]
+                    get_pos.append(pos)
+                    get_defs.append(d)
+                    last_get[d] = pos
+                elif code == 0x71:              # BINPUT
+                    key = data[pos + 1]
+                else:                           # LONG_BINGET, LONG_BINPUT
+                    key, = unpack_uint4(data, pos + 1)
+                    if code == 0x6a:
+                        d = memo[key]
+                        get_pos.append(pos)
+                        get_defs.append(d)
+                        last_get[d] = pos
+                        key = None
+                next_pos = pos + size
+            else:
+                a, b, next_pos = _opcode_arg(data, pos + 1,
+                                             _opcode_args[code])
+                if code == 0x70:                # PUT
+                    key = int(bytes(data[a:b]))
+                else:                           # GET
+                    d = memo[int(bytes(data[a:b]))]
+                    get_pos.append(pos)
+                    get_defs.append(d)
+                    last_get[d] = pos
+            if key is not None:
+                memo[key] = pos
+                def_pos.append(pos)
+                def_keys.append(key)
+            pos = next_pos
+    except KeyError as exc:
+        raise UnpicklingError("Memo value not found at index %d" %
+                              exc.args[0]) from None
+    except (IndexError, struct_error):
+        raise UnpicklingError("pickle data was truncated") from None
+    except ValueError as exc:
+        raise UnpicklingError(str(exc)) from None
+    index[6] = pos
+    return index
+
+def scan(data, pos=0):
+    """Return the structure of the pickle found at data[pos], a PickleScan.
+
+    *data* is a bytes-like object, such as bytes or an mmap of a file.
+    The opcodes are followed, FRAME included, on a stack that holds where
+    each value starts instead of the value: nothing is imported, looked
+    up, called or built, so scanning is safe on untrusted data and
+    faster than loading.  The spans of the items of the root are found by
+    the scan; those of nested values are found on demand by scanning
+    their range.
+
+    Spans tell the byte range of every value, the memo keys it defines
+    and those it reads from elsewhere in the pickle, which is enough to
+    count the records of a pickled list, measure the size of each entry
+    of a dict or split a pickle into independent parts.
+
+    UnpicklingError is raised for invalid opcodes, truncated data, stack
+    underflows, missing marks, unsupported protocols and memo keys read
+    before they are defined.  Frame lengths are not checked.
+    """
+    if not isinstance(data, (bytes, bytearray)) and \
+            type(data).__name__ != 'mmap':
+        data = memoryview(data).cast('B')
+    return _scan(PickleScan(data, pos))
+
+def _scan(result, until=None):
+    # Scan the pickle of a new PickleScan and return it.  If until is
+    # given, scanning may stop early as _scan_values() says; the end of
+    # the PickleScan is then None, and its root span ends where scanning
+    # stopped, or is None if it stopped past an offset until returned.
+    start, kind, entries, stop = _scan_values(result.data, result.start,
+                                              len(result.data), result,
+                                              until)
+    if stop is None:
+        return result
+    if result.end is not None:
+        stop = result.end - 1
+    result.root = PickleSpan(result, start, stop, kind, entries)
+    return result
+
+# Loading selected parts of pickles
+
+def _select_tree(paths):
+    # Merge the paths given to Unpickler.load_select() into a tree of
+    # dicts mapping keys to subtrees, None standing for a value selected
+    # whole.  Return None if everything is selected.
+    tree = {}
+    for path in paths:
+        if not isinstance(path, (tuple, list)):
+            path = (path,)
+        if not path:
+            return None
+        node = tree
+        for key in path[:-1]:
+            child = node.get(key, {})
+            if child is None:
+                break
+            node[key] = child
+            node = child
+        else:
+            node[path[-1]] = None
+    return tree
+
+def _merge_select_trees(a, b):
+    if a is None or b is None:
+        return None
+    merged = dict(a)
+    for key, subtree in b.items():
+        merged[key] = (_merge_select_trees(merged[key], subtree)
+                       if key in merged else subtree)
+    return merged
+
+def _select_subtree(tree, *keys):
+    # Return the subtree of tree selected by any of keys or by Ellipsis,
+    # or False if none is.
+    found = False
+    for key in keys + (...,):
+        subtree = tree.get(key, False)
+        if subtree is not False:
+            found = (subtree if found is False else
+                     _merge_select_trees(found, subtree))
+    return found
+
+def _select_value(value, tree):
+    # Pick the parts of a loaded value selected by tree, for
+    # Unpickler.load_select() when the pickle cannot be scanned.
+    if tree is None:
+        return value
+    cls = type(value)
+    if cls is dict:
+        if ... not in tree:
+            return {key: _select_value(item, tree[key])
+                    for key, item in value.items() if key in tree}
+        selected = {}
+        for key, item in value.items():
+            subtree = _select_subtree(tree, key)
+            if subtree is not False:
+                selected[key] = _select_value(item, subtree)
+        return selected
+    if cls is list or cls is tuple:
+        if len(tree) == 1 and ... in tree:
+            subtree = tree[...]
+            selected = [_select_value(item, subtree) for item in value]
+        elif all(type(key) is int for key in tree):
+            n = len(value)
+            picked = {}
+            for key in tree:
+                if -n <= key < n:
+                    picked.setdefault(key % n, []).append(key)
+            selected = [_select_value(value[i], _select_subtree(tree, *keys))
+                        for i, keys in sorted(picked.items())]
+        else:
+            n = len(value)
+            selected = []
+            for i, item in enumerate(value):
+                subtree = _select_subtree(tree, i, i - n)
+                if subtree is not False:
+                    selected.append(_select_value(item, subtree))
+        return selected if cls is list else tuple(selected)
+    return value
+
+def _span_atom(data, start, end):
+    # Return the offset just past the atom opcode data[start:end] starts
+    # with if the span holds only it and a memo opcode, else None.
+    code = data[start]
+    if _scan_kinds[code] != "atom":
+        return None
+    size = _opcode_sizes[code]
+    if size:
+        stop = start + size
+    elif code == 0x8c or code == 0x43 or code == 0x8a or code == 0x55:
+        # SHORT_BINUNICODE, SHORT_BINBYTES, LONG1, SHORT_BINSTRING
+        stop = start + 2 + data[start + 1]
+    else:
+        stop = _opcode_arg(data, start + 1, _opcode_args[code])[2]
+    if stop == end or _span_put(data, stop, end):
+        return stop
+    return None
+
+def _span_put(data, start, end):
+    # Return whether data[start:end] is a single memo definition.
+    code = data[start]
+    if code == 0x94:                            # MEMOIZE
+        return end == start + 1
+    if code == 0x71:                            # BINPUT
+        return end == start + 2
+    if code == 0x72:                            # LONG_BINPUT
+        return end == start + 5
+    if code == 0x70:                            # PUT
+        return end == _find_newline(data, start + 1) + 1
+    return False
+
+def _span_get(data, start, end):
+    # Return whether data[start:end] is a single memo GET.
+    code = data[start]
+    if code == 0x68:                            # BINGET
+        return end == start + 2
+    if code == 0x6a:                            # LONG_BINGET
+        return end == start + 5
+    if code == 0x67:                            # GET
+        return end == _find_newline(data, start + 1) + 1
+    return False
+
+def _span_filled(scan, start, end):
+    # Return "dict" or "list" if the first opcodes of data[start:end] make
+    # such a container and the last one adds items to it, which tells that
+    # the span holds that container without scanning it, else None.  A
+    # byte that could be the argument of a memo opcode proves nothing.
+    data = scan.data
+    code = data[start]
+    if code == 0x28 and data[start + 1] in (0x64, 0x6c):
+        # MARK DICT, MARK LIST
+        code = data[start + 1]
+    if code == 0x7d or code == 0x64:            # EMPTY_DICT, DICT
+        kind = "dict"
+        adds = (0x73, 0x75)                     # SETITEM, SETITEMS
+    elif code == 0x5d or code == 0x6c:          # EMPTY_LIST, LIST
+        kind = "list"
+        adds = (0x61, 0x65)                     # APPEND, APPENDS
+    else:
+        return None
+    frames = scan.frames
+    i = bisect_left(frames, end - 9)
+    if i < len(frames) and frames[i] == end - 9 >= start:
+        end -= 9
+    # BINGET, BINPUT and LONG_BINGET, LONG_BINPUT
+    if (data[end - 1] in adds and data[end - 2] not in (0x68, 0x71) and
+            data[end - 5] not in (0x6a, 0x72)):
+        return kind
+    return None
+
+def _span_pickle(scan, start, end, def_pos, def_keys, several=False,
+                 gaps=(), memoize=False):
+    # Return a pickle of the value in data[start:end] of a scanned pickle,
+    # without its FRAME opcodes, and with MEMOIZE replaced by LONG_BINPUT
+    # so that it defines the same memo keys as in the whole pickle.
+    # def_pos and def_keys are as found by _scan_memo() up to end.  If
+    # several is true, data[start:end] holds values one after the other,
+    # and the pickle is of the list of them.  gaps lists (start, end)
+    # ranges of data[start:end] to leave out, which hold no memo opcodes.
+    # If memoize is true, MEMOIZE is kept, for a memo whose next key is
+    # that of the first memo opcode in data[start:end].
+    data = scan.data
+    cuts = [(a, b - a, b'') for a, b in gaps]
+    if not memoize:
+        for i in range(bisect_left(def_pos, start),
+                       bisect_left(def_pos, end)):
+            pos = def_pos[i]
+            if data[pos] == 0x94:               # MEMOIZE
+                cuts.append((pos, 1, LONG_BINPUT + pack("<I", def_keys[i])))
+    frames = scan.frames
+    for pos in frames[bisect_left(frames, start):bisect_left(frames, end)]:
+        cuts.append((pos, 9, b''))
+    cuts.sort()
+    chunks = [PROTO + bytes([scan.proto])] if scan.proto >= 2 else []
+    if several:
+        chunks.append(MARK)
+    pos = start
+    for cut, size, replacement in cuts:
+        if cut < pos:
+            # A FRAME opcode in a gap.
+            continue
+        chunks.append(data[pos:cut])
+        chunks.append(replacement)
+        pos = cut + size
+    chunks.append(data[pos:end])
+    if several:
+        chunks.append(LIST)
+    chunks.append(STOP)
+    return b''.join(chunks)
+
+# When load_select() selects from every entry of a dict, list or tuple
+# whose entries take fewer bytes than this on average, it loads them all;
+# so it does to select dict keys, negative indices, or indices that lie
+# past the first quarter of the pickle.
+_SELECT_ITEM_SIZE = 256
+
+# Raised by _SelectLoader.select() when such entries make up most of the
+# pickle, which is then loaded whole.
+class _SelectWhole(Exception):
+    pass
+
+def _select_sample(kind, items, same):
+    # The until argument of _scan_values() that stops once there are enough
+    # items to tell their size.
+    return len(items) >= 32
+
+class _SelectLoader:
+    # Builds the parts of a scanned pickle selected by a tree made by
+    # _select_tree(), for Unpickler.load_select().  Values are loaded by
+    # the unpickler from pickles of their span, made by _span_pickle(),
+    # after the memo entries they read from outside of it; single atoms
+    # and memo GETs are decoded directly.  The memo opcodes are indexed
+    # only up to the end of the last span loaded.
+
+    def __init__(self, unpickler, scan, placeholders):
+        self.unpickler = unpickler
+        self.scan = scan
+        self.data = scan.data
+        self.memo_index = _scan_memo(scan.data, scan.start, scan.start)
+        (self.def_pos, self.def_keys,
+         self.get_pos, self.get_defs) = self.memo_index[:4]
+        self.placeholder_refs = placeholders
+        # Whether a placeholder was given.
+        self.placeholders = False
+        # The dict keys decoded by until(), by the offset of the memo
+        # opcode that defines them.
+        self.atom_keys = {}
+
+    def until(self, tree):
+        # Return a function for the until argument of _scan_values() that
+        # stops the scan once the entries of the dict or list at the
+        # bottom selected by tree are complete, or None if they cannot be
+        # known before the end.
+        if tree is None or ... in tree:
+            return None
+        limit = None
+        if all(type(key) is int and key >= 0 for key in tree):
+            limit = max(tree) + 1
+        wanted = len(tree)
+        checked = 0
+        # The indices of the keys checked that are in tree.
+        found = []
+        gave_up = False
+
+        def until(kind, items, same):
+            nonlocal checked, gave_up
+            if kind == "list":
+                return limit is not None and len(items) >= limit
+            if kind != "dict":
+                return False
+            if same < checked or same == checked and gave_up:
+                # Entries guessed complete were not.
+                checked = same - (same & 1)
+                while found and found[-1] >= checked:
+                    del found[-1]
+                gave_up = False
+            elif gave_up:
+                return False
+            while checked < len(items):
+                key = self.atom_key(*items[checked])
+                if key is self:
+                    gave_up = True
+                    return False
+                if key in tree:
+                    found.append(checked)
+                checked += 2
+            if len(found) < wanted:
+                return False
+            k = found[-1]
+            if k + 1 == len(items):
+                # The value of the last key selected starts here.  If it
+                # is to be loaded whole, stop once it is found to make up
+                # a quarter of the pickle, which is then loaded whole, as
+                # settling the rest would cost about as much.
+                start = items[k][1]
+                if self.loads_whole(start, len(self.data),
+                                    tree[self.atom_key(*items[k])]):
+                    return start + (len(self.data) - self.scan.start) // 4
+            return True
+        return until
+
+    def loads_whole(self, start, end, tree):
+        # Return whether the entries tree selects from the dict or list at
+        # data[start:end] are better picked from all of them loaded, which
+        # is when its entries are small, and tree selects every one of
+        # them, dict keys, negative indices or indices past the first
+        # quarter of the pickle: finding them would take scanning most of
+        # it, which costs more.  Only the first entries are scanned, as
+        # small ones take up so many bytes at most.
+        if tree is None or self.placeholder_refs:
+            return False
+        data = self.data
+        sample = []
+
+        def until(kind, items, same):
+            if kind != "list" and kind != "dict":
+                return False
+            if _select_sample(kind, items, same):
+                sample[:] = items
+                return True
+            return False
+        try:
+            _scan_values(data, start,
+                         min(end, start + 64 * _SELECT_ITEM_SIZE), None, until)
+        except UnpicklingError:
+            pass
+        if not sample:
+            return False
+        size = (sample[-1][1] - sample[0][0]) / len(sample)
+        if size >= _SELECT_ITEM_SIZE:
+            return False
+        if ... in tree or not all(type(key) is int and key >= 0
+                                  for key in tree):
+            return True
+        return (max(tree) + 1) * size * 4 > len(data) - self.scan.start
+
+    def load_whole(self, span, tree):
+        # Load span and pick the parts tree selects from it, or have the
+        # whole pickle loaded instead if span makes up most of it.
+        root = self.scan.root
+        if span.size * 2 > root.end - root.start:
+            raise _SelectWhole
+        return _select_value(self.load(span), tree)
+
+    def atom_key(self, start, end):
+        # Return the dict key in data[start:end] if it is an atom or a GET
+        # of one decoded here before, else self.
+        frames = self.scan.frames
+        i = bisect_left(frames, end - 9)
+        if i < len(frames) and frames[i] == end - 9 >= start:
+            end -= 9
+        if _span_get(self.data, start, end):
+            self.index_memo(end)
+            d = self.get_defs[bisect_left(self.get_pos, start)]
+            return self.atom_keys.get(d, self)
+        stop = _span_atom(self.data, start, end)
+        if stop is None:
+            return self
+        key = self.atom(start, stop)
+        if stop != end:
+            self.atom_keys[stop] = key
+        return key
+
+    def atom(self, start, stop):
+        # Decode the atom opcode in data[start:stop].
+        unpickler = self.unpickler
+        data = self.data
+        code = data[start]
+        if code == 0x8c:                        # SHORT_BINUNICODE
+            value = str(data[start + 2:stop], 'utf-8', 'surrogatepass')
+        elif code == 0x58:                      # BINUNICODE
+            value = str(data[start + 5:stop], 'utf-8', 'surrogatepass')
+        elif code == 0x4b:                      # BININT1
+            return data[start + 1]
+        elif code == 0x4d:                      # BININT2
+            return unpack_from('<H', data, start + 1)[0]
+        elif code == 0x4a:                      # BININT
+            return unpack_from('<i', data, start + 1)[0]
+        elif code == 0x47:                      # BINFLOAT
+            return unpack_from('>d', data, start + 1)[0]
+        else:
+            value = loads_data(bytes(data[start:stop]) + STOP,
+                               encoding=unpickler.encoding,
+                               errors=unpickler.errors)
+        interned = unpickler._interned
+        if (interned is not None and type(value) is str and
+                len(value) <= _INTERN_MAX_STR):
+            value = _intern(interned, value, value)
+        return value
+
+    def index_memo(self, end):
+        # Index the memo opcodes of the pickle up to offset end, or up to
+        # 64 KiB further once the scan is over, to take fewer steps.
+        index = self.memo_index
+        if end > index[6]:
+            root = self.scan.root
+            if root is not None:
+                end = max(end, min(index[6] + 65536, root.end))
+            _scan_memo(self.data, index[6], end, index)
+
+    def select(self, span, tree):
+        if tree is None:
+            return self.load(span)
+        data = self.data
+        start = span.start
+        end = span.end
+        if _span_get(data, start, end):
+            # Follow the reference, to the value in the memo if it was
+            # loaded whole, else to the span that defines it.
+            self.index_memo(end)
+            d = self.get_defs[bisect_left(self.get_pos, start)]
+            value = self.memo_lookup(d)
+            if value is not self and type(value) is not PickleSpan:
+                return _select_value(value, tree)
+            return self.select(self.scan.find(d), tree)
+        kind = span._kind
+        entries = span._entries
+        if (entries is None and ... not in tree and
+                span.size * 4 > len(data) - self.scan.start and
+                self.loads_whole(start, end, tree)):
+            return self.load_whole(span, tree)
+        if entries is None:
+            # Scan only up to the selected entries, or when all are, up to
+            # enough of them to tell their size.  What a scan stopped early
+            # finds is the span only if the span is known to hold a dict
+            # or list, and is kept only if that is all of it.
+            until = self.until(tree)
+            if until is None:
+                until = _select_sample
+            elif _span_filled(self.scan, start, end) is None:
+                until = None
+            if until is None:
+                kind = span.kind
+                entries = span._entries
+            else:
+                _, kind, entries, stop = _scan_values(data, start, end, None,
+                                                      until)
+                if stop == end:
+                    span._kind = kind
+                    span._entries = entries
+        if ... in tree:
+            if (entries and not self.placeholder_refs and
+                    entries[-1][1] - entries[0][0] <
+                    len(entries) * _SELECT_ITEM_SIZE):
+                # Building each of many small entries apart costs more than
+                # loading them all, and loading most of the pickle apart
+                # more than loading all of it.
+                return self.load_whole(span, tree)
+            kind = span.kind
+            entries = span._entries
+        scan = self.scan
+        if kind == "dict":
+            value = {}
+            if ... in tree:
+                wanted = None
+            else:
+                # A pickled dict has each key once: stop once all of
+                # those selected are found.
+                wanted = len(tree)
+            for i in range(0, len(entries), 2):
+                key = self.key(scan._span(*entries[i]))
+                if wanted is None:
+                    subtree = _select_subtree(tree, key)
+                else:
+                    subtree = tree.get(key, False)
+                if subtree is not False:
+                    value[key] = self.select(scan._span(*entries[i + 1]),
+                                             subtree)
+                    if wanted is not None:
+                        wanted -= 1
+                        if not wanted:
+                            break
+            return value
+        if kind == "list" or kind == "tuple":
+            n = len(entries)
+            value = []
+            for i, entry in enumerate(entries):
+                subtree = _select_subtree(tree, i, i - n)
+                if subtree is not False:
+                    value.append(self.select(scan._span(*entry), subtree))
+            return value if kind == "list" else tuple(value)
+        return self.load(span)
+
+    def key(self, span):
+        # Load a dict key, which is most often a string or a GET of one.
+        # A key holding a placeholder would match no path, so the values
+        # it reads from the memo are loaded, even with placeholders.
+        data = self.data
+        start = span.start
+        end = span.end
+        code = data[start]
+        if code == 0x68 and end == start + 2 or \
+                code == 0x6a and end == start + 5:
+            self.index_memo(end)
+            value = self.memo_lookup(
+                self.get_defs[bisect_left(self.get_pos, start)])
+            if value is not self and type(value) is not PickleSpan:
+                return value
+        refs = self.placeholder_refs
+        self.placeholder_refs = False
+        try:
+            return self.load(span)
+        finally:
+            self.placeholder_refs = refs
+
+    def memo_lookup(self, d):
+        # Return the value memoized by the opcode at offset d if it is in
+        # the memo, else self.
+        key = self.def_keys[bisect_left(self.def_pos, d)]
+        memo = self.unpickler._memo
+        if key < len(memo):
+            return memo[key]
+        return self.unpickler._memo_sparse.get(key, self)
+
+    def memo_value(self, d):
+        # Return the value memoized by the opcode at offset d, loading the
+        # span that defines it, or putting a placeholder for it in the
+        # memo, if it is not there yet.
+        value = self.memo_lookup(d)
+        if value is not self and (type(value) is not PickleSpan or
+                                  self.placeholder_refs):
+            return value
+        dep = self.scan.find(d)
+        if (self.placeholder_refs and dep.kind != "atom" and
+                dep.kind != "global"):
+            self.placeholders = True
+            self.unpickler._memo_put(
+                self.def_keys[bisect_left(self.def_pos, d)], dep)
+            return dep
+        self.load(dep)
+        return self.memo_lookup(d)
+
+    def load(self, span):
+        # Load the value of span whole.
+        unpickler = self.unpickler
+        data = self.data
+        start = span.start
+        end = span.end
+        self.index_memo(end)
+        stop = _span_atom(data, start, end)
+        if stop is not None:
+            value = self.atom(start, stop)
+            if stop != end:
+                unpickler._memo_put(
+                    self.def_keys[bisect_left(self.def_pos, stop)], value)
+            return value
+        if _span_get(data, start, end):
+            return self.memo_value(
+                self.get_defs[bisect_left(self.get_pos, start)])
+        return self.fragment(start, end)
+
+    def fragment(self, start, end, several=False, gaps=()):
+        # Load data[start:end] from a pickle made by _span_pickle(), after
+        # the memo entries it reads from outside of it.  The memo opcodes
+        # must be indexed up to end.
+        get_pos = self.get_pos
+        get_defs = self.get_defs
+        outside = {d for d in get_defs[bisect_left(get_pos, start):
+                                       bisect_left(get_pos, end)]
+                   if not start <= d < end}
+        for d in sorted(outside):
+            self.memo_value(d)
+        return self.unpickler._load_fragment(
+            self.span_pickle(start, end, several, gaps))
+
+    def span_pickle(self, start, end, several, gaps):
+        return _span_pickle(self.scan, start, end, self.def_pos,
+                            self.def_keys, several, gaps)
+
+# Loading pickles lazily
+
+def _span_first(data, start):
+    # Return the offset of the first opcode after those that make the
+    # empty dict or list at data[start], the memo definition of it and
+    # FRAME opcodes, or None if data[start] does not make one.
+    code = data[start]
+    if code == 0x7d or code == 0x5d:            # EMPTY_DICT, EMPTY_LIST
+        pos = start + 1
+    elif code == 0x28 and data[start + 1] in (0x64, 0x6c):
+        pos = start + 2                         # MARK DICT, MARK LIST
+    else:
+        return None
+    code = data[pos]
+    if code == 0x94:                            # MEMOIZE
+        pos += 1
+    elif code == 0x71:                          # BINPUT
+        pos += 2
+    elif code == 0x72:                          # LONG_BINPUT
+        pos += 5
+    elif code == 0x70:                          # PUT
+        pos = _find_newline(data, pos + 1) + 1
+    while data[pos] == 0x95:                    # FRAME
+        pos += 9
+    return pos
+
+def _span_gap(data, start, end):
+    # Return whether data[start:end], between two items of a dict or list,
+    # holds only the opcodes that end a batch of items and start the next,
+    # and FRAME opcodes.
+    pos = start
+    while pos < end:
+        code = data[pos]
+        if code == 0x95:                        # FRAME
+            pos += 9
+        elif code in b'(aesu':    # MARK, APPEND, APPENDS, SETITEM, SETITEMS
+            pos += 1
+        else:
+            return False
+    return pos == end
+
+# _scan_large() keeps the entries of the dicts and lists that take more
+# bytes than this, or than the lazy_size if less.
+_LAZY_ENTRIES_SIZE = 256
+
+def _scan_large(data, pos, size, frames, index):
+    # For _LazyLoader: follow the opcodes of the pickle at data[pos] on a
+    # stack holding the offset of the first opcode of each value, as
+    # _scan_values() does, but checking only what it takes to follow
+    # them, add the offsets of the FRAME opcodes to frames, and index the
+    # memo opcodes in index, an empty result of _scan_memo() for pos.
+    # Return the offset of the STOP opcode, that of the pickled value, and
+    # a dict mapping the offset of each dict or list made empty that takes
+    # more than size bytes, or _LAZY_ENTRIES_SIZE, to the batches of its
+    # entries, or to None if it was added to before then.  Each batch is
+    # the list of the offsets of the entries and the offset where the
+    # last ends.  Return None for each if the pickle cannot be followed.
+    size = min(size, _LAZY_ENTRIES_SIZE)
+    def_pos, def_keys, get_pos, get_defs, last_get, memo, _ = index
+    stack = []
+    append = stack.append
+    marks = []          # lengths of the stack at each mark
+    mark_pos = []       # and the offsets of the MARK opcodes
+    fence = 0
+    sizes = _opcode_sizes
+    pushes = _scan_pushes
+    unpack_uint4 = _unpack_uint4
+    found = {}
+
+    def record(target, first, items, stop):
+        # Add items, the starts of the values added to the value at target,
+        # the first of which is at first, to its batches.
+        batches = found.get(target, False)
+        if batches is False:
+            batches = None
+            if _span_first(data, target) == first:
+                batches = []
+            found[target] = batches
+        if batches is not None:
+            batches.append((items, stop))
+    try:
+        while True:
+            start = pos
+            code = data[pos]
+            if pushes[code]:
+                append(start)
+                n = sizes[code]
+                if n:
+                    pos += n
+                    # Runs of them, as in lists of floats, are common.
+                    while data[pos] == code:
+                        append(pos)
+                        pos += n
+                elif code == 0x8c or code == 0x43 or code == 0x8a or \
+                        code == 0x55:
+                    # SHORT_BINUNICODE, SHORT_BINBYTES, LONG1,
+                    # SHORT_BINSTRING
+                    pos += 2 + data[pos + 1]
+                elif code == 0x58 or code == 0x42:
+                    # BINUNICODE, BINBYTES
+                    pos += 5 + unpack_uint4(data, pos + 1)[0]
+                else:
+                    pos = _opcode_arg(data, pos + 1, _opcode_args[code])[2]
+            elif code == 0x94:                  # MEMOIZE
+                pos += 1
+                key = len(memo)
+                memo[key] = start
+                def_pos.append(start)
+                def_keys.append(key)
+            elif code == 0x68 or code == 0x6a:  # BINGET, LONG_BINGET
+                if code == 0x68:
+                    d = memo[data[pos + 1]]
+                    pos += 2
+                else:
+                    d = memo[unpack_uint4(data, pos + 1)[0]]
+                    pos += 5
+                append(start)
+                get_pos.append(start)
+                get_defs.append(d)
+                last_get[d] = start
+            elif code == 0x71 or code == 0x72:  # BINPUT, LONG_BINPUT
+                if code == 0x71:
+                    key = data[pos + 1]
+                    pos += 2
+                else:
+                    key, = unpack_uint4(data, pos + 1)
+                    pos += 5
+                memo[key] = start
+                def_pos.append(start)
+                def_keys.append(key)
+            elif code == 0x28:                  # MARK
+                pos += 1
+                fence = len(stack)
+                marks.append(fence)
+                mark_pos.append(start)
+            elif code == 0x75 or code == 0x65 or code == 0x90:
+                # SETITEMS, APPENDS, ADDITEMS
+                pos += 1
+                if fence and start - stack[fence - 1] > size:
+                    record(stack[fence - 1], mark_pos[-1], stack[fence:],
+                           start)
+                del stack[fence:]
+                marks.pop()
+                mark_pos.pop()
+                fence = marks[-1] if marks else 0
+            elif code == 0x61 or code == 0x73:  # APPEND, SETITEM
+                pos += 1
+                n = 1 if code == 0x61 else 2
+                stack[fence + n]
+                target = stack[-n - 1]
+                if start - target > size:
+                    record(target, stack[-n], stack[-n:], start)
+                del stack[-n:]
+            elif 0x85 <= code <= 0x87:          # TUPLE1, TUPLE2, TUPLE3
+                pos += 1
+                n = code - 0x84
+                stack[fence + n - 1]
+                del stack[len(stack) - n + 1:]
+            elif code == 0x52 or code == 0x81 or code == 0x92 or \
+                    code == 0x93 or code == 0x51 or code == 0x62:
+                # REDUCE, NEWOBJ, NEWOBJ_EX, STACK_GLOBAL, BINPERSID, BUILD
+                pos += 1
+                n = 3 if code == 0x92 else 1 if code == 0x51 else 2
+                stack[fence + n - 1]
+                del stack[len(stack) - n + 1:]
+            elif code == 0x95:                  # FRAME
+                frames.append(start)
+                pos += 9
+            elif code == 0x2e:                  # STOP
+                if len(stack) != 1 or marks:
+                    return None, None, None
+                index[6] = start
+                return start, stack[0], found
+            elif code == 0x74 or code == 0x6c or code == 0x64 or \
+                    code == 0x91 or code == 0x6f or code == 0x69:
+                # TUPLE, LIST, DICT, FROZENSET, OBJ, INST
+                pos = _opcode_arg(data, pos + 1, _opcode_args[code])[2]
+                del stack[fence:]
+                append(mark_pos.pop())
+                marks.pop()
+                fence = marks[-1] if marks else 0
+            elif code == 0x67 or code == 0x70:  # GET, PUT
+                a, b, pos = _opcode_arg(data, pos + 1, _opcode_args[code])
+                key = int(bytes(data[a:b]))
+                if code == 0x67:
+                    d = memo[key]
+                    append(start)
+                    get_pos.append(start)
+                    get_defs.append(d)
+                    last_get[d] = start
+                else:
+                    memo[key] = start
+                    def_pos.append(start)
+                    def_keys.append(key)
+            elif code == 0x30:                  # POP
+                pos += 1
+                if marks and len(stack) == fence:
+                    marks.pop()
+                    mark_pos.pop()
+                    fence = marks[-1] if marks else 0
+                else:
+                    del stack[-1]
+            elif code == 0x31:                  # POP_MARK
+                pos += 1
+                del stack[fence:]
+                marks.pop()
+                mark_pos.pop()
+                fence = marks[-1] if marks else 0
+            elif code == 0x32:                  # DUP
+                pos += 1
+                append(stack[-1])
+            elif code == 0x80 or code == 0x98:  # PROTO, READONLY_BUFFER
+                pos += 2 if code == 0x80 else 1
+            else:
+                return None, None, None
+    except (IndexError, KeyError, ValueError, struct_error):
+        return None, None, None
+
+class _LazyLoader(_SelectLoader):
+    # Builds the value of a pickle for Unpicklers created with a
+    # lazy_size, with the dicts and lists larger than that as proxies.
+    # The pickle is followed once, by _scan_large(), for where the entries
+    # of its large dicts and lists lie and to index its memo opcodes; only
+    # the spans of those it cannot tell are scanned when their proxy is
+    # built.  Proxies not built yet never overlap: they are kept by the
+    # offset of their span, to find the one holding a memo definition.
+    # They and the memoized atoms are put in the memo only once read from
+    # it.  Values are loaded as _SelectLoader does, with the memo of the
+    # loader in place of that of the unpickler, which is why proxies are
+    # built one at a time.
+
+    def __init__(self, unpickler, scan, size):
+        super().__init__(unpickler, scan, False)
+        self.size = size
+        self.memo = []
+        self.memo_sparse = {}
+        self.pending = {}
+        self.starts = []
+        # The atoms not put in the memo yet, by the offset of the memo
+        # opcode that defines them.
+        self.atoms = {}
+        # The entries found by _scan_large(), once it has run.
+        self.large = None
+        self.lock = RLock()
+        # The mmap to close with the data once all proxies are built, and
+        # the number of proxies being built.
+        self.mapping = None
+        self.depth = 0
+
+    def find_root(self, seek):
+        # Set the root span of the scan, and return whether it holds a
+        # dict or list larger than the lazy_size.  The pickle is followed
+        # now if seek is true, which also finds its end, or if the data
+        # does not end with a STOP opcode that could be its end; otherwise
+        # not before the root is built.
+        scan = self.scan
+        data = self.data
+        pos = scan.start
+        if data[pos] == 0x80:                   # PROTO
+            scan.proto = data[pos + 1]
+            pos += 2
+        if seek or data[-1] != 0x2e:            # STOP
+            if not self.walk():
+                return False
+        else:
+            while data[pos] == 0x95:            # FRAME
+                pos += 9
+            scan.root = PickleSpan(scan, pos, len(data) - 1)
+        root = scan.root
+        kind = _span_filled(scan, root.start, root.end)
+        if kind is None or root.size <= self.size:
+            return False
+        root._kind = kind
+        return True
+
+    def walk(self):
+        # Follow the pickle with _scan_large(), and return whether it
+        # could.  Its end and root span are set if the root span was not,
+        # else the entries are only kept if the root span is right.  The
+        # memo index it makes replaces the contents of that of the loader,
+        # which covers less of the same pickle.
+        scan = self.scan
+        frames = []
+        index = _scan_memo(self.data, scan.start, scan.start)
+        stop, start, large = _scan_large(self.data, scan.start, self.size,
+                                         frames, index)
+        root = scan.root
+        if stop is None or root is not None and (root.start != start or
+                                                 root.end != stop):
+            self.large = {}
+            return False
+        self.large = large
+        scan.frames[:] = frames
+        scan._frame_set = None
+        for old, new in zip(self.memo_index, index[:6]):
+            old.clear()
+            if type(old) is dict:
+                old.update(new)
+            else:
+                old.extend(new)
+        self.memo_index[6] = index[6]
+        if root is None:
+            scan.end = stop + 1
+            scan.root = PickleSpan(scan, start, stop)
+        return True
+
+    def entries(self, span):
+        # Return the (start, end) offsets of the entries of the dict or
+        # list of span, scanning it if _scan_large() did not keep them.
+        if span._entries is None:
+            if self.large is None:
+                self.walk()
+            batches = self.large.get(span.start)
+            if batches is not None and (not batches or
+                                        batches[-1][1] <= span.end):
+                entries = span._entries = []
+                for items, stop in batches:
+                    entries += zip(items, items[1:] + [stop])
+            else:
+                kind = span._kind
+                span._scan()
+                if span._kind != kind:
+                    raise UnpicklingError("expected a %s, found a %s" %
+                                          (kind, span._kind))
+        return span._entries
+
+    def load_root(self):
+        return self._with_memo(self.item, self.scan.root)
+
+    def build(self, proxy):
+        # Build the dict or list of proxy, unless another thread did, or
+        # this one is doing so.
+        with self.lock:
+            if proxy._value is None:
+                self.depth += 1
+                try:
+                    self._with_memo(self._build, proxy)
+                finally:
+                    self.depth -= 1
+                if not self.pending and not self.depth:
+                    # The spans of the scan refer to it, so the data would
+                    # only be released by the collector.
+                    _close_scan(self.data, self.mapping)
+        return proxy._value
+
+    def _with_memo(self, func, arg):
+        unpickler = self.unpickler
+        saved = unpickler._memo, unpickler._memo_sparse
+        unpickler._memo = self.memo
+        unpickler._memo_sparse = self.memo_sparse
+        try:
+            return func(arg)
+        finally:
+            unpickler._memo, unpickler._memo_sparse = saved
+
+    def item(self, span):
+        # Load the value of span, as a proxy if it is a large dict or list
+        # made empty and filled afterwards.
+        if span.size > self.size:
+            data = self.data
+            start = span.start
+            code = data[start]
+            if code == 0x7d or code == 0x5d:        # EMPTY_DICT, EMPTY_LIST
+                pos = start + 1
+            elif code == 0x28 and data[start + 1] in (0x64, 0x6c):
+                # MARK DICT, MARK LIST
+                code = data[start + 1]
+                pos = start + 2
+            else:
+                return self.load(span)
+            kind = "dict" if code == 0x7d or code == 0x64 else "list"
+            if span._kind is None and _span_filled(self.scan, start,
+                                                   span.end) == kind:
+                span._kind = kind
+            if span.kind == kind:
+                proxy = (LazyDict if kind == "dict" else LazyList)(self, span)
+                self.pending[start] = proxy, pos
+                insort(self.starts, start)
+                return proxy
+        return self.load(span)
+
+    def load(self, span):
+        start = span.start
+        end = span.end
+        stop = _span_atom(self.data, start, end)
+        if stop is None or stop == end:
+            return super().load(span)
+        value = self.atoms[stop] = self.atom(start, stop)
+        return value
+
+    def memo_lookup(self, d):
+        value = self.atoms.pop(d, self)
+        if value is not self:
+            self.put(d, value)
+            return value
+        return super().memo_lookup(d)
+
+    def put(self, pos, value):
+        # Put value in the memo under the key of the opcode at pos, if it
+        # is a memo definition.
+        self.index_memo(pos + 1)
+        i = bisect_left(self.def_pos, pos)
+        if i < len(self.def_pos) and self.def_pos[i] == pos:
+            self.unpickler._memo_put(self.def_keys[i], value)
+
+    def span_pickle(self, start, end, several, gaps):
+        # Keep the MEMOIZE opcodes if all the memo opcodes of the span are
+        # MEMOIZE, and the memo holds none of their keys: it is filled up
+        # to the first with self, which memo_lookup() takes for a value
+        # not put yet, so that they define the same keys.
+        def_pos = self.def_pos
+        i = bisect_left(def_pos, start)
+        j = bisect_left(def_pos, end)
+        memo = self.memo
+        memoize = False
+        if i < j:
+            first = self.def_keys[i]
+            data = self.data
+            if len(memo) <= first and \
+                    self.def_keys[i:j] == list(range(first, first + j - i)) \
+                    and all(data[pos] == 0x94 for pos in def_pos[i:j]):
+                sparse = self.memo_sparse
+                while len(memo) < first:
+                    memo.append(sparse.pop(len(memo), self))
+                memoize = not sparse
+        return _span_pickle(self.scan, start, end, def_pos, self.def_keys,
+                            several, gaps, memoize)
+
+    def _build(self, proxy):
+        span = proxy._span
+        _, pos = self.pending.pop(span.start)
+        del self.starts[bisect_left(self.starts, span.start)]
+        entries = self.entries(span)
+        self.put(pos, proxy)
+        data = self.data
+        scan = self.scan
+        size = self.size
+        # The value is in place before its items are, as when unpickling.
+        # Items too small to be proxies are loaded together, from one
+        # pickle without the opcodes that end a batch of them and start
+        # the next, so that a dict or list of small items is one pickle.
+        if span.kind == "dict":
+            value = proxy._value = {}
+            step = 2
+        else:
+            value = proxy._value = []
+            step = 1
+        n = len(entries)
+        i = 0
+        while i < n:
+            start = end = entries[i][0]
+            gaps = []
+            j = i
+            while j < n and entries[j][1] - entries[j][0] <= size:
+                if entries[j][0] != end:
+                    if not _span_gap(data, end, entries[j][0]):
+                        break
+                    gaps.append((end, entries[j][0]))
+                end = entries[j][1]
+                j += 1
+            j -= (j - i) % step
+            if j - i > step:
+                end = entries[j - 1][1]
+                self.index_memo(end)
+                items = self.fragment(start, end, True,
+                                      [gap for gap in gaps if gap[1] < end])
+                if step == 2:
+                    value.update(zip(items[::2], items[1::2]))
+                else:
+                    value += items
+                i = j
+            elif step == 2:
+                key = self.key(scan._span(*entries[i]))
+                value[key] = self.item(scan._span(*entries[i + 1]))
+                i += 2
+            else:
+                value.append(self.item(scan._span(*entries[i])))
+                i += 1
+        proxy._loader = proxy._span = None
+
+    def memo_value(self, d):
+        # Return the value memoized by the opcode at offset d, building the
+        # proxies that hold it first.
+        value = self.memo_lookup(d)
+        while value is self:
+            starts = self.starts
+            i = bisect_right(starts, d) - 1
+            if i < 0:
+                return super().memo_value(d)
+            proxy, pos = self.pending[starts[i]]
+            if d >= proxy._span.end:
+                return super().memo_value(d)
+            if d == pos:
+                self.put(pos, proxy)
+                return proxy
+            self._build(proxy)
+            value = self.memo_lookup(d)
+        return value
+
+class _LazyValue:
+    # The base of LazyDict and LazyList.
+
+    __slots__ = ('_loader', '_span', '_value')
+
+    def __init__(self, loader, span):
+        self._loader = loader
+        self._span = span
+        self._value = None
+
+    def _load(self):
+        # _value is set before the items are in place, and _loader cleared
+        # after.
+        loader = self._loader
+        if loader is None:
+            return self._value
+        return loader.build(self)
+
+    @property
+    def loaded(self):
+        """Whether the value has been built."""
+        return self._loader is None
+
+    def __repr__(self):
+        if self._loader is not None:
+            return "<%s of %d bytes, not loaded>" % (type(self).__name__,
+                                                      self._span.size)
+        return repr(self._value)
+
+    def __len__(self):
+        return len(self._load())
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __contains__(self, x):
+        return x in self._load()
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+
+    def __delitem__(self, key):
+        del self._load()[key]
+
+    def __eq__(self, other):
+        if isinstance(other, _LazyValue):
+            other = other._load()
+        return self._load() == other
+
+    __hash__ = None
+
+    def __reduce_ex__(self, protocol):
+        return self._load().__reduce_ex__(protocol)
+
+class LazyDict(_LazyValue, MutableMapping):
+    """A dict of a pickle loaded with a lazy_size, built on first use.
+
+    It is a MutableMapping that forwards to the dict once built.  *loaded*
+    tells whether it has been built; repr() does not build it.
+    """
+
+    __slots__ = ()
+
+    def keys(self):
+        return self._load().keys()
+
+    def values(self):
+        return self._load().values()
+
+    def items(self):
+        return self._load().items()
+
+    def get(self, key, default=None):
+        return self._load().get(key, default)
+
+class LazyList(_LazyValue, MutableSequence):
+    """A list of a pickle loaded with a lazy_size, built on first use.
+
+    It is a MutableSequence that forwards to the list once built.
+    *loaded* tells whether it has been built; repr() does not build it.
+    """
+
+    __slots__ = ()
+
+    def insert(self, i, x):
+        self._load().insert(i, x)
+
+    def append(self, x):
+        self._load().append(x)
+
+    def extend(self, xs):
+        self._load().extend(xs)
+
+# Data-only pickling and unpickling
+
+# Opcode prefixes for dumps_data(), indexed by a one-byte argument.
+_DATA_BINGET = [BINGET + pack("<B", i) for i in range(256)]
+_DATA_BININT1 = [BININT1 + pack("<B", i) for i in range(256)]
+_DATA_SHORT_BINUNICODE = [SHORT_BINUNICODE + pack("<B", i)
+                          for i in range(256)]
+
+def dumps_data(obj, protocol=None):
+    """Return the pickled representation of the plain data *obj* as bytes.
+
+    *obj* may only contain None, bools, ints, floats, str, bytes, lists,
+    tuples, dicts, sets and frozensets, and with protocol 5 bytearray;
+    subclasses are not accepted.  PicklingError is raised for the first
+    other object found.  persistent_id(), reducer_override(), dispatch
+    tables and __reduce_ex__() are never consulted.
+
+    The output is the same as that of dumps() with the same *protocol*,
+    which must be 4 or higher.
+    """
+    if protocol is None:
+        protocol = DEFAULT_PROTOCOL
+    if protocol < 0:
+        protocol = HIGHEST_PROTOCOL
+    elif not 4 <= protocol <= HIGHEST_PROTOCOL:
+        raise ValueError("dumps_data() needs pickle protocol 4 to %d" %
+                         HIGHEST_PROTOCOL)
+    frame_target = _Framer._FRAME_SIZE_TARGET
+    batchsize = _Pickler._BATCHSIZE
+    chunks = [PROTO + pack("<B", protocol)]
+    # The frame being written; committed like _Framer.commit_frame() does
+    # at the start of every save, so the frames match those of dumps().
+    frame = bytearray()
+    memo = {}
+
+    def commit():
+        nonlocal frame
+        if len(frame) >= _Framer._FRAME_SIZE_MIN:
+            chunks.append(FRAME + pack("<Q", len(frame)))
+        chunks.append(frame)
+        frame = bytearray()
+
+    def write_large(header, payload):
+        # Like _Framer.write_large_bytes().
+        if frame:
+            commit()
+        chunks.append(header)
+        chunks.append(payload)
+
+    def save(obj):
+        nonlocal frame
+        if len(frame) >= frame_target:
+            commit()
+        t = type(obj)
+        if t is int:
+            if 0 <= obj <= 0xff:
+                frame += _DATA_BININT1[obj]
+            elif 0 <= obj <= 0xffff:
+                frame += BININT2 + pack("<H", obj)
+            elif -0x80000000 <= obj <= 0x7fffffff:
+                frame += BININT + pack("<i", obj)
+            else:
+                encoded = encode_long(obj)
+                n = len(encoded)
+                if n < 256:
+                    frame += LONG1 + pack("<B", n) + encoded
+                else:
+                    frame += LONG4 + pack("<i", n) + encoded
+            return
+        if t is float:
+            frame += BINFLOAT + pack('>d', obj)
+            return
+        if obj is None:
+            frame += NONE
+            return
+        if t is bool:
+            frame += NEWTRUE if obj else NEWFALSE
+            return
+        if t is tuple and not obj:
+            frame += EMPTY_TUPLE
+            return
+
+        x = memo.get(id(obj))
+        if x is not None:
+            frame += (_DATA_BINGET[x] if x < 256 else
+                      LONG_BINGET + pack("<I", x))
+            return
+
+        if t is str:
+            encoded = obj.encode('utf-8', 'surrogatepass')
+            n = len(encoded)
+            if n <= 0xff:
+                frame += _DATA_SHORT_BINUNICODE[n]
+                frame += encoded
+            elif n > 0xffffffff:
+                write_large(BINUNICODE8 + pack("<Q", n), encoded)
+            elif n >= frame_target:
+                write_large(BINUNICODE + pack("<I", n), encoded)
+            else:
+                frame += BINUNICODE + pack("<I", n)
+                frame += encoded
+        elif t is dict:
+            frame += EMPTY_DICT + MEMOIZE
+            memo[id(obj)] = len(memo)
+            if len(obj) <= batchsize:
+                batches = (obj.items(),)
+            else:
+                it = iter(obj.items())
+                batches = iter(lambda: list(islice(it, batchsize)), [])
+            for batch in batches:
+                if len(batch) > 1:
+                    frame += MARK
+                    for k, v in batch:
+                        save(k)
+                        save(v)
+                    frame += SETITEMS
+                elif batch:
+                    for k, v in batch:
+                        save(k)
+                        save(v)
+                    frame += SETITEM
+            return
+        elif t is list:
+            frame += EMPTY_LIST + MEMOIZE
+            memo[id(obj)] = len(memo)
+            for i in range(0, len(obj), batchsize):
+                batch = obj[i:i + batchsize]
+                if len(batch) > 1:
+                    frame += MARK
+                    for x in batch:
+                        save(x)
+                    frame += APPENDS
+                else:
+                    save(batch[0])
+                    frame += APPEND
+            return
+        elif t is tuple:
+            n = len(obj)
+            if n > 3:
+                frame += MARK
+            for x in obj:
+                save(x)
+            x = memo.get(id(obj))
+            if x is not None:
+                # The tuple is recursive; see _Pickler.save_tuple().
+                frame += POP * n if n <= 3 else POP_MARK
+                frame += (_DATA_BINGET[x] if x < 256 else
+                          LONG_BINGET + pack("<I", x))
+                return
+            frame += _tuplesize2code[n] if n <= 3 else TUPLE
+        elif t is bytes:
+            n = len(obj)
+            if n <= 0xff:
+                frame += SHORT_BINBYTES + pack("<B", n)
+                frame += obj
+            elif n > 0xffffffff:
+                write_large(BINBYTES8 + pack("<Q", n), obj)
+            elif n >= frame_target:
+                write_large(BINBYTES + pack("<I", n), obj)
+            else:
+                frame += BINBYTES + pack("<I", n)
+                frame += obj
+        elif t is set:
+            frame += EMPTY_SET + MEMOIZE
+            memo[id(obj)] = len(memo)
+            it = iter(obj)
+            for batch in iter(lambda: list(islice(it, batchsize)), []):
+                frame += MARK
+                for x in batch:
+                    save(x)
+                frame += ADDITEMS
+            return
+        elif t is frozenset:
+            frame += MARK
+            for x in obj:
+                save(x)
+            frame += FROZENSET
+        elif t is bytearray and protocol >= 5:
+            n = len(obj)
+            if n >= frame_target:
+                write_large(BYTEARRAY8 + pack("<Q", n), obj)
+            else:
+                frame += BYTEARRAY8 + pack("<Q", n)
+                frame += obj
+        else:
+            raise PicklingError("dumps_data() can't pickle %r object: %r" %
+                                (t.__name__, obj))
+        frame += MEMOIZE
+        memo[id(obj)] = len(memo)
+
+    save(obj)
+    frame += STOP
+    commit()
+    return b"".join(chunks)
+
+# Opcodes that loads_data() refuses: they import or call objects, or need
+# persistent IDs, the extension registry or out-of-band buffers.
+_DATA_REJECTED = {op[0]: name for name, op in (
+    ("PERSID", PERSID), ("BINPERSID", BINPERSID), ("REDUCE", REDUCE),
+    ("BUILD", BUILD), ("GLOBAL", GLOBAL), ("STACK_GLOBAL", STACK_GLOBAL),
+    ("INST", INST), ("OBJ", OBJ), ("NEWOBJ", NEWOBJ),
+    ("NEWOBJ_EX", NEWOBJ_EX), ("EXT1", EXT1), ("EXT2", EXT2),
+    ("EXT4", EXT4), ("NEXT_BUFFER", NEXT_BUFFER),
+    ("READONLY_BUFFER", READONLY_BUFFER))}
+
+def _data_line(data, pos):
+    # Return the line of data starting at pos without its newline, and
+    # the position after it.
+    end = data.find(b'\n', pos)
+    if end < 0:
+        raise UnpicklingError("pickle data was truncated")
+    return data[pos:end], end + 1
+
+def loads_data(data, /, *, encoding="ASCII", errors="strict", plans=None):
+    """Read a pickle of plain data from the bytes-like object *data*.
+
+    Only None, bools, ints, floats, str, bytes, bytearray, lists, tuples,
+    dicts, sets and frozensets are accepted, along with the MARK, memo
+    and FRAME opcodes.  Opcodes that look up globals or call objects,
+    such as GLOBAL, REDUCE and BUILD, raise UnpicklingError, so this is
+    safe to use on untrusted data; it is also faster than loads().
+    Note that protocols before 3 pickle bytes with REDUCE, and before 4
+    sets and frozensets.
+
+    *encoding* and *errors* decode 8-bit strings pickled by Python 2, as
+    in loads().  If *plans* is a DataPlanCache, pickles with the same
+    opcodes as earlier ones are loaded by a plan compiled for them.
+    """
+    if isinstance(data, str):
+        raise TypeError("Can't load pickle from unicode string")
+    if type(data) is not bytes:
+        data = bytes(data)
+    if plans is not None:
+        return plans._load(data, encoding, errors)
+    stack = []
+    append = stack.append
+    marks = []
+    memo = {}
+    # Length of the stack at the topmost mark; see _Unpickler._load_fused().
+    fence = 0
+    pos = 0
+
+    try:
+        while True:
+            code = data[pos]
+            pos += 1
+            if code >= 0x80:
+                if code == 0x94:                # MEMOIZE
+                    stack[fence]
+                    memo[len(memo)] = stack[-1]
+                elif code == 0x8c:              # SHORT_BINUNICODE
+                    n = data[pos]
+                    pos += 1 + n
+                    value = data[pos - n:pos]
+                    if len(value) < n:
+                        raise UnpicklingError("pickle data was truncated")
+                    append(str(value, 'utf-8', 'surrogatepass'))
+                elif code == 0x86:              # TUPLE2
+                    stack[fence + 1]
+                    second = stack.pop()
+                    stack[-1] = (stack[-1], second)
+                elif code == 0x85:              # TUPLE1
+                    stack[fence]
+                    stack[-1] = (stack[-1],)
+                elif code == 0x87:              # TUPLE3
+                    stack[fence + 2]
+                    third = stack.pop()
+                    second = stack.pop()
+                    stack[-1] = (stack[-1], second, third)
+                elif code == 0x88:              # NEWTRUE
+                    append(True)
+                elif code == 0x89:              # NEWFALSE
+                    append(False)
+                elif code == 0x95:              # FRAME
+                    # The whole pickle is in memory; frames change nothing.
+                    unpack_from('<Q', data, pos)
+                    pos += 8
+                elif code == 0x8a:              # LONG1
+                    n = data[pos]
+                    pos += 1 + n
+                    if pos > len(data):
+                        raise UnpicklingError("pickle data was truncated")
+                    append(int.from_bytes(data[pos - n:pos], 'little',
+                                          signed=True))
+                elif code == 0x8f:              # EMPTY_SET
+                    append(set())
+                elif code == 0x90:              # ADDITEMS
+                    if not marks:
+                        raise UnpicklingError("could not find MARK")
+                    if fence == 0 or (len(marks) > 1 and marks[-2] == fence):
+                        raise UnpicklingError("unpickling stack underflow")
+                    target = stack[fence - 1]
+                    if type(target) is not set:
+                        raise UnpicklingError("ADDITEMS target is not a set")
+                    items = stack[fence:]
+                    del stack[fence:]
+                    marks.pop()
+                    target.update(items)
+                    fence = marks[-1] if marks else 0
+                elif code == 0x91:              # FROZENSET
+                    if not marks:
+                        raise UnpicklingError("could not find MARK")
+                    items = frozenset(stack[fence:])
+                    del stack[fence:]
+                    append(items)
+                    marks.pop()
+                    fence = marks[-1] if marks else 0
+                elif code == 0x80:              # PROTO
+                    proto = data[pos]
+                    pos += 1
+                    if not 0 <= proto <= HIGHEST_PROTOCOL:
+                        raise ValueError("unsupported pickle protocol: %d" %
+                                         proto)
+                elif code == 0x8b:              # LONG4
+                    n, = unpack_from('<i', data, pos)
+                    if n < 0:
+                        raise UnpicklingError("LONG pickle has negative "
+                                              "byte count")
+                    pos += 4 + n
+                    if pos > len(data):
+                        raise UnpicklingError("pickle data was truncated")
+                    append(int.from_bytes(data[pos - n:pos], 'little',
+                                          signed=True))
+                elif code == 0x8d or code == 0x8e or code == 0x96:
+                    # BINUNICODE8, BINBYTES8, BYTEARRAY8
+                    n, = unpack_from('<Q', data, pos)
+                    pos += 8 + n
+                    value = data[pos - n:pos]
+                    if len(value) < n:
+                        raise UnpicklingError("pickle data was truncated")
+                    if code == 0x8d:
+                        append(str(value, 'utf-8', 'surrogatepass'))
+                    elif code == 0x8e:
+                        append(value)
+                    else:
+                        append(bytearray(value))
+                else:
+                    break
+            elif code >= 0x61:
+                if code == 0x68:                # BINGET
+                    i = data[pos]
+                    pos += 1
+                    try:
+                        append(memo[i])
+                    except KeyError:
+                        raise UnpicklingError("Memo value not found at "
+                                              "index %d" % i) from None
+                elif code == 0x71:              # BINPUT
+                    stack[fence]
+                    memo[data[pos]] = stack[-1]
+                    pos += 1
+                elif code == 0x75:              # SETITEMS
+                    if not marks:
+                        raise UnpicklingError("could not find MARK")
+                    if fence == 0 or (len(marks) > 1 and marks[-2] == fence):
+                        raise UnpicklingError("unpickling stack underflow")
+                    if (len(stack) - fence) & 1:
+                        raise UnpicklingError("odd number of items for "
+                                              "SETITEMS")
+                    target = stack[fence - 1]
+                    if type(target) is not dict:
+                        raise UnpicklingError("SETITEMS target is not a dict")
+                    items = iter(stack[fence:])
+                    del stack[fence:]
+                    marks.pop()
+                    target.update(zip(items, items))
+                    fence = marks[-1] if marks else 0
+                elif code == 0x65:              # APPENDS
+                    if not marks:
+                        raise UnpicklingError("could not find MARK")
+                    if fence == 0 or (len(marks) > 1 and marks[-2] == fence):
+                        raise UnpicklingError("unpickling stack underflow")
+                    target = stack[fence - 1]
+                    if type(target) is not list:
+                        raise UnpicklingError("APPENDS target is not a list")
+                    items = stack[fence:]
+                    del stack[fence:]
+                    marks.pop()
+                    target.extend(items)
+                    fence = marks[-1] if marks else 0
+                elif code == 0x61:              # APPEND
+                    stack[fence + 1]
+                    value = stack.pop()
+                    if type(stack[-1]) is not list:
+                        raise UnpicklingError("APPEND target is not a list")
+                    stack[-1].append(value)
+                elif code == 0x73:              # SETITEM
+                    stack[fence + 2]
+                    value = stack.pop()
+                    key = stack.pop()
+                    if type(stack[-1]) is not dict:
+                        raise UnpicklingError("SETITEM target is not a dict")
+                    stack[-1][key] = value
+                elif code == 0x74:              # TUPLE
+                    if not marks:
+                        raise UnpicklingError("could not find MARK")
+                    items = tuple(stack[fence:])
+                    del stack[fence:]
+                    append(items)
+                    marks.pop()
+                    fence = marks[-1] if marks else 0
+                elif code == 0x6c or code == 0x64:
+                    # LIST, DICT
+                    if not marks:
+                        raise UnpicklingError("could not find MARK")
+                    items = stack[fence:]
+                    del stack[fence:]
+                    if code == 0x64:
+                        if len(items) & 1:
+                            raise UnpicklingError("odd number of items for "
+                                                  "DICT")
+                        items = iter(items)
+                        items = dict(zip(items, items))
+                    append(items)
+                    marks.pop()
+                    fence = marks[-1] if marks else 0
+                elif code == 0x72:              # LONG_BINPUT
+                    stack[fence]
+                    i, = unpack_from('<I', data, pos)
+                    pos += 4
+                    memo[i] = stack[-1]
+                elif code == 0x6a or code == 0x67:
+                    # LONG_BINGET, GET
+                    if code == 0x6a:
+                        i, = unpack_from('<I', data, pos)
+                        pos += 4
+                    else:
+                        line, pos = _data_line(data, pos)
+                        i = int(line)
+                    try:
+                        append(memo[i])
+                    except KeyError:
+                        raise UnpicklingError("Memo value not found at "
+                                              "index %d" % i) from None
+                elif code == 0x70:              # PUT
+                    stack[fence]
+                    line, pos = _data_line(data, pos)
+                    i = int(line)
+                    if i < 0:
+                        raise ValueError("negative PUT argument")
+                    memo[i] = stack[-1]
+                elif code == 0x7d:              # EMPTY_DICT
+                    append({})
+                else:
+                    break
+            else:
+                if code == 0x4b:                # BININT1
+                    append(data[pos])
+                    pos += 1
+                elif code == 0x28:              # MARK
+                    fence = len(stack)
+                    marks.append(fence)
+                elif code == 0x58:              # BINUNICODE
+                    n, = unpack_from('<I', data, pos)
+                    pos += 4 + n
+                    value = data[pos - n:pos]
+                    if len(value) < n:
+                        raise UnpicklingError("pickle data was truncated")
+                    append(str(value, 'utf-8', 'surrogatepass'))
+                elif code == 0x5d:              # EMPTY_LIST
+                    append([])
+                elif code == 0x4d:              # BININT2
+                    append(unpack_from('<H', data, pos)[0])
+                    pos += 2
+                elif code == 0x4e:              # NONE
+                    append(None)
+                elif code == 0x47:              # BINFLOAT
+                    append(unpack_from('>d', data, pos)[0])
+                    pos += 8
+                elif code == 0x4a:              # BININT
+                    append(unpack_from('<i', data, pos)[0])
+                    pos += 4
+                elif code == 0x29:              # EMPTY_TUPLE
+                    append(())
+                elif code == 0x43 or code == 0x42:
+                    # SHORT_BINBYTES, BINBYTES
+                    if code == 0x43:
+                        n = data[pos]
+                        pos += 1 + n
+                    else:
+                        n, = unpack_from('<I', data, pos)
+                        pos += 4 + n
+                    value = data[pos - n:pos]
+                    if len(value) < n:
+                        raise UnpicklingError("pickle data was truncated")
+                    append(value)
+                elif code == 0x2e:              # STOP
+                    stack[fence]
+                    return stack.pop()
+                elif code == 0x30:              # POP
+                    if marks and len(stack) == fence:
+                        del stack[marks.pop():]
+                        fence = marks[-1] if marks else 0
+                    else:
+                        del stack[-1]
+                elif code == 0x31:              # POP_MARK
+                    if not marks:
+                        raise UnpicklingError("could not find MARK")
+                    del stack[marks.pop():]
+                    fence = marks[-1] if marks else 0
+                elif code == 0x32:              # DUP
+                    stack[fence]
+                    append(stack[-1])
+                elif code == 0x49:              # INT
+                    line, pos = _data_line(data, pos)
+                    if line == b'00':
+                        append(False)
+                    elif line == b'01':
+                        append(True)
+                    else:
+                        append(int(line, 0))
+                elif code == 0x4c:              # LONG
+                    line, pos = _data_line(data, pos)
+                    if line[-1:] == b'L':
+                        line = line[:-1]
+                    append(int(line, 0))
+                elif code == 0x46:              # FLOAT
+                    line, pos = _data_line(data, pos)
+                    append(float(line))
+                elif code == 0x56:              # UNICODE
+                    line, pos = _data_line(data, pos)
+                    append(str(line, 'raw-unicode-escape'))
+                elif code == 0x55 or code == 0x54:
+                    # SHORT_BINSTRING, BINSTRING
+                    if code == 0x55:
+                        n = data[pos]
+                        pos += 1 + n
+                    else:
+                        n, = unpack_from('<i', data, pos)
+                        if n < 0:
+                            raise UnpicklingError("BINSTRING pickle has "
+                                                  "negative byte count")
+                        pos += 4 + n
+                    value = data[pos - n:pos]
+                    if len(value) < n:
+                        raise UnpicklingError("pickle data was truncated")
+                    if encoding != "bytes":
+                        value = value.decode(encoding, errors)
+                    append(value)
+                elif code == 0x53:              # STRING
+                    line, pos = _data_line(data, pos)
+                    if (len(line) >= 2 and line[0] == line[-1] and
+                            line[0] in b'"\''):
+                        line = line[1:-1]
+                    else:
+                        raise UnpicklingError("the STRING opcode argument "
+                                              "must be quoted")
+                    value = codecs.escape_decode(line)[0]
+                    if encoding != "bytes":
+                        value = value.decode(encoding, errors)
+                    append(value)
+                else:
+                    break
+    except struct_error:
+        raise UnpicklingError("pickle data was truncated") from None
+    except IndexError:
+        # Either data or the stack ran out.
+        if pos == 0:
+            raise EOFError("Ran out of input") from None
+        if pos >= len(data):
+            raise UnpicklingError("pickle data was truncated") from None
+        raise UnpicklingError("unpickling stack underflow") from None
+    if code in _DATA_REJECTED:
+        raise UnpicklingError("loads_data() does not accept the %s opcode" %
+                              _DATA_REJECTED[code])
+    raise UnpicklingError("invalid load key, '%c'." % code)
+
+# Compiled plans for loads_data()
+#
+# Many streams carry pickles whose opcodes are all the same from one
+# message to the next, with only the values of the atoms changing.  A
+# DataPlanCache compiles such an opcode sequence into a Python function
+# that checks the opcodes and builds the result directly.
+#
+# The skeleton of a pickle is the sequence of its opcodes together with
+# the arguments that are not values: the protocol number and memo keys.
+# Atom values, their lengths and frame sizes are left out.
+
+# Argument layout of the opcodes a plan can contain, derived from
+# _opcode_args: the length of the argument that is part of the skeleton,
+# the length of a fixed-size value argument, and the struct format of the
+# length prefix of a variable-size value, if any.  The fixed-size
+# arguments of PROTO and the memo opcodes are the skeleton ones.
+_PLAN_OPS = {}
+for _op in (PROTO, FRAME, STOP, MARK, POP, POP_MARK, DUP, MEMOIZE, BINPUT,
+            LONG_BINPUT, BINGET, LONG_BINGET, NONE, NEWTRUE, NEWFALSE,
+            BININT1, BININT2, BININT, BINFLOAT, LONG1, LONG4,
+            SHORT_BINUNICODE, BINUNICODE, BINUNICODE8, SHORT_BINBYTES,
+            BINBYTES, BINBYTES8, BYTEARRAY8, EMPTY_TUPLE, TUPLE1, TUPLE2,
+            TUPLE3, TUPLE, EMPTY_LIST, APPEND, APPENDS, LIST, EMPTY_DICT,
+            SETITEM, SETITEMS, DICT, EMPTY_SET, ADDITEMS, FROZENSET):
+    _size, _prefix = _opcode_args[_op[0]][:2]
+    if _op in (PROTO, BINPUT, LONG_BINPUT, BINGET, LONG_BINGET):
+        _PLAN_OPS[_op[0]] = (_size, 0, _prefix)
+    else:
+        _PLAN_OPS[_op[0]] = (0, _size, _prefix)
+del _op, _size, _prefix
+
+# Longest skeleton, in opcodes, that is compiled.
+_PLAN_MAX_OPS = 2000
+
+def _data_skeleton(data):
+    # Return the skeleton of data as bytes, or None if it contains an
+    # opcode that plans do not support or is malformed.
+    skeleton = bytearray()
+    pos = 0
+    ops = 0
+    try:
+        while ops < _PLAN_MAX_OPS:
+            code = data[pos]
+            layout = _PLAN_OPS.get(code)
+            if layout is None:
+                return None
+            skeleton_size, size, prefix = layout
+            skeleton += data[pos:pos + 1 + skeleton_size]
+            pos += 1 + skeleton_size + size
+            if prefix is not None:
+                n, = unpack_from(prefix, data, pos)
+                if n < 0:
+                    return None
+                pos += calcsize(prefix) + n
+            if code == STOP[0]:
+                return bytes(skeleton)
+            ops += 1
+    except (IndexError, struct_error):
+        pass
+    return None
+
+def _compile_plan(skeleton):
+    # Compile a skeleton into a function of the pickle data that returns
+    # the loaded object, or raises any exception if the data does not
+    # match.  Return None if the skeleton cannot be compiled.
+    lines = []
+    checks = []         # (offset, expected bytes) not yet checked
+    stack = []          # expressions of the values on the stack
+    marks = []
+    memo = {}
+    names = count()
+    offset = 0          # of the next opcode, relative to pos
+
+    def new_var(expr):
+        name = "v%d" % next(names)
+        lines.append("%s = %s" % (name, expr))
+        return name
+
+    def flush_checks():
+        # Check the opcodes read since pos last moved, merging runs of
+        # adjacent bytes.
+        runs = []
+        for start, expected in checks:
+            if runs and runs[-1][0] + len(runs[-1][1]) == start:
+                runs[-1][1] += expected
+            else:
+                runs.append([start, bytearray(expected)])
+        tests = []
+        for start, expected in runs:
+            if len(expected) == 1:
+                tests.append("data[pos + %d] != %d" % (start, expected[0]))
+            else:
+                tests.append("data[pos + %d:pos + %d] != %r" %
+                             (start, start + len(expected), bytes(expected)))
+        if tests:
+            lines.append("if %s: raise _PlanMismatch" % " or ".join(tests))
+        del checks[:]
+
+    def pop_mark():
+        mark = marks.pop()
+        items = stack[mark:]
+        del stack[mark:]
+        return items
+
+    i = 0
+    while i < len(skeleton):
+        code = skeleton[i]
+        skeleton_size, size, prefix = _PLAN_OPS[code]
+        checks.append((offset, skeleton[i:i + 1 + skeleton_size]))
+        arg = skeleton[i + 1:i + 1 + skeleton_size]
+        i += 1 + skeleton_size
+        at = offset + 1 + skeleton_size         # offset of the value
+        offset = at + size
+        if prefix is not None:
+            flush_checks()
+            prefix_size = calcsize(prefix)
+            if prefix == '<B':
+                lines.append("n = data[pos + %d]" % at)
+            else:
+                lines.append("n = unpack_from(%r, data, pos + %d)[0]" %
+                             (prefix, at))
+            if prefix == '<i':
+                lines.append("if n < 0: raise _PlanMismatch")
+            lines.append("pos += %d + n" % (at + prefix_size))
+            offset = 0
+            payload = "data[pos - n:pos]"
+            if code == SHORT_BINUNICODE[0] or code == BINUNICODE[0] or \
+                    code == BINUNICODE8[0]:
+                stack.append(new_var("str(%s, 'utf-8', 'surrogatepass')" %
+                                     payload))
+            elif code == LONG1[0] or code == LONG4[0]:
+                stack.append(new_var("int.from_bytes(%s, 'little', "
+                                     "signed=True)" % payload))
+            elif code == BYTEARRAY8[0]:
+                stack.append(new_var("bytearray(%s)" % payload))
+            else:
+                stack.append(new_var(payload))
+        elif code == BININT1[0]:
+            stack.append(new_var("data[pos + %d]" % at))
+        elif code == BININT2[0]:
+            stack.append(new_var("unpack_from('<H', data, pos + %d)[0]" % at))
+        elif code == BININT[0]:
+            stack.append(new_var("unpack_from('<i', data, pos + %d)[0]" % at))
+        elif code == BINFLOAT[0]:
+            stack.append(new_var("unpack_from('>d', data, pos + %d)[0]" % at))
+        elif code == NONE[0]:
+            stack.append("None")
+        elif code == NEWTRUE[0]:
+            stack.append("True")
+        elif code == NEWFALSE[0]:
+            stack.append("False")
+        elif code == EMPTY_TUPLE[0]:
+            stack.append("()")
+        elif code == EMPTY_LIST[0]:
+            stack.append(new_var("[]"))
+        elif code == EMPTY_DICT[0]:
+            stack.append(new_var("{}"))
+        elif code == EMPTY_SET[0]:
+            stack.append(new_var("set()"))
+        elif code == MARK[0]:
+            marks.append(len(stack))
+        elif code in (MEMOIZE[0], BINPUT[0], LONG_BINPUT[0]):
+            if code == MEMOIZE[0]:
+                key = len(memo)
+            else:
+                key = int.from_bytes(arg, 'little')
+            memo[key] = stack[-1]
+        elif code == BINGET[0] or code == LONG_BINGET[0]:
+            stack.append(memo[int.from_bytes(arg, 'little')])
+        elif code in (TUPLE1[0], TUPLE2[0], TUPLE3[0]):
+            n = _tuplesize2code.index(bytes((code,)))
+            items = stack[len(stack) - n:]
+            del stack[len(stack) - n:]
+            stack.append(new_var("(%s,)" % ", ".join(items)))
+        elif code == TUPLE[0]:
+            items = pop_mark()
+            stack.append(new_var("(%s)" % "".join(x + ", " for x in items)))
+        elif code == LIST[0]:
+            stack.append(new_var("[%s]" % ", ".join(pop_mark())))
+        elif code == DICT[0]:
+            items = pop_mark()
+            if len(items) & 1:
+                return None
+            stack.append(new_var("{%s}" % ", ".join(
+                "%s: %s" % (items[j], items[j + 1])
+                for j in range(0, len(items), 2))))
+        elif code == FROZENSET[0]:
+            items = pop_mark()
+            stack.append(new_var("frozenset((%s))" %
+                                 "".join(x + ", " for x in items)))
+        elif code == APPEND[0]:
+            value = stack.pop()
+            lines.append("%s.append(%s)" % (stack[-1], value))
+        elif code == APPENDS[0]:
+            items = pop_mark()
+            lines.append("%s.extend((%s))" %
+                         (stack[-1], "".join(x + ", " for x in items)))
+        elif code == SETITEM[0]:
+            value = stack.pop()
+            key = stack.pop()
+            lines.append("%s[%s] = %s" % (stack[-1], key, value))
+        elif code == SETITEMS[0]:
+            items = pop_mark()
+            if len(items) & 1:
+                return None
+            target = stack[-1]
+            for j in range(0, len(items), 2):
+                lines.append("%s[%s] = %s" % (target, items[j], items[j + 1]))
+        elif code == ADDITEMS[0]:
+            items = pop_mark()
+            lines.append("%s.update((%s))" %
+                         (stack[-1], "".join(x + ", " for x in items)))
+        elif code == POP[0]:
+            if marks and marks[-1] == len(stack):
+                marks.pop()
+            else:
+                stack.pop()
+        elif code == POP_MARK[0]:
+            pop_mark()
+        elif code == DUP[0]:
+            stack.append(stack[-1])
+        elif code == STOP[0]:
+            flush_checks()
+            lines.append("return %s" % stack.pop())
+        # PROTO and FRAME have nothing to build.
+    source = ("def plan(data, unpack_from=unpack_from, "
+              "_PlanMismatch=_PlanMismatch):\n    pos = 0\n" +
+              "".join("    %s\n" % line for line in lines))
+    namespace = {"unpack_from": unpack_from, "_PlanMismatch": _PlanMismatch}
+    exec(source, namespace)
+    return namespace["plan"]
+
+class _PlanMismatch(Exception):
+    pass
+
+class DataPlanCache:
+    """A cache of compiled plans for loads_data().
+
+    Pass an instance as the *plans* argument of loads_data().  A pickle
+    whose skeleton -- its opcodes, protocol and memo keys, but not the
+    values of its atoms -- has been loaded before is then loaded by a
+    Python function compiled for that skeleton, which decodes the values
+    and builds the result without interpreting the opcodes one by one.
+
+    A skeleton is compiled the second time it is seen.  The plan that
+    loaded the previous pickle is tried first; if it does not match, the
+    skeleton of the pickle is computed and looked up.  Pickles whose
+    skeleton has no plan are loaded by loads_data() as usual.  At most
+    *maxsize* skeletons are remembered, the least recently used ones
+    being evicted first.  Only pickles of protocol 1 and higher whose
+    strings are not Python 2 strings are compiled.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        # Maps skeletons to their plan, to False for skeletons seen once
+        # and to None for those that cannot be compiled.
+        self._plans = OrderedDict()
+        self._last = None
+
+    def clear(self):
+        """Forget all skeletons and plans."""
+        self._plans.clear()
+        self._last = None
+
+    def _load(self, data, encoding, errors):
+        plan = self._last
+        if plan is not None:
+            try:
+                return plan(data)
+            except Exception:
+                pass
+        skeleton = _data_skeleton(data)
+        if skeleton is None:
+            return loads_data(data, encoding=encoding, errors=errors)
+        plans = self._plans
+        plan = plans.get(skeleton, False)
+        if plan:
+            plans.move_to_end(skeleton)
+            self._last = plan
+            try:
+                return plan(data)
+            except Exception:
+                pass
+            return loads_data(data, encoding=encoding, errors=errors)
+        # Load the data first, so that malformed data is never compiled.
+        value = loads_data(data, encoding=encoding, errors=errors)
+        if skeleton in plans:
+            if plan is False:
+                try:
+                    plan = _compile_plan(skeleton)
+                except Exception:
+                    plan = None
+                plans[skeleton] = plan
+                self._last = plan
+            plans.move_to_end(skeleton)
+        else:
+            plans[skeleton] = False
+            while len(plans) > self.maxsize:
+                plans.popitem(last=False)
+        return value
+
+# Record logs
+
+class PickleLog:
+    """An append-only log of pickled records, with an index of offsets.
+
+    Each record is stored as an independent pickle at the end of the file
+    at *path*.  The file *path* + ".idx" holds the offset at which each
+    record ends, as an 8-byte little-endian integer, so that records can
+    be counted and read in any order without parsing the ones before.
+
+    With *mode* "a" (the default) the files are created if needed and
+    records can be appended; with "r" they are only read.  Opening a log
+    for appending recovers from a crash during an earlier append: complete
+    records missing from the index are indexed, and a partial last record
+    is truncated.  Records are written with *protocol*.  If *sync* is
+    true, each append is flushed to disk with os.fsync() before the index
+    entry that makes it visible, and again after it.  Other keyword
+    arguments are passed to Unpickler when records are read; with
+    bytes_as="memoryview", records may hold views of the mmap described
+    below, which stays mapped until they are released.
+
+    Records are read through an mmap of the file where possible.  A log
+    may have one writer, and any number of readers, in other processes,
+    which see new records through follow().  Instances are not thread-safe.
+    """
+
+    def __init__(self, path, mode="a", *, protocol=None, sync=False,
+                 **load_options):
+        if mode not in ("r", "a"):
+            raise ValueError("mode must be 'r' or 'a', not %r" % (mode,))
+        self.path = os.fspath(path)
+        self.index_path = self.path + ".idx"
+        self.mode = mode
+        self.protocol = protocol
+        self.sync = sync
+        self._load_options = load_options
+        self._map = None
+        self._ends = array('Q')
+        file_mode = "a+b" if mode == "a" else "rb"
+        self._data = open(self.path, file_mode)
+        try:
+            self._index = open(self.index_path, file_mode)
+        except BaseException:
+            self._data.close()
+            raise
+        try:
+            self._refresh()
+            if mode == "a":
+                self._recover()
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the log's files."""
+        self._unmap()
+        self._data.close()
+        self._index.close()
+
+    def _unmap(self):
+        # Drop the mmap of the data file, closing it unless records loaded
+        # with bytes_as="memoryview" still hold views of it; it is then
+        # unmapped once they are released.
+        mapping = self._map
+        if mapping is not None:
+            self._map = None
+            try:
+                mapping.close()
+            except BufferError:
+                pass
+
+    def __len__(self):
+        return len(self._ends)
+
+    def _refresh(self):
+        # Read the index entries appended since the last call; a partial
+        # last entry is left for the next call.
+        index = self._index
+        ends = self._ends
+        n = os.fstat(index.fileno()).st_size // 8
+        if n > len(ends):
+            index.seek(len(ends) * 8)
+            entries = array('Q')
+            entries.frombytes(index.read((n - len(ends)) * 8))
+            if sys.byteorder == 'big':
+                entries.byteswap()
+            ends.extend(entries)
+
+    def _recover(self):
+        # Make the files agree after an interrupted append: the index
+        # entry may be partial or point past the data written, and the
+        # data may hold complete records after the last indexed one,
+        # followed by a partial record.
+        ends = self._ends
+        data = self._data
+        index = self._index
+        size = os.fstat(data.fileno()).st_size
+        indexed = len(ends)
+        while ends and ends[-1] > size:
+            ends.pop()
+        end = ends[-1] if ends else 0
+        if end < size:
+            data.seek(end)
+            tail = data.read()
+            pos = 0
+            while pos < len(tail):
+                stop = _pickle_end(tail, pos)
+                if stop is None:
+                    break
+                pos = stop
+                ends.append(end + pos)
+            if pos < len(tail):
+                data.truncate(end + pos)
+        if (len(ends) != indexed or
+                os.fstat(index.fileno()).st_size != indexed * 8):
+            keep = min(len(ends), indexed)
+            index.truncate(keep * 8)
+            self._write_index(ends[keep:])
+
+    def _write_index(self, ends):
+        entries = array('Q', ends)
+        if sys.byteorder == 'big':
+            entries.byteswap()
+        self._index.write(entries.tobytes())
+        self._index.flush()
+        if self.sync:
+            os.fsync(self._index.fileno())
+
+    def append(self, obj):
+        """Append a pickled record of obj to the log; return its index."""
+        if self.mode != "a":
+            raise io.UnsupportedOperation("log not opened for appending")
+        record = _dumps(obj, self.protocol)
+        data = self._data
+        data.write(record)
+        data.flush()
+        if self.sync:
+            os.fsync(data.fileno())
+        end = (self._ends[-1] if self._ends else 0) + len(record)
+        self._write_index((end,))
+        self._ends.append(end)
+        return len(self._ends) - 1
+
+    def extend(self, objs):
+        """Append a record for each object of the iterable objs."""
+        for obj in objs:
+            self.append(obj)
+
+    def get(self, i):
+        """Return the record at index i, which may be negative."""
+        ends = self._ends
+        if i < 0:
+            i += len(ends)
+        if not 0 <= i < len(ends):
+            raise IndexError("record index out of range")
+        start = ends[i - 1] if i else 0
+        end = ends[i]
+        mapping = self._mapping(end)
+        if mapping is not None:
+            mapping.seek(start)
+            return _Unpickler(mapping, **self._load_options).load()
+        self._data.seek(start)
+        return _loads(self._data.read(end - start), **self._load_options)
+
+    __getitem__ = get
+
+    def _mapping(self, end):
+        # Return an mmap of the data file covering at least end bytes, or
+        # None if the file cannot be mapped.
+        mapping = self._map
+        if mapping is None or len(mapping) < end:
+            self._unmap()
+            try:
+                import mmap
+                mapping = mmap.mmap(self._data.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+            except (ImportError, OSError, ValueError):
+                return None
+            self._map = mapping
+        return mapping
+
+    def scan(self, start=0, stop=None):
+        """Yield the records from index start up to index stop.
+
+        start and stop are interpreted as in a slice.
+        """
+        for i in range(*slice(start, stop).indices(len(self._ends))):
+            yield self.get(i)
+
+    def follow(self, start=0, *, interval=0.1, timeout=None):
+        """Yield the records from index start on, waiting for new ones.
+
+        The index is polled for records appended by another process every
+        *interval* seconds.  Stop once no record has been appended for
+        *timeout* seconds, or never if *timeout* is None.
+        """
+        from time import monotonic, sleep
+        i = start
+        last = monotonic()
+        while True:
+            while i < len(self._ends):
+                yield self.get(i)
+                i += 1
+                last = monotonic()
+            self._refresh()
+            if i < len(self._ends):
+                continue
+            if timeout is not None and monotonic() - last >= timeout:
+                return
+            sleep(interval)
+
+# Indexed pickles
+
+def _range_pickle(data, proto, key):
+    # Return a pickle of the value in data, a range of a pickle of protocol
+    # proto written when the memo of the pickler held key entries, without
+    # its FRAME opcodes and with MEMOIZE replaced by LONG_BINPUT, as
+    # _span_pickle() does for a scanned pickle.
+    chunks = [PROTO + bytes([proto])] if proto >= 2 else []
+    if proto >= 4:
+        sizes = _opcode_sizes
+        unpack_uint4 = _unpack_uint4
+        pos = last = 0
+        end = len(data)
+        while pos < end:
+            code = data[pos]
+            size = sizes[code]
+            if size:
+                if code == 0x94 or code == 0x95:        # MEMOIZE, FRAME
+                    chunks.append(data[last:pos])
+                    if code == 0x94:
+                        chunks.append(LONG_BINPUT + pack("<I", key))
+                        key += 1
+                    last = pos + size
+                pos += size
+            elif code == 0x8c or code == 0x43:
+                # SHORT_BINUNICODE, SHORT_BINBYTES
+                pos += 2 + data[pos + 1]
+            elif code == 0x58 or code == 0x42:
+                # BINUNICODE, BINBYTES
+                pos += 5 + unpack_uint4(data, pos + 1)[0]
+            else:
+                layout = _opcode_args[code]
+                if layout is None:
+                    # Left for the unpickler to report.
+                    break
+                pos = _opcode_arg(data, pos + 1, layout)[2]
+        data = data[last:]
+    chunks.append(data)
+    chunks.append(STOP)
+    return b''.join(chunks)
+
+class PickleIndex:
+    """Random access to the entries of a dict or list pickled with an index.
+
+    *file* is a binary file positioned at the start of a pickle written by
+    a Pickler created with an *index_file*, and *index_file* a binary
+    file positioned at the index written for that pickle.  An entry is
+    loaded from the byte range the index gives for it, through an mmap of
+    *file* or the buffer of an io.BytesIO where possible and otherwise by
+    seeking and reading, without parsing the rest of the pickle.  Other
+    keyword arguments are passed to Unpickler, for the index as well.
+
+    Each lookup loads its entry into a new memo, after the keys and items
+    defining the memo entries it reads from elsewhere, such as a string
+    it shares with an earlier entry; the value equals that of a full
+    load, but values are not shared between lookups.  An entry that
+    refers to the root itself is taken from a full load.
+    """
+
+    def __init__(self, file, index_file, **load_options):
+        self._load_options = load_options
+        index = _Unpickler(index_file, **load_options).load()
+        if type(index) is not dict or index.get("kind") not in ("dict",
+                                                                 "list"):
+            raise UnpicklingError("invalid pickle index")
+        self._index = index
+        self.kind = index["kind"]
+        self._file = file
+        self._view, self._pos, self._mapping = _open_scan(file, False)
+        if self._view is None:
+            self._pos = file.tell()
+        elif len(self._view) < self._pos + index["size"]:
+            self.close()
+            raise UnpicklingError("pickle data was truncated")
+        self._positions = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Release the view of the file; the file itself is left open."""
+        if self._view is not None:
+            _close_scan(self._view, self._mapping)
+            self._view = self._mapping = None
+
+    def __len__(self):
+        n = len(self._index["memo_starts"]) - 1
+        return n // 2 if self.kind == "dict" else n
+
+    def keys(self):
+        """Return the list of the keys of a dict, or a range for a list."""
+        if self.kind == "dict":
+            return list(self._index["keys"])
+        return range(len(self))
+
+    def _item(self, key):
+        # Return the number of the item of the index holding the value
+        # of key.
+        if self.kind == "list":
+            n = len(self)
+            try:
+                i = key.__index__()
+            except AttributeError:
+                raise TypeError("list indices must be integers, not %s" %
+                                type(key).__name__) from None
+            if i < 0:
+                i += n
+            if not 0 <= i < n:
+                raise IndexError("list index out of range")
+            return i
+        positions = self._positions
+        if positions is None:
+            keys = self._index["keys"]
+            positions = self._positions = dict(zip(keys, range(len(keys))))
+        return 2 * positions[key] + 1
+
+    def __contains__(self, key):
+        try:
+            self._item(key)
+        except (KeyError, IndexError):
+            return False
+        return True
+
+    def __getitem__(self, key):
+        value = self._load_item(self._item(key))
+        if value is self:
+            return self.load()[key]
+        return value
+
+    def get(self, key, default=None):
+        """Return the value for key if it is in the dict, else default."""
+        try:
+            i = self._item(key)
+        except KeyError:
+            return default
+        value = self._load_item(i)
+        if value is self:
+            return self.load()[key]
+        return value
+
+    def load(self):
+        """Load the whole pickle."""
+        if self._view is not None:
+            data = self._view[self._pos:self._pos + self._index["size"]]
+            return _Unpickler(io.BytesIO(data), **self._load_options).load()
+        self._file.seek(self._pos)
+        return _Unpickler(self._file, **self._load_options).load()
+
+    def _load_item(self, i):
+        # Load item i of the index, or return self if it refers to the
+        # root.
+        index = self._index
+        deps = index["deps"]
+        dep_starts = index["dep_starts"]
+        memo_starts = index["memo_starts"]
+        last = len(memo_starts) - 1
+        # The items that define the memo entries read, and so on.
+        needed = set()
+        pending = [i]
+        while pending:
+            j = pending.pop()
+            for key in deps[dep_starts[j]:dep_starts[j + 1]]:
+                j = bisect_right(memo_starts, key, 0, last) - 1
+                if j < 0 or key >= memo_starts[last]:
+                    if key == index["memo"]:
+                        return self
+                    raise UnpicklingError("memo key %d is not defined by "
+                                          "this pickle" % key)
+                if j not in needed:
+                    needed.add(j)
+                    pending.append(j)
+        unpickler = _Unpickler(io.BytesIO(), **self._load_options)
+        for j in sorted(needed):
+            unpickler._load_fragment(self._item_pickle(j))
+        return unpickler._load_fragment(self._item_pickle(i))
+
+    def _item_pickle(self, i):
+        index = self._index
+        spans = index["spans"]
+        start = self._pos + spans[2 * i]
+        end = self._pos + spans[2 * i + 1]
+        if self._view is not None:
+            data = self._view[start:end]
+        else:
+            self._file.seek(start)
+            data = self._file.read(end - start)
+            if len(data) < end - start:
+                raise UnpicklingError("pickle data was truncated")
+        return _range_pickle(data, index["proto"],
+                             index["memo_starts"][i])
 
 # Use the faster _pickle if possible
 try:
@@ -3,6 +3,21 @@ import hashlib
 import coverage
 import importlib.util
 import io
+import os
+import gc
+import mmap
+import tempfile
+import threading
+import dataclasses
+import datetime
+import decimal
+import enum
+import fractions
+import functools
+import pathlib
+import uuid
+import weakref
+from collections import deque, namedtuple, OrderedDict, defaultdict, Counter
 from test_pickle_usage import PurePythonPickleTester
 
 sys.modules['_pickle'] = None
@@ -146,11 +161,1318 @@ def test_pickle_coverage():
     except Exception as e:
         print(f"Expected exception caught: {e}")
 
+def test_collections_containers():
+    recursive_deque = deque()
+    recursive_deque.append(recursive_deque)
+    test_objects = [
+        deque([1, 2, 3]),
+        deque(range(2500), maxlen=3000),
+        OrderedDict([("b", 1), ("a", 2)]),
+        defaultdict(list, {"k": [1]}),
+        Counter("mississippi"),
+    ]
+
+    print("\nTesting collections containers")
+    for obj in test_objects:
+        for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+            data = pickle.dumps(obj, protocol=proto)
+            restored = pickle.loads(data)
+            assert type(restored) is type(obj), f"Type mismatch: {restored!r}"
+            assert restored == obj, f"Mismatch: {restored} != {obj}"
+        print(f"  {type(obj).__name__}: OK")
+
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        restored = pickle.loads(pickle.dumps(recursive_deque, protocol=proto))
+        assert restored[0] is restored, "Recursive deque not preserved"
+
+    restored = pickle.loads(pickle.dumps(defaultdict(list), protocol=2))
+    assert restored.default_factory is list
+
+    # Reducers in a dispatch table take precedence over the fast paths.
+    for obj in test_objects:
+        f = io.BytesIO()
+        pickler = pickle._Pickler(f, 2)
+        pickler.dispatch_table = {type(obj): lambda obj: (list, (list(obj),))}
+        pickler.dump(obj)
+        assert pickle.loads(f.getvalue()) == list(obj), type(obj)
+
+class Color(enum.Enum):
+    RED = 1
+    GREEN = 2
+
+def test_stdlib_value_types():
+    values = [
+        datetime.datetime(2024, 5, 6, 7, 8, 9, 10),
+        datetime.datetime(2024, 5, 6, tzinfo=datetime.timezone.utc),
+        datetime.date(2024, 5, 6),
+        datetime.time(7, 8, 9),
+        datetime.timedelta(days=-2, seconds=5),
+        decimal.Decimal("-12.50"),
+        uuid.UUID("12345678-1234-5678-1234-567812345678"),
+        fractions.Fraction(-3, 4),
+        Color.GREEN,
+        pathlib.PurePosixPath("/tmp/data.bin"),
+    ]
+
+    print("\nTesting stdlib value types")
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        data = pickle.dumps(values, protocol=proto, stdlib_types=True)
+        for restored in (pickle.loads(data),
+                         pickle.loads(data, stdlib_types=True)):
+            assert restored == values, f"Mismatch: {restored} != {values}"
+            assert restored[8] is Color.GREEN
+        print(f"  Protocol {proto}: {len(data)} bytes")
+
+Point = namedtuple("Point", ["x", "y"])
+
+@dataclasses.dataclass
+class Event:
+    id: int
+    name: str
+    tags: list = dataclasses.field(default_factory=list)
+
+@dataclasses.dataclass(frozen=True)
+class FrozenEvent:
+    id: int
+
+def test_records():
+    records = [Point(1, 2), Event(1, "start", ["a"]), Event(2, "stop"),
+               FrozenEvent(3), [Point(3, 4), Point(5, 6)]]
+
+    print("\nTesting namedtuples and dataclasses")
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        restored = pickle.loads(pickle.dumps(records, protocol=proto))
+        assert restored == records, f"Mismatch: {restored} != {records}"
+        assert type(restored[0]) is Point
+        print(f"  Protocol {proto}: OK")
+
+    # Equal attribute names are shared between loaded instances.
+    events = pickle.loads(pickle.dumps([Event(i, str(i)) for i in range(3)]))
+    names = [list(vars(e)) for e in events]
+    assert all(a is b for a, b in zip(names[0], names[2]))
+
+    # Records are written without object.__reduce_ex__(), which caches
+    # __slotnames__ on the class, and the handler cached for a class does
+    # not keep it alive.  Local is not importable, so pickling fails when
+    # the class itself is saved.
+    @dataclasses.dataclass
+    class Local:
+        id: int
+    try:
+        pickle.dumps(Local(1), 2)
+    except pickle.PicklingError:
+        pass
+    else:
+        raise AssertionError("local class pickled")
+    assert "__slotnames__" not in vars(Local)
+    local = weakref.ref(Local)
+    del Local
+    gc.collect()
+    assert local() is None, "class kept alive by the pickler"
+
+def scale(value, factor=2):
+    return value * factor
+
+class Task:
+    def __init__(self, name):
+        self.name = name
+    def run(self, value):
+        return f"{self.name}:{value}"
+    @staticmethod
+    def helper(value):
+        return value + 1
+
+def test_callables():
+    envelopes = [
+        (scale, (3,), {}),
+        (functools.partial(scale, factor=10), (3,), {}),
+        (Task("t1").run, (3,), {}),
+        (Task.helper, (3,), {}),
+        (max, ([3, 1],), {}),
+        ({}.fromkeys, ("ab",), {}),
+    ]
+
+    print("\nTesting callables")
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        for func, args, kwargs in envelopes:
+            data = pickle.dumps((func, args, kwargs), protocol=proto)
+            f, a, k = pickle.loads(data)
+            assert f(*a, **k) == func(*args, **kwargs), f"Mismatch for {func!r}"
+        print(f"  Protocol {proto}: OK")
+
+    assert pickle.loads(pickle.dumps(str.maketrans)) is str.maketrans
+    # A static method is written as getattr() of its type, not by name.
+    data = pickle.dumps(str.maketrans, 4)
+    assert b"getattr" in data and b"str.maketrans" not in data
+    assert pickle.loads(data) is str.maketrans
+    # Pickling a partial does not create its __dict__.
+    func = functools.partial(scale, 3)
+    reduced = func.__reduce__()
+    assert pickle.loads(pickle.dumps(func))() == 6
+    assert func.__reduce__() == reduced and reduced[2][3] is None
+    try:
+        pickle.dumps(Task.__dict__["helper"])
+    except (TypeError, pickle.PicklingError):
+        pass
+    else:
+        raise AssertionError("staticmethod descriptor pickled")
+
+    # Reducers in a dispatch table take precedence over the fast paths.
+    for func, args, kwargs in envelopes[1:3] + envelopes[4:]:
+        f = io.BytesIO()
+        pickler = pickle._Pickler(f, 2)
+        pickler.dispatch_table = {type(func): lambda func: (str, ("r",))}
+        pickler.dump(func)
+        assert pickle.loads(f.getvalue()) == "r", func
+
+    # Functions saved by reference are cached without keeping them alive.
+    def runtime(value):
+        return value
+    runtime.__qualname__ = "runtime_function"
+    globals()["runtime_function"] = runtime
+    assert pickle.loads(pickle.dumps(runtime)) is runtime
+    assert runtime in pickle._global_names
+    del globals()["runtime_function"]
+    runtime = weakref.ref(runtime)
+    gc.collect()
+    assert runtime() is None, "function kept alive by the pickler"
+
+class CountingUnpickler(pickle._Unpickler):
+    dispatch = dict(pickle._Unpickler.dispatch)
+
+    def load_binint1(self):
+        self.binint1_count = getattr(self, "binint1_count", 0) + 1
+        pickle._Unpickler.load_binint1(self)
+    dispatch[pickle.BININT1[0]] = load_binint1
+
+def test_load_dispatch():
+    obj = {"a": [1, 2, (3, 4.5)], "b": ("x" * 300, None, True, 70000)}
+
+    print("\nTesting load dispatch")
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        data = pickle.dumps(obj, protocol=proto)
+        assert pickle.loads(data) == obj, f"Mismatch at protocol {proto}"
+        unpickler = CountingUnpickler(io.BytesIO(data))
+        assert unpickler.load() == obj, f"Override mismatch at protocol {proto}"
+        if proto >= 1:
+            assert unpickler.binint1_count == 3
+        print(f"  Protocol {proto}: OK")
+
+    for data in (b"\xff", b"\x80\x04\xff."):
+        try:
+            pickle.loads(data)
+        except pickle.UnpicklingError as e:
+            assert "invalid load key" in str(e)
+        else:
+            raise AssertionError(f"{data!r} loaded")
+
+    try:
+        pickle.loads(b"}(Nu.")
+    except IndexError:
+        pass
+    else:
+        raise AssertionError("odd-length SETITEMS loaded")
+
+    # A frame that ends before the argument of its last opcode: the
+    # argument is read from after the frame, as _Unframer.read() does.
+    data = (b"\x80\x05\x95\x13\x00\x00\x00\x00\x00\x00\x00K\x01]\x94(K\x02K"
+            b"\x03\x85\x94e\x8c\x01s\x94\x87\x94K\x02K\x03\x85.")
+    assert pickle.loads(data) == (3,)
+    # The first frame size ends a frame before an argument, the second
+    # inside one, which is truncated.
+    for body, size, inside, value in (
+            (b"G?\xf8" + bytes(6), 1, 2, 1.5),
+            (b"J\x07\x00\x00\x00", 1, 2, 7),
+            (b"\x8c\x02ab", 1, 3, "ab"),
+            (b"N\x94j\x00\x00\x00\x00\x86", 3, 4, (None, None))):
+        data = b"\x80\x05\x95" + bytes([size]) + bytes(7) + body + b"."
+        assert pickle.loads(data) == value
+        data = b"\x80\x05\x95" + bytes([inside]) + bytes(7) + body + b"."
+        try:
+            pickle.loads(data)
+        except pickle.UnpicklingError as e:
+            assert "exhausted before end of frame" in str(e)
+        else:
+            raise AssertionError(f"{data!r} loaded")
+
+def test_unpickler_memo():
+    print("\nTesting unpickler memo")
+    # PUT keys out of order: 3, 1, then 0 and 2.
+    data = b"(lp3\nS'a'\np1\naI7\np0\nag3\nag1\nag0\naI9\np2\n0g2\na."
+    result = pickle.loads(data)
+    assert result[:2] == ["a", 7] and result[2] is result
+    assert result[3:] == ["a", 7, 9]
+
+    unpickler = pickle._Unpickler(io.BytesIO(data))
+    unpickler.load()
+    assert sorted(unpickler.memo) == [0, 1, 2, 3]
+    unpickler.memo = {5: "x"}
+    assert unpickler.memo == {5: "x"}
+    # The memo attribute is a view: changes to it are seen by load().
+    memo = unpickler.memo
+    memo[0] = "y"
+    memo.update({1: "z", 3: "w"})
+    assert memo.copy() == {0: "y", 1: "z", 3: "w", 5: "x"}
+    unpickler = pickle._Unpickler(io.BytesIO(b"\x80\x02h\x00.h\x05.h\x05."))
+    unpickler.memo[0] = "x"
+    unpickler.memo[5] = "v"
+    assert unpickler.load() == "x" and unpickler.load() == "v"
+    del unpickler.memo[0]
+    assert dict(unpickler.memo) == {5: "v"}
+    unpickler.memo = unpickler.memo
+    assert len(unpickler.memo) == 1
+    unpickler.memo.clear()
+    try:
+        unpickler.load()
+    except pickle.UnpicklingError:
+        pass
+    else:
+        raise AssertionError("cleared memo read")
+    for bad, exc in ((object(), TypeError), ({-1: None}, ValueError)):
+        try:
+            unpickler.memo = bad
+        except exc:
+            pass
+        else:
+            raise AssertionError(f"memo = {bad!r} accepted")
+
+    for data in (b"\x80\x02h\x00.", b"\x80\x02N\x94j\x05\x00\x00\x00.",
+                 b"Np1\ng2\n."):
+        try:
+            pickle.loads(data)
+        except pickle.UnpicklingError as e:
+            assert "Memo value not found" in str(e)
+        else:
+            raise AssertionError(f"{data!r} loaded")
+    print("  OK")
+
+def test_marks():
+    print("\nTesting marks")
+    good = {
+        b"(I1\nI2\n(I3\ntt.": (1, 2, (3,)),
+        b"(I1\n1I2\n.": 2,
+        b"(0I5\n.": 5,
+        b"]q\x00(K\x01K\x02e(K\x03e.": [1, 2, 3],
+        b"}(U\x01aK\x01u.": {"a": 1},
+    }
+    bad = [b"N(.", b"N(2", b"]N(a", b"}((u", b"]((e", b"N(\x94",
+           b"NN(\x86", b"cbuiltins\nlist\n)(R", b"1"]
+    for unpickler_class in (pickle._Unpickler, CountingUnpickler):
+        for data, expected in good.items():
+            result = unpickler_class(io.BytesIO(data)).load()
+            assert result == expected, f"{data!r} gave {result!r}"
+        for data in bad:
+            try:
+                unpickler_class(io.BytesIO(data)).load()
+            except IndexError:
+                pass
+            else:
+                raise AssertionError(f"{data!r} loaded")
+    print("  OK")
+
+find_class_events = []
+
+def audit_find_class(event, args):
+    if event == "pickle.find_class":
+        find_class_events.append(args)
+
+def test_find_class():
+    print("\nTesting find_class")
+    sys.addaudithook(audit_find_class)
+    objects = [datetime.date(2020, 1, 1), OrderedDict(a=1)]
+    data = b"".join(pickle.dumps(obj, protocol=2) for obj in objects * 2)
+    allowed = [("datetime", "date"), ("collections", "OrderedDict"),
+               ("_codecs", "encode")]
+    for kwargs in ({}, {"shared_global_cache": True},
+                   {"allowed_globals": allowed},
+                   {"allowed_globals": allowed, "shared_global_cache": True}):
+        del find_class_events[:]
+        unpickler = pickle._Unpickler(io.BytesIO(data), **kwargs)
+        result = [unpickler.load() for _ in range(4)]
+        assert result == objects * 2, kwargs
+        # One event per GLOBAL opcode, cached or not.
+        assert find_class_events.count(("datetime", "date")) == 2, kwargs
+
+    # Python 2 names are checked after mapping them.
+    assert pickle.loads(b"c__builtin__\nlen\n.",
+                        allowed_globals=[("builtins", "len")]) is len
+    for data in (b"cos\nsystem\n.", b"\x80\x04\x8c\x02os\x8c\x06system\x93."):
+        try:
+            pickle.loads(data, allowed_globals=allowed)
+        except pickle.UnpicklingError as e:
+            assert "forbidden" in str(e)
+        else:
+            raise AssertionError(f"{data!r} loaded")
+    print("  OK")
+
+class SlotsClass:
+    __slots__ = ("a", "b", "__dict__")
+
+class StateClass:
+    def __init__(self, value):
+        self.value = value
+    def __getstate__(self):
+        return {"value": self.value, "extra": 1}
+    def __setstate__(self, state):
+        self.value = state["value"]
+        self.restored = True
+
+class GuardedSlots:
+    __slots__ = ("a",)
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value * 2)
+
+class LazyAttrs:
+    def __getattr__(self, name):
+        if name == "__setstate__":
+            return lambda state: setattr(self, "via_getattr", state)
+        raise AttributeError(name)
+
+class OldStyleArgs:
+    def __init__(self, *args):
+        self.args = args
+    def __getinitargs__(self):
+        return ()
+
+def test_build():
+    print("\nTesting BUILD and OBJ")
+    slots = SlotsClass()
+    slots.a, slots.b, slots.c = 1, [2], "3"
+    guarded = GuardedSlots()
+    object.__setattr__(guarded, "a", 5)
+    lazy = LazyAttrs()
+    lazy.x = 1
+    objects = [slots, StateClass(4), guarded, lazy, SimpleClass(1, 2)]
+    for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+        # Several instances per class, so later ones reuse interned keys.
+        result = pickle.loads(pickle.dumps(objects * 3, protocol))
+        for s in result[0::5]:
+            assert (s.a, s.b, s.c) == (1, [2], "3"), protocol
+        for s in result[1::5]:
+            assert s.value == 4 and s.restored, protocol
+            assert not hasattr(s, "extra"), protocol
+        for g in result[2::5]:
+            assert g.a == 10, protocol
+        for l in result[3::5]:
+            assert l.via_getattr == {"x": 1}, protocol
+        assert result[4::5] == [SimpleClass(1, 2)] * 3, protocol
+
+    # An instance attribute shadows the class's __setstate__.
+    shadowed = SimpleClass(1, 2)
+    shadowed.__setstate__ = lambda state: setattr(shadowed, "seen", state)
+    unpickler = pickle._Unpickler(io.BytesIO(b"."))
+    for state in ({"x": 3}, {"x": 4}):
+        unpickler.stack = [shadowed, state]
+        unpickler.load_build()
+        assert shadowed.seen == state and shadowed.x == 1
+
+    # OBJ with no arguments only calls the class if it has __getinitargs__.
+    old_style = b"(c%s\nOldStyleArgs\no" % __name__.encode()
+    simple = b"(c%s\nSimpleClass\no" % __name__.encode()
+    data = b"(" + old_style * 2 + simple * 2 + b"l."
+    result = pickle.loads(data)
+    assert [hasattr(obj, "args") for obj in result] == [True, True, False, False]
+    assert not any(hasattr(obj, "x") for obj in result)
+    print("  OK")
+
+def test_intern_table():
+    print("\nTesting intern_table")
+    # Not memoized by the pickler, since the values are distinct objects.
+    records = [{"".join(["na", "me"]): "".join(["x", "y"]),
+                "key": (1, "".join(["a", "b"])), "flag": tuple([True]),
+                "point": tuple([0.0]), "long": "".join(["z"] * 100)}
+               for _ in range(3)]
+    # Protocol 0 writes strings as UNICODE, which is not interned.
+    for protocol in range(1, pickle.HIGHEST_PROTOCOL + 1):
+        data = pickle.dumps(records, protocol)
+        plain = pickle.loads(data)
+        assert plain == records
+        assert plain[0]["name"] is not plain[1]["name"], protocol
+        for unpickler_class in (pickle._Unpickler, CountingUnpickler):
+            result = unpickler_class(io.BytesIO(data), intern_table=True).load()
+            assert result == records, protocol
+            first, second = result[0], result[1]
+            assert first["name"] is second["name"], protocol
+            assert first["key"] is second["key"], protocol
+            assert first["flag"] is second["flag"], protocol
+            assert type(first["flag"][0]) is bool, protocol
+            assert first["point"] is not second["point"], protocol
+            # Only short strings are interned.
+            assert first["long"] is not second["long"], protocol
+            assert list(map(id, first)) == list(map(id, second)), protocol
+
+    # (1,) and (True,) are equal but must keep their types.
+    assert pickle.loads(pickle.dumps([(1,), (True,)], 2),
+                        intern_table=True) == [(1,), (True,)]
+    assert [type(t[0]) for t in pickle.loads(pickle.dumps([(1,), (True,)], 2),
+                                             intern_table=True)] == [int, bool]
+
+    # Tuples holding long strings, bytes or ints are not interned either.
+    table = {}
+    for big in ("z" * 100, b"z" * 100, 1 << 1000):
+        pickle.loads(pickle.dumps((big,), 4), intern_table=table)
+        pickle.loads(pickle.dumps((1, big), 4), intern_table=table)
+    assert table == {}, table
+
+    # A table shared across loads; it stops growing when full.
+    table = {}
+    a = pickle.loads(pickle.dumps("".join(["sh", "ared"]), 4), intern_table=table)
+    b = pickle.loads(pickle.dumps("".join(["sh", "ared"]), 4), intern_table=table)
+    assert a is b and table == {"shared": "shared"}
+    table.update((str(i), str(i)) for i in range(pickle._INTERN_MAX_ENTRIES))
+    pickle.loads(pickle.dumps("new", 4), intern_table=table)
+    assert "new" not in table
+    print("  OK")
+
+def test_bytes_as_memoryview():
+    print("\nTesting bytes_as='memoryview'")
+    blob = bytes(range(256)) * 1024
+    obj = {"blob": blob, "small": b"abc", "again": blob, "tail": [1, 2]}
+    for protocol in range(3, pickle.HIGHEST_PROTOCOL + 1):
+        data = pickle.dumps(obj, protocol)
+        result = pickle.loads(data, bytes_as="memoryview")
+        view = result["blob"]
+        assert type(view) is memoryview and view.readonly, protocol
+        assert view.obj is data, protocol
+        assert view == blob and result["again"] is view, protocol
+        assert result["small"] == b"abc" and result["tail"] == [1, 2]
+
+        file = io.BytesIO(data)
+        unpickler = pickle._Unpickler(file, bytes_as="memoryview")
+        result = unpickler.load()
+        assert type(result["blob"]) is memoryview and result == obj, protocol
+        # Once the views are released, the unpickler does not pin the input.
+        result["blob"].release()
+        file.write(b".")
+        del unpickler
+        assert pickle.loads(data) == obj
+        assert type(pickle.loads(data)["blob"]) is bytes
+
+    with tempfile.TemporaryFile() as f:
+        f.write(pickle.dumps([blob, "x"], 4))
+        f.flush()
+        with mmap.mmap(f.fileno(), 0) as m:
+            result = pickle._Unpickler(m, bytes_as="memoryview").load()
+            assert type(result[0]) is memoryview and result == [blob, "x"]
+            result[0].release()
+
+    try:
+        pickle.loads(b"N.", bytes_as="bytearray")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("bytes_as='bytearray' accepted")
+    print("  OK")
+
+def test_loads_data():
+    print("\nTesting loads_data")
+    shared = ["shared"]
+    data = {"none": None, "bools": [True, False], "ints": [0, -1, 255, 65536,
+            -2**31, 2**100], "float": -0.5, "str": "é" * 300, "bytes": b"\0",
+            "array": bytearray(b"ab"), "tuples": [(), (1,), (1, 2), (1, 2, 3),
+            tuple(range(5))], "sets": [set(), {1, 2}, frozenset({"a"})],
+            "refs": (shared, shared)}
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        # Older protocols pickle these types with REDUCE.
+        value = dict(data)
+        if protocol < 5:
+            value["array"] = None
+        if protocol < 4:
+            value["sets"] = None
+        if protocol < 3:
+            value["bytes"] = None
+        result = pickle.loads_data(pickle.dumps(value, protocol))
+        assert result == value, protocol
+        assert result["refs"][0] is result["refs"][1], protocol
+    recursive = []
+    recursive.append(recursive)
+    result = pickle.loads_data(pickle.dumps(recursive, 2))
+    assert result[0] is result
+    # Python 2 strings.
+    assert pickle.loads_data(b"U\x02ab.") == "ab"
+    assert pickle.loads_data(b"S'ab'\n.", encoding="bytes") == b"ab"
+
+    for obj in (SimpleClass(1, 2), datetime.date(2020, 1, 1), len, b"a"):
+        try:
+            pickle.loads_data(pickle.dumps(obj, 2))
+        except pickle.UnpicklingError as e:
+            assert "does not accept" in str(e), e
+        else:
+            raise AssertionError(f"{obj!r} loaded")
+    for bad, error in ((b"", EOFError), (b"\x8c\x05ab", pickle.UnpicklingError),
+                       (b"a.", pickle.UnpicklingError),
+                       (b"(]e.", pickle.UnpicklingError),
+                       (b"}(K\x01u.", pickle.UnpicklingError),
+                       (b"\x80\x04\x8f(KaKbu.", pickle.UnpicklingError),
+                       (b"\x80\x04](KaKbu.", pickle.UnpicklingError),
+                       (b"\x80\x04\x96\x02\x00\x00\x00\x00\x00\x00\x00ab"
+                        b"(KcKde.", pickle.UnpicklingError),
+                       (b"\x80\x04}KaKbs)a.", pickle.UnpicklingError),
+                       (b"\xff.", pickle.UnpicklingError)):
+        try:
+            pickle.loads_data(bad)
+        except error:
+            pass
+        else:
+            raise AssertionError(f"{bad!r} loaded")
+    print("  OK")
+
+def test_dumps_data():
+    print("\nTesting dumps_data")
+    shared = "".join(["sha", "red"])
+    recursive = [1]
+    recursive.append((recursive, shared))
+    values = [
+        None, True, 0, 255, 65535, -1, 2**31, 2**2100, 0.25, "", "é" * 300,
+        "x" * 70000, b"", b"y" * 300, b"z" * 70000, (), (1,), (1, 2, 3),
+        tuple(range(10)), list(range(2001)), {str(i): i for i in range(1001)},
+        set(range(1000)), frozenset("abc"), [shared, shared, (shared,)],
+        recursive, [{"id": i, "tags": [str(i)], "pos": (i, -i)}
+                    for i in range(3000)],
+    ]
+    for protocol in range(4, pickle.HIGHEST_PROTOCOL + 1):
+        data = pickle.dumps_data(values, protocol)
+        assert data == pickle.dumps(values, protocol), protocol
+        result = pickle.loads_data(data)
+        assert result[-1] == values[-1] and result[-2][1][0] is result[-2]
+    array = [bytearray(b"ab"), bytearray(70000)]
+    assert pickle.dumps_data(array, 5) == pickle.dumps(array, 5)
+
+    for obj, protocol in ((SimpleClass(1, 2), 4), ([1, {2: 1j}], 4),
+                          (Color.RED, 4), (bytearray(b"ab"), 4)):
+        try:
+            pickle.dumps_data(obj, protocol)
+        except pickle.PicklingError:
+            pass
+        else:
+            raise AssertionError(f"{obj!r} pickled")
+    try:
+        pickle.dumps_data([], 3)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("protocol 3 accepted")
+    print("  OK")
+
+def test_data_plans():
+    print("\nTesting DataPlanCache")
+    def message(i, protocol=4):
+        shared = [i, str(i)]
+        msg = {"method": "get", "id": i, "args": (shared, shared),
+               "big": 2**(64 + i), "ratio": i / 3}
+        if protocol >= 4:
+            # Sets and bytes are reduced to globals before protocol 4.
+            msg.update(blob=b"x" * i, flags={True, None})
+        return msg
+    cache = pickle.DataPlanCache(maxsize=2)
+    for protocol in (2, 3, 4, 5):
+        for i in range(5):
+            data = pickle.dumps(message(i, protocol), protocol)
+            result = pickle.loads_data(data, plans=cache)
+            expected = pickle.loads_data(data)
+            assert repr(result) == repr(expected), (protocol, i)
+            assert result["args"][0] is result["args"][1]
+        # Compiled on the second message of the same shape.
+        skeleton = pickle._data_skeleton(data)
+        assert cache._plans[skeleton] is cache._last is not None
+    assert len(cache._plans) <= 2
+
+    # Another shape, and back: the plan still matches.
+    recursive = []
+    recursive.append((recursive, 1))
+    for obj in ([1, 2], recursive, message(7), [3, 4], [5, 6]):
+        result = pickle.loads_data(pickle.dumps(obj, 4), plans=cache)
+        if obj is recursive:
+            assert result[0][0] is result
+        else:
+            assert result == obj
+    # Malformed data is rejected as without plans.
+    data = pickle.dumps([1, 2], 4)
+    for bad in (data[:-1], data[:-2] + b"a.", data[:-2] + b"u."):
+        errors = []
+        for plans in (None, cache, cache):
+            try:
+                pickle.loads_data(bad, plans=plans)
+            except Exception as e:
+                errors.append((type(e), str(e)))
+            else:
+                raise AssertionError(f"{bad!r} loaded")
+        assert errors[0] == errors[1] == errors[2], errors
+    cache.clear()
+    assert not cache._plans and cache._last is None
+    print("  OK")
+
+@dataclasses.dataclass
+class Sample:
+    id: int
+    value: float
+    unit: str
+    raw: bytes
+    valid: bool
+    note: object = None
+
+class Reading:
+    def __init__(self, sensor, level):
+        self.sensor = sensor
+        self.level = level
+
+def test_register_layout():
+    print("\nTesting register_layout")
+    import pickletools
+    def opcodes(data):
+        return [(op.name, arg) for op, arg, pos in pickletools.genops(data)
+                if op.name != "FRAME"]
+    extra = Reading("s", 1)
+    extra.calibrated = True
+    samples = [Sample(i, i / 4, "unit%d" % (i % 3), b"r", i % 2 == 0,
+                      [i] if i % 3 else None) for i in range(-300, 70000, 97)]
+    samples.append(Sample(2**70, 1, "u" * 300, b"r" * 300, None, samples[0]))
+    values = [samples, Reading("s1", 0.5), Reading(None, 2**40), extra,
+              samples[5], samples[5].__dict__, Reading("s1", "high")]
+    expected = [pickle.dumps(values, proto)
+                for proto in range(pickle.HIGHEST_PROTOCOL + 1)]
+    pickle.register_layout(Sample)
+    pickle.register_layout(Reading, {"sensor": str, "level": float})
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        data = pickle.dumps(values, proto)
+        assert opcodes(data) == opcodes(expected[proto]), proto
+        restored = pickle.loads(data)
+        assert restored[0] == samples
+        assert restored[0][5] is restored[4]
+        assert [vars(r) for r in restored[1:4]] == \
+            [vars(r) for r in values[1:4]]
+        print(f"  Protocol {proto}: OK")
+
+    # Hooks set on the pickler itself see the field values, and reducers
+    # in a dispatch table take precedence.
+    seen = []
+    f = io.BytesIO()
+    pickler = pickle._Pickler(f, 4)
+    pickler.persistent_id = lambda obj: seen.append(obj)
+    pickler.dump(Reading("abc", 5))
+    assert "abc" in seen and 5 in seen, seen
+    f = io.BytesIO()
+    pickler = pickle._Pickler(f, 4)
+    pickler.dispatch_table = {Reading: lambda obj: (str, ("r",))}
+    pickler.dump(Reading("abc", 5))
+    assert pickle.loads(f.getvalue()) == "r"
+
+    pickle.unregister_layout(Sample)
+    pickle.unregister_layout(Reading)
+    assert Sample not in pickle._Pickler.dispatch
+    assert Reading not in pickle._layout_builders
+    assert pickle.dumps(values, 4) == expected[4]
+    try:
+        pickle.unregister_layout(Reading)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("unregistered twice")
+
+    for cls in (SlotsClass, StateClass, LazyAttrs, Point, int):
+        try:
+            pickle.register_layout(cls)
+        except TypeError:
+            pass
+        else:
+            raise AssertionError(f"{cls!r} registered")
+
+def test_prefetch_globals():
+    print("\nTesting prefetch_globals")
+    values = [OrderedDict, fractions.Fraction(1, 3), Color.RED, scale]
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        data = pickle.dumps(values, proto)
+        times = pickle.prefetch_globals(data)
+        assert list(times) == ["collections", "fractions", __name__], times
+        file = io.BytesIO(b"xx" + data)
+        file.seek(2)
+        assert list(pickle.prefetch_globals(file, max_workers=2)) == \
+            list(times)
+        assert file.tell() == 2
+        assert pickle.loads(file.read(), shared_global_cache=True) == values
+
+    # A module first imported by the prefetch.
+    sys.modules.pop("colorsys", None)
+    data = (b"(ccolorsys\nrgb_to_hls\n(I1\nI0\nI0\ntR"
+            b"cfractions\nFraction\n(I1\ntRl.")
+    allowed = [("fractions", "Fraction")]
+    assert list(pickle.prefetch_globals(data, allowed_globals=allowed)) == \
+        ["fractions"]
+    assert "colorsys" not in sys.modules
+    with tempfile.TemporaryFile() as f:
+        f.write(data)
+        f.seek(0)
+        times = pickle.prefetch_globals(f)
+        assert list(times) == ["colorsys", "fractions"] and f.tell() == 0
+    assert "colorsys" in sys.modules
+    hits = pickle._find_global_cached.cache_info().hits
+    pickle.loads(data, shared_global_cache=True)
+    assert pickle._find_global_cached.cache_info().hits == hits + 2
+
+    # Invalid and truncated pickles are left for load() to report.
+    assert pickle.prefetch_globals(b"cfractions\nFrac") == {}
+    assert pickle.prefetch_globals(b"\xff") == {}
+    print("  OK")
+
+class GCProbe:
+    # Records whether the garbage collector is enabled when pickled and
+    # when unpickled.
+    def __reduce__(self):
+        return GCProbe, (), gc.isenabled()
+    def __setstate__(self, state):
+        self.dumped_with_gc = state
+        self.loaded_with_gc = gc.isenabled()
+
+def test_gc_mode():
+    print("\nTesting gc_mode")
+    assert gc.isenabled()
+    data = pickle.dumps([GCProbe()], gc_mode="disable")
+    assert gc.isenabled()
+    probe, = pickle.loads(data)
+    assert probe.dumped_with_gc is False and probe.loaded_with_gc is True
+    for mode in ("disable", "freeze"):
+        probe, = pickle.loads(data, gc_mode=mode)
+        assert probe.loaded_with_gc is False and gc.isenabled()
+        assert (gc.get_freeze_count() > 0) == (mode == "freeze")
+        gc.unfreeze()
+    # The collector's state is restored when loading fails.
+    try:
+        pickle.loads(data[:-1], gc_mode="disable")
+    except Exception:
+        pass
+    else:
+        raise AssertionError("truncated pickle loaded")
+    assert gc.isenabled()
+    gc.disable()
+    try:
+        pickle.loads(data, gc_mode="disable")
+        assert not gc.isenabled()
+    finally:
+        gc.enable()
+    for func, mode in ((pickle.dumps, "freeze"), (pickle.dumps, "off"),
+                       (pickle.loads, True)):
+        try:
+            func(data, gc_mode=mode)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"gc_mode={mode!r} accepted")
+    print("  OK")
+
+def test_dump_iter():
+    print("\nTesting dump_iter and dump_items")
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        for n in (0, 1, 2, 1000, 1001, 2500):
+            shared = "shared"
+            rows = [(i, str(i), shared) for i in range(n)]
+            f = io.BytesIO()
+            pickle.Pickler(f, proto).dump_iter(row for row in rows)
+            assert f.getvalue() == pickle.dumps(rows, proto), (proto, n)
+            table = {str(i): [i, shared] for i in range(n)}
+            f = io.BytesIO()
+            pickle.Pickler(f, proto).dump_items(iter(table.items()))
+            assert f.getvalue() == pickle.dumps(table, proto), (proto, n)
+            assert pickle.loads(f.getvalue()) == table
+
+    # Items are written while the iterable is being consumed.
+    f = io.BytesIO()
+    sizes = []
+    def rows():
+        for i in range(5000):
+            sizes.append(f.tell())
+            yield [i]
+    pickle.Pickler(f, 2).dump_iter(rows())
+    assert sizes[0] < sizes[2000] < sizes[4000]
+    assert pickle.loads(f.getvalue()) == [[i] for i in range(5000)]
+    print("  OK")
+
+class StreamOnly:
+    # A file without tell(), seek() or a buffer.
+    def __init__(self, data):
+        self._file = io.BytesIO(data)
+        self.read = self._file.read
+        self.readline = self._file.readline
+
+def test_iter_load():
+    print("\nTesting iter_load")
+    shared = {"kind": "shared"}
+    rows = [{"id": i, "name": str(i), "shared": shared} for i in range(2500)]
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        data = pickle.dumps(rows, proto)
+        for unpickler in (pickle.Unpickler(io.BytesIO(data)),
+                          CountingUnpickler(io.BytesIO(data)),
+                          pickle.Unpickler(StreamOnly(data))):
+            result = list(unpickler.iter_load())
+            assert result == rows, proto
+            assert all(row["shared"] is result[0]["shared"]
+                       for row in result)
+        # The list is emptied as its items are yielded.
+        unpickler = pickle.Unpickler(io.BytesIO(data))
+        items = unpickler.iter_load()
+        for i in range(1500):
+            next(items)
+        assert len(unpickler.stack[0]) <= 1000
+        assert len(list(items)) == 1000
+
+        # The list itself is referred to: loaded with load().
+        recursive = [1, 2]
+        recursive.append([recursive])
+        result = list(pickle.Unpickler(
+            io.BytesIO(pickle.dumps(recursive, proto))).iter_load())
+        assert result[:2] == [1, 2] and len(result[2][0]) == 3
+
+        for obj in ({}, (1, 2)):
+            unpickler = pickle.Unpickler(io.BytesIO(pickle.dumps(obj, proto)))
+            try:
+                list(unpickler.iter_load())
+            except pickle.UnpicklingError:
+                pass
+            else:
+                raise AssertionError(f"{obj!r} streamed")
+
+    with tempfile.TemporaryFile() as f:
+        pickle.Pickler(f).dump_iter({"id": i} for i in range(5000))
+        f.seek(0)
+        assert sum(1 for row in pickle.Unpickler(f).iter_load()) == 5000
+    print("  OK")
+
+def test_pickle_log():
+    print("\nTesting PickleLog")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = tmp + "/events.log"
+        with pickle.PickleLog(path, protocol=4) as log:
+            for i in range(300):
+                assert log.append({"seq": i, "payload": "x" * (i % 40)}) == i
+            log.extend([Event(1, "start"), Event(2, "stop")])
+            assert len(log) == 302
+            assert log.get(7)["seq"] == 7 and log[-1] == Event(2, "stop")
+            assert [r["seq"] for r in log.scan(295, 298)] == [295, 296, 297]
+            assert len(list(log.scan(-2))) == 2
+            try:
+                log.get(302)
+            except IndexError:
+                pass
+            else:
+                raise AssertionError("record 302 read")
+
+        # An interrupted append: a complete record missing from the index,
+        # a partial record and a partial index entry.
+        with open(path, "ab") as f:
+            f.write(pickle.dumps("indexed on recovery"))
+            f.write(pickle.dumps("lost")[:-2])
+        with open(path + ".idx", "ab") as f:
+            f.write(b"\x01\x02")
+        with pickle.PickleLog(path, "r") as reader:
+            assert len(reader) == 302
+            try:
+                reader.append(1)
+            except io.UnsupportedOperation:
+                pass
+            else:
+                raise AssertionError("append to a read-only log")
+        with pickle.PickleLog(path) as log:
+            assert len(log) == 303 and log[-1] == "indexed on recovery"
+            log.append("next")
+        with pickle.PickleLog(path, "r") as reader:
+            assert list(reader.scan(-2)) == ["indexed on recovery", "next"]
+            assert os.path.getsize(path + ".idx") == 8 * len(reader)
+
+            # A reader sees records appended later.
+            with pickle.PickleLog(path) as log:
+                log.append("later")
+                assert list(reader.follow(304, timeout=0)) == ["later"]
+
+        # Views of loaded records do not stop the log from growing.
+        path = tmp + "/views.log"
+        blob = bytes(100 * 1024)
+        with pickle.PickleLog(path, bytes_as="memoryview") as log:
+            log.append(blob)
+            first = log.get(0)
+            log.append(blob)
+            second = log.get(1)
+            assert type(first) is memoryview and first == second == blob
+            first.release()
+            second.release()
+    print("  OK")
+
+def test_scan():
+    print("\nTesting scan")
+    shared = ["shared"]
+    obj = {"meta": {"version": 3}, "rows": [Event(i, "e%d" % i)
+                                            for i in range(50)],
+           "again": shared, "first": shared}
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        data = pickle.dumps(obj, proto)
+        result = pickle.scan(data)
+        assert result.end == len(data) and result.root.kind == "dict"
+        entries = {key.value: value for key, value in result.root.items}
+        assert list(entries) == list(obj)
+        assert entries["meta"].size < entries["rows"].size
+        assert len(entries["rows"].items) == 50
+        row = entries["rows"].items[7]
+        assert row.kind == "object"
+        assert row.items[0].kind in ("global", "ref")
+        assert entries["first"].kind == "ref"
+        assert entries["first"].refs == entries["again"].shared
+        assert entries["again"].defines and not entries["again"].refs
+        key, = entries["first"].refs
+        assert result.memo_span(key).start == entries["again"].start
+        assert result.find(row.start) is row.items[0]
+        version = entries["meta"].items[0][1]
+        assert version.kind == "atom" and version.value == 3
+
+    # Nothing is imported or called.
+    data = b"\x80\x02cno_such_module\nboom\nq\x00)R."
+    result = pickle.scan(data)
+    assert result.root.kind == "object" and result.proto == 2
+    assert result.root.items[0].value == ("no_such_module", "boom")
+
+    many = pickle.dumps(list(range(3000)), 4)
+    assert len(pickle.scan(many).root.items) == 3000
+    for bad in (many[:-1], many[:100], b"\x80\x04h\x05.", b"e.", b"]a.",
+                b"\x80\x04\xff.", b"(u."):
+        try:
+            pickle.scan(bad)
+        except pickle.UnpicklingError:
+            pass
+        else:
+            raise AssertionError("scanned %r" % bad[:20])
+    print("  OK")
+
+def test_load_select():
+    print("\nTesting load_select")
+    shared = ["shared"]
+    obj = {"meta": {"version": 3, "tags": ("a", "b")},
+           "rows": [{"id": i, "name": "r%d" % i, "vals": [i, i * 0.5]}
+                    for i in range(40)],
+           "again": shared, "first": shared}
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        data = pickle.dumps(obj, proto)
+        assert pickle.loads(data, select=["meta"]) == {"meta": obj["meta"]}
+        ids = pickle.loads(data, select=[("rows", ..., "id")])
+        assert ids == {"rows": [{"id": i} for i in range(40)]}
+        last = pickle.loads(data, select=[("rows", -1, "vals", 0),
+                                          ("meta", "tags", 1), "missing"])
+        assert last == {"rows": [{"vals": [39]}], "meta": {"tags": ("b",)}}
+        first = pickle.loads(data, select=["first"])
+        assert first == {"first": ["shared"]}
+        assert pickle.loads(data, select=[()]) == obj
+
+        spans = pickle.loads(data, select=["first"], select_refs="placeholder")
+        assert isinstance(spans["first"], pickle.PickleSpan)
+        assert spans["first"].kind == "list"
+        # A dict key read from the memo is loaded, not a placeholder.
+        key = (1, "k")
+        keyed = pickle.dumps({"a": {key: 0}, "d": {key: 1}}, proto)
+        for refs in ("load", "placeholder"):
+            assert pickle.loads(keyed, select=[("d", key)],
+                                select_refs=refs) == {"d": {key: 1}}
+
+        f = io.BytesIO(data + b"after")
+        assert pickle.load(f, select=["meta"]) == {"meta": obj["meta"]}
+        assert f.read() == b"after"
+
+    # Recursive structures keep their shape.
+    x = {"a": [1]}
+    x["a"].append(x["a"])
+    x["self"] = x
+    y = pickle.loads(pickle.dumps(x, 4), select=["self"])
+    assert y["self"]["self"] is y["self"]
+    assert y["self"]["a"][1] is y["self"]["a"]
+
+    # The head of a long list is loaded before the rest is walked, which
+    # still has to be well formed.
+    many = pickle.dumps(list(range(3000)), 4)
+    assert pickle.loads(many, select=[0, -1]) == [0, 2999]
+    for load in (pickle.loads, lambda data, select: pickle.load(
+            io.BytesIO(data), select=select)):
+        try:
+            load(many[:-1], select=[0])
+        except pickle.UnpicklingError:
+            pass
+        else:
+            raise AssertionError("truncated pickle loaded")
+    # A list is the pickled object only if nothing is made of it after.
+    assert pickle.loads(pickle.dumps(([1, 2],), 4), select=[0]) == ([1, 2],)
+    # Values past the point where the scan stopped keep their frames out.
+    framed = {"a": 1, "big": ["x%d" % i * 20 for i in range(5000)], "z": 2}
+    data = pickle.dumps(framed, 4)
+    assert pickle.loads(data, select=["big"]) == {"big": framed["big"]}
+    assert (pickle.loads(data, select=[("big", ...)]) ==
+            {"big": framed["big"]})
+
+    # Scanning stops at the value after the selected entries, even in the
+    # middle of a batch of items and past values built from several, and
+    # the rest of the batch is only walked.  The entries are too large to
+    # be loaded whole.
+    rows = [(i, Event(i, "e%d" % i * 150)) for i in range(300)]
+    table = {"meta": (1, 2), "rows": rows, "obj": Event(0, "x")}
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        for value, paths in ((table, ["meta"]), (table, ["obj"]),
+                             (table, [("rows", 250, 1)]), (rows, [2]),
+                             (rows, [(250, 1)]), (list(range(3000)), [5])):
+            data = pickle.dumps(value, proto)
+            tree = pickle._select_tree(paths)
+            result = pickle.PickleScan(data, 0)
+            loader = pickle._SelectLoader(pickle._Unpickler(io.BytesIO(data)),
+                                          result, False)
+            pickle._scan(result, loader.until(tree))
+            assert result.end is None
+            assert (loader.select(result.root, tree) ==
+                    pickle._select_value(value, tree))
+    assert result.root.end < len(data) // 2
+
+    # Selecting from all of many small entries that make up most of the
+    # pickle loads it whole, once the walk is a quarter of the way through.
+    table = {"meta": {"k%d" % i: i for i in range(100)},
+             "rows": [{"id": i, "name": "n%d" % i} for i in range(2000)]}
+    for proto in range(1, pickle.HIGHEST_PROTOCOL + 1):
+        data = pickle.dumps(table, proto)
+        for paths, whole in (([("rows", ..., "id")], True),
+                             ([("meta", ...)], False)):
+            tree = pickle._select_tree(paths)
+            result = pickle.PickleScan(data, 0)
+            loader = pickle._SelectLoader(pickle._Unpickler(io.BytesIO(data)),
+                                          result, False)
+            pickle._scan(result, loader.until(tree))
+            assert (result.root is None) == whole
+            assert (pickle.loads(data, select=paths) ==
+                    pickle._select_value(table, tree))
+            f = io.BytesIO(data + b"tail")
+            assert (pickle.load(f, select=paths) ==
+                    pickle._select_value(table, tree))
+            assert f.read() == b"tail"
+    # So does selecting entries past the first quarter of such a list, or
+    # from its end.
+    for paths in ([("rows", 1500)], [("rows", 1500, "id")], [("rows", -1)],
+                  [("rows", 10), ("rows", -10), ("rows", 5000)]):
+        tree = pickle._select_tree(paths)
+        assert (pickle.loads(data, select=paths) ==
+                pickle._select_value(table, tree))
+    rows = table["rows"]
+    for paths in ([1500], [(1500, "name")], [-1, 3, 3, 5000]):
+        assert (pickle.loads(pickle.dumps(rows, 4), select=paths) ==
+                pickle._select_value(rows, pickle._select_tree(paths)))
+
+    # Memo keys read before they are defined are not a KeyError.
+    data = bytearray(pickle.dumps({"meta": {"v": 3},
+                                   "rows": [{"id": i} for i in range(50)],
+                                   "z": [1, 2]}, 4))
+    data[data.rindex(pickle.BINGET) + 1] = 183
+    try:
+        pickle.loads(bytes(data), select=["meta"])
+    except pickle.UnpicklingError:
+        pass
+    else:
+        raise AssertionError("undefined memo key loaded")
+
+    class Stream(io.RawIOBase):
+        def __init__(self, data):
+            self.data = io.BytesIO(data)
+        def readable(self):
+            return True
+        def readinto(self, b):
+            return self.data.readinto(b)
+    data = pickle.dumps(obj, 4)
+    selected = pickle.load(io.BufferedReader(Stream(data)),
+                           select=[("rows", 2)])
+    assert selected == {"rows": [obj["rows"][2]]}
+    try:
+        pickle.loads(data, select=["meta"], select_refs="copy")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("select_refs='copy' accepted")
+    print("  OK")
+
+def test_pickle_index():
+    print("\nTesting PickleIndex")
+    shared = ["shared", {"x": 1}]
+    obj = {"row%d" % i: {"id": i, "event": Event(i, "e%d" % i),
+                         "shared": shared if i % 10 == 0 else None}
+           for i in range(500)}
+    obj["blob"] = b"b" * 100000
+    obj[(1, 2)] = "tuple key"
+    rows = list(obj.values())
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        for root in (obj, rows):
+            f, index = io.BytesIO(), io.BytesIO()
+            pickle.Pickler(f, proto, index_file=index).dump(root)
+            assert f.getvalue() == pickle.dumps(root, proto)
+            f.seek(0)
+            index.seek(0)
+            with pickle.PickleIndex(f, index) as entries:
+                assert len(entries) == len(root)
+                if root is obj:
+                    assert entries.keys() == list(obj)
+                    assert entries["row490"] == obj["row490"]
+                    assert entries[(1, 2)] == "tuple key"
+                    assert entries["blob"] == obj["blob"]
+                    assert "row7" in entries and "row500" not in entries
+                    assert entries.get("row500", 0) == 0
+                    value = entries["row30"]
+                    assert value["shared"] == shared
+                else:
+                    assert entries[7] == rows[7] and entries[-1] == rows[-1]
+                    try:
+                        entries[len(rows)]
+                    except IndexError:
+                        pass
+                    else:
+                        raise AssertionError("item past the end loaded")
+
+    # dump_items() and a root referred to by its entries.
+    recursive = {"a": 1}
+    recursive["self"] = recursive
+    f, index = io.BytesIO(), io.BytesIO()
+    pickler = pickle.Pickler(f, 4, index_file=index)
+    pickler.dump_items(("k%d" % i, [i]) for i in range(2000))
+    pickler.clear_memo()
+    start = f.tell()
+    pickler.dump(recursive)
+    f.seek(0)
+    index.seek(0)
+    entries = pickle.PickleIndex(f, index)
+    assert len(entries) == 2000 and entries["k1999"] == [1999]
+    f.seek(start)
+    entries = pickle.PickleIndex(f, index)
+    value = entries["self"]
+    assert value["self"] is value and value["a"] == 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = tmp + "/shard.pkl"
+        with open(path, "wb") as f, open(path + ".idx", "wb") as index:
+            pickle.dump(obj, f, 5, index_file=index)
+        with open(path, "rb") as f, open(path + ".idx", "rb") as index:
+            with pickle.PickleIndex(f, index) as entries:
+                assert entries["row3"] == obj["row3"]
+
+    try:
+        pickle.dumps((1, 2), index_file=io.BytesIO())
+    except pickle.PicklingError:
+        pass
+    else:
+        raise AssertionError("tuple pickled with an index")
+    print("  OK")
+
+def test_lazy_load():
+    print("\nTesting lazy_size")
+    shared = {"kind": "shared"}
+    rows = [{"id": i, "tags": ["t%d" % (i % 5)] * 3, "shared": shared}
+            for i in range(300)]
+    # shared is pickled first, so loading the root does not build rows.
+    obj = {"meta": {"n": 300, "shared": shared}, "rows": rows,
+           "pair": (shared, [1, 2]), "blob": b"x" * 5000}
+    obj["again"] = rows
+    obj["self"] = obj
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        data = pickle.dumps(obj, proto)
+        value = pickle.loads(data, lazy_size=100)
+        assert isinstance(value, pickle.LazyDict)
+        assert not value.loaded and "not loaded" in repr(value)
+        assert value["blob"] == obj["blob"] and value.loaded
+        assert isinstance(value["rows"], pickle.LazyList)
+        assert not value["rows"].loaded
+        assert value["rows"][123]["tags"] == rows[123]["tags"]
+        assert value["again"] is value["rows"]
+        assert value["self"] is value
+        assert value["rows"][7]["shared"] is value["meta"]["shared"]
+        assert value["pair"][0] is value["rows"][0]["shared"]
+        assert value["rows"] == rows and value["meta"] == obj["meta"]
+        assert [row["id"] for row in value["rows"]] == list(range(300))
+        value["rows"].append("new")
+        assert value["again"][-1] == "new"
+        # Containers smaller than lazy_size load as usual.
+        small = pickle.loads(data, lazy_size=10 ** 9)
+        assert type(small) is dict and small["self"] is small
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = tmp + "/lazy.pkl"
+        with open(path, "wb") as f:
+            pickle.dump(obj, f, 5)
+            pickle.dump("next", f, 5)
+        with open(path, "rb") as f:
+            value = pickle.load(f, lazy_size=0)
+            assert pickle.load(f) == "next"
+            assert value["rows"][299]["id"] == 299
+
+    # Items too small to be proxies are loaded together, from one pickle
+    # for each dict or list of them, across its batches.
+    rows = [{"id": i, "name": "n%d" % i} for i in range(3000)]
+    table = {"n": 3000, "rows": rows, "index": {i: i for i in range(3000)}}
+    for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+        unpickler = pickle._Unpickler(io.BytesIO(pickle.dumps(table, proto)),
+                                      lazy_size=1000)
+        fragments = []
+        load_fragment = unpickler._load_fragment
+        unpickler._load_fragment = lambda data: (fragments.append(data) or
+                                                 load_fragment(data))
+        value = unpickler.load()
+        assert value["rows"][5] == rows[5] and value["rows"] == rows
+        assert value["index"] == table["index"] and value["n"] == 3000
+        assert len(fragments) == 2
+
+    # The buffer of an io.BytesIO stays exported until all proxies are
+    # built, from whichever thread uses them.
+    file = io.BytesIO(pickle.dumps(table, 5))
+    value = pickle.load(file, lazy_size=1000)
+    try:
+        file.write(b"more")
+    except BufferError:
+        pass
+    else:
+        raise AssertionError("buffer released before proxies were built")
+    threads = [threading.Thread(target=lambda: value["rows"][-1])
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert value["rows"].loaded and value["rows"] == rows
+    assert value["index"][7] == 7
+    file.write(b"more")
+
+    # Without tell() the pickle is loaded as usual.
+    value = pickle.Unpickler(StreamOnly(pickle.dumps(obj)),
+                             lazy_size=0).load()
+    assert type(value) is dict and value["self"] is value
+    try:
+        pickle.Unpickler(io.BytesIO(), lazy_size=-1)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("negative lazy_size accepted")
+    print("  OK")
+
 def main():
     cov = coverage.Coverage(source=["std_pickle"])
     cov.start()
 
     test_pickle_coverage()
+    test_collections_containers()
+    test_stdlib_value_types()
+    test_records()
+    test_callables()
+    test_load_dispatch()
+    test_unpickler_memo()
+    test_marks()
+    test_find_class()
+    test_build()
+    test_intern_table()
+    test_bytes_as_memoryview()
+    test_loads_data()
+    test_dumps_data()
+    test_data_plans()
+    test_register_layout()
+    test_prefetch_globals()
+    test_gc_mode()
+    test_dump_iter()
+    test_iter_load()
+    test_pickle_log()
+    test_scan()
+    test_load_select()
+    test_pickle_index()
+    test_lazy_load()
 
     tester = PurePythonPickleTester(pickle_path="./std_pickle/pickle.py")
     tester.test_unpickler_methods()
@@ -0,0 +1,77 @@
+"""Benchmark Unpickler.marker() on wide and nested pickles.
+
+Loads each payload with the vendored pure-Python Unpickler and with a
+subclass that finds marks the original way, by searching the stack,
+checks that both give the same result and prints the timings.
+
+    python bench_marker.py [repeat]
+"""
+import sys
+import importlib.machinery
+import timeit
+
+sys.modules['_pickle'] = None
+if 'pickle' in sys.modules:
+    del sys.modules['pickle']
+pickle = importlib.machinery.SourceFileLoader(
+    'pickle', './std_pickle/pickle.py').load_module()
+
+
+class ScanningUnpickler(pickle._Unpickler):
+    """Unpickler that searches the stack for the topmost mark."""
+
+    def marker(self):
+        stack = self.stack
+        mark = self.mark
+        k = len(stack)-1
+        while stack[k] is not mark: k = k-1
+        return k
+
+
+def nested(depth):
+    obj = []
+    for i in range(depth):
+        obj = (i, obj, str(i))
+    return obj
+
+
+PAYLOADS = [
+    # A single MARK with many values above it: tuples are never
+    # batched, and neither are dicts in protocol 0.
+    ("wide tuple", tuple(range(200000)), 1),
+    ("wide dict", dict((str(i), i) for i in range(50000)), 0),
+    # APPENDS and SETITEMS batches of 1000 items each.
+    ("wide list", list(range(200000)), 2),
+    ("many dicts", [dict(a=i, b=str(i), c=[i]) for i in range(20000)], 2),
+    # Marks nested inside marks.
+    ("nested tuples", [nested(3000) for i in range(5)], 1),
+    ("nested lists", [[[[i, [i]]]] for i in range(20000)], 1),
+]
+
+
+def load(unpickler_class, data):
+    return unpickler_class(pickle.io.BytesIO(data)).load()
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 20000))
+    print("%-14s %6s %10s %10s %8s" %
+          ("payload", "proto", "scan (s)", "index (s)", "speedup"))
+    for name, obj, proto in PAYLOADS:
+        data = pickle.dumps(obj, proto)
+        if (pickle.dumps(load(pickle._Unpickler, data), proto) !=
+                pickle.dumps(load(ScanningUnpickler, data), proto)):
+            raise AssertionError("results differ for %s" % name)
+        times = []
+        for cls in (ScanningUnpickler, pickle._Unpickler):
+            times.append(min(timeit.repeat(lambda: load(cls, data),
+                                           number=1, repeat=repeat)))
+        print("%-14s %6d %10.4f %10.4f %7.2fx" %
+              (name, proto, times[0], times[1], times[0] / times[1]))
+    sys.setrecursionlimit(limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -1029,6 +1029,7 @@ class _Unpickler:
         self.read = self._unframer.read
         self.readline = self._unframer.readline
         self.mark = object() # any new unique object
+        self.marks = []      # indices of the marks on the stack
         self.stack = []
         self.append = self.stack.append
         self.proto = 0
@@ -1044,17 +1045,24 @@ class _Unpickler:
         except _Stop as stopinst:
             return stopinst.value
 
-    # Return largest index k such that self.stack[k] is self.mark.
+    # Return largest index k such that self.stack[k] is self.mark, and
+    # forget it; every caller removes the mark from the stack.
     # If the stack doesn't contain a mark, eventually raises IndexError.
-    # This could be sped by maintaining another stack, of indices at which
-    # the mark appears.  For that matter, the latter stack would suffice,
-    # and we wouldn't need to push mark objects on self.stack at all.
-    # Doing so is probably a good thing, though, since if the pickle is
-    # corrupt (or hostile) we may get a clue from finding self.mark embedded
-    # in unpickled objects.
+    # Whenever the mark is pushed, its index is pushed on self.marks, so
+    # the topmost one is found without searching the stack.  We still
+    # push mark objects on self.stack, since if the pickle is corrupt (or
+    # hostile) we may get a clue from finding self.mark embedded in
+    # unpickled objects.  Such a pickle can also take a mark off the
+    # stack with an opcode other than the ones calling marker(); the
+    # index left behind is skipped once it no longer points at a mark.
     def marker(self):
         stack = self.stack
         mark = self.mark
+        marks = self.marks
+        while marks:
+            k = marks.pop()
+            if k < len(stack) and stack[k] is mark:
+                return k
         k = len(stack)-1
         while stack[k] is not mark: k = k-1
         return k
@@ -1403,6 +1411,8 @@ class _Unpickler:
     dispatch[REDUCE[0]] = load_reduce
 
     def load_pop(self):
+        if self.stack[-1] is self.mark:
+            self.marker()
         del self.stack[-1]
     dispatch[POP[0]] = load_pop
 
@@ -1411,23 +1421,30 @@ class _Unpickler:
         del self.stack[k:]
     dispatch[POP_MARK[0]] = load_pop_mark
 
+    # DUP and the GET opcodes can push a mark again (only for corrupt
+    # pickles); keep self.marks in step with the stack.
+    def _push_copy(self, value):
+        if value is self.mark:
+            self.marks.append(len(self.stack))
+        self.append(value)
+
     def load_dup(self):
-        self.append(self.stack[-1])
+        self._push_copy(self.stack[-1])
     dispatch[DUP[0]] = load_dup
 
     def load_get(self):
         i = int(self.readline()[:-1])
-        self.append(self.memo[i])
+        self._push_copy(self.memo[i])
     dispatch[GET[0]] = load_get
 
     def load_binget(self):
         i = self.read(1)[0]
-        self.append(self.memo[i])
+        self._push_copy(self.memo[i])
     dispatch[BINGET[0]] = load_binget
 
     def load_long_binget(self):
         i, = unpack('<I', self.read(4))
-        self.append(self.memo[i])
+        self._push_copy(self.memo[i])
     dispatch[LONG_BINGET[0]] = load_long_binget
 
     def load_put(self):
@@ -1534,6 +1551,7 @@ class _Unpickler:
     dispatch[BUILD[0]] = load_build
 
     def load_mark(self):
+        self.marks.append(len(self.stack))
         self.append(self.mark)
     dispatch[MARK[0]] = load_mark
 
@@ -0,0 +1,48 @@
+import os
+import sys
+import importlib.machinery
+
+
+# test.py loads a copy of pickle that is not in this tree; these tests
+# load the one in std_pickle.
+sys.modules['_pickle'] = None
+if 'pickle' in sys.modules:
+    del sys.modules['pickle']
+pickle = importlib.machinery.SourceFileLoader('pickle', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'std_pickle', 'pickle.py')).load_module()
+
+
+def test_marks():
+    # The opcodes that end at a mark, with marks pushed again by DUP and
+    # GET, or taken off the stack by POP, which the index of marks kept by
+    # the unpickler must follow.
+    print("\nTesting marks")
+    cases = {
+        b"(I1\nI2\nl.": [1, 2],
+        b"(S'a'\nI1\nd.": {"a": 1},
+        b"(I1\n(I2\ntt.": (1, (2,)),
+        b"]q\x00(K\x01K\x02e(K\x03e.": [1, 2, 3],
+        b"}(U\x01aK\x01U\x01bK\x02u.": {"a": 1, "b": 2},
+        b"(I1\n1I2\n.": 2,
+        b"(2I7\nt.": (7,),
+        b"(I1\n(2I7\nttt.": (1, ((7,),)),
+        b"(p0\nI1\ng0\nI2\nt.": (2,),
+        b"(q\x00K\x01h\x00K\x02tt.": (1, (2,)),
+        b"(0(I1\nt.": (1,),
+        b"((0I1\nt.": (1,),
+    }
+    for data, expected in cases.items():
+        result = pickle.loads(data)
+        assert result == expected, "{!r} gave {!r}".format(data, result)
+    for data in (b"I1\nt.", b"(0t."):
+        try:
+            pickle.loads(data)
+        except IndexError:
+            pass
+        else:
+            raise AssertionError("{!r} loaded".format(data))
+    print("  OK")
+
+
+if __name__ == "__main__":
+    test_marks()